@@ -5,76 +5,251 @@ This script continuously fetches sensor data from a ThingSpeak API endpoint
 and streams the data into an AWS Kinesis Data Stream. It adds a timestamp
 (`ec2_timestamp`) indicating when the data was fetched from the EC2 instance.
 
+Records are encoded with `pipeline_common.codec`: the compact binary layout
+by default, or JSON with `--encoding json`.
+
+In `batch` mode (the default) records are sent through `KinesisBatchProducer`,
+which packs them into concurrent `PutRecords` calls; `single` mode keeps the
+original one-`PutRecord`-per-entry behaviour. In batch mode entries are also
+aggregated, KPL style, into Kinesis records of up to `--aggregate-bytes`
+(0 sends one Kinesis record per entry); the Lambda de-aggregates them.
+With `--latency-slo-ms`, the batch size and age are tuned at runtime by a
+`pipeline_common.adaptive.LatencySLOController`: as large as the p95 time
+from `put` to an accepted PutRecords allows, and smaller again when a burst
+breaks the target.
+
+ThingSpeak is read through a pooled keep-alive session, and every poll only
+asks for the entries created since the last one it saw. `--backfill-start`
+instead replays a historical date range, fetched in concurrent pages under
+a request-rate limit, and exits when the range is done.
+
+Per-stage timings (fetch, encode, produce) and record counters are kept in
+`pipeline_common.metrics` instead of a log line per record; they are printed
+as a summary after every poll and, with `--metrics-port`, served as
+OpenMetrics text on /metrics.
+
+With `--clock-reference`, every entry also carries the EC2 host's
+skew-corrected clock stamp (`ec2_ref_us`, `ec2_error_us`; see
+`pipeline_common.clock`), so cross-host latencies can be corrected.
+
+With `--source synthetic` or `--source replay` the ThingSpeak poll is replaced
+by the shared open-loop load generator, which offers records at `--rate`
+events/sec following `--profile` (see `pipeline_common/load_generator.py`).
+
 """
 
-import requests
+import argparse
 import boto3
 import json
 import time
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional
+
+from kinesis_producer import KinesisBatchProducer, MAX_RECORDS_PER_CALL
+from pipeline_common.adaptive import Knob, LatencySLOController
+from pipeline_common.aggregation import DEFAULT_MAX_AGGREGATE_BYTES
+from pipeline_common.clock import ClockSync, add_clock_arguments, clock_from_args
+from pipeline_common.codec import ENCODINGS, encode
+from pipeline_common.dedupe import EntryIdFilter
+from pipeline_common.load_generator import add_load_arguments, run_from_args
+from pipeline_common.metrics import REGISTRY, SampledLog
+from pipeline_common.thingspeak import ThingSpeakFetcher, add_backfill_arguments, backfill_from_args
 
 # Configuration
-THINGSPEAK_URL = "https://api.thingspeak.com/channels/12397/feeds.json?results=100"
+THINGSPEAK_RESULTS = 100
 STREAM_NAME = "data-ingestion-kinesis"
 REGION_NAME = "us-east-1"
 FETCH_INTERVAL_SECONDS = 60
 kinesis_client = boto3.client("kinesis", region_name=REGION_NAME)
 
+# Each poll overlaps the previous one; only entries not sent before go out
+entry_filter = EntryIdFilter()
+
+# Stage timings and counters; see pipeline_common/metrics.py
+FETCH_SECONDS = REGISTRY.histogram("stage_seconds", stage="fetch")
+ENCODE_SECONDS = REGISTRY.histogram("stage_seconds", stage="encode")
+PRODUCE_SECONDS = REGISTRY.histogram("stage_seconds", stage="produce")
+# The same counters KinesisBatchProducer counts in, so both modes report alike
+RECORDS_SENT = REGISTRY.counter("kinesis_records", outcome="sent")
+RECORDS_FAILED = REGISTRY.counter("kinesis_records", outcome="failed")
+error_log = SampledLog(print, every=100)
 
-def fetch_thing_speak_feeds() -> List[Dict]:
+parser = argparse.ArgumentParser()
+parser.add_argument('--mode', dest='mode', choices=['batch', 'single'], default='batch', required=False)
+parser.add_argument('--max-batch-age-ms', dest='max_batch_age_ms', type=float, default=100.0, required=False)
+parser.add_argument('--max-in-flight', dest='max_in_flight', type=int, default=4, required=False)
+parser.add_argument('--aggregate-bytes', dest='aggregate_bytes', type=int, default=DEFAULT_MAX_AGGREGATE_BYTES,
+                    required=False, help='largest aggregated Kinesis record in batch mode (0: no aggregation)')
+parser.add_argument('--latency-slo-ms', dest='latency_slo_ms', type=float, default=0.0, required=False,
+                    help='tune batch size and age at runtime to keep the p95 put-to-ack latency under this '
+                         '(0: fixed batching)')
+parser.add_argument('--encoding', dest='encoding', choices=ENCODINGS, default='binary', required=False)
+parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=0, required=False,
+                    help='serve OpenMetrics text on this port (0: off)')
+add_load_arguments(parser)
+add_backfill_arguments(parser)
+add_clock_arguments(parser)
+
+
+def fetch_thing_speak_feeds(fetcher: ThingSpeakFetcher) -> List[Dict]:
     """
-    Fetches the latest sensor feeds from ThingSpeak API.
+    Fetches the sensor feeds added since the previous call from ThingSpeak API.
+
+    Args:
+        fetcher: Fetcher that remembers the last entry seen.
 
     Returns:
         List of feed entries as dictionaries. Empty list if error.
     """
     try:
-        response = requests.get(THINGSPEAK_URL, timeout=10)
-        response.raise_for_status()
-        feeds = response.json().get("feeds", [])
-        return feeds
+        with FETCH_SECONDS.time():
+            return fetcher.fetch_new()
     except Exception as e:
         print(f"[{datetime.now()}] Error fetching ThingSpeak data: {e}")
         return []
 
-def push_feeds_to_kinesis(feeds: List[Dict]) -> None:
+def stamp_entry(entry: Dict, clock: Optional[ClockSync] = None) -> None:
+    """
+    Adds the EC2 timestamp and, when a clock reference is synced, the
+    skew-corrected stamp.
+    """
+    entry["ec2_timestamp"] = datetime.utcnow().isoformat() + "Z"
+    if clock is not None:
+        clock.stamp(entry, "ec2_timestamp")
+
+def queue_entry(entry: Dict, producer: KinesisBatchProducer, encoding: str = "binary",
+                clock: Optional[ClockSync] = None) -> None:
+    """
+    Stamps a feed record and hands it to the batching producer.
+
+    Args:
+        entry: Sensor data dictionary.
+        producer: Batching producer that sends the record.
+        encoding: Payload encoding, see `pipeline_common.codec`.
+        clock: Clock reference sync for the corrected stamp.
+    """
+    stamp_entry(entry, clock)
+    start_ns = time.perf_counter_ns()
+    payload = encode(entry, encoding)
+    encoded_ns = time.perf_counter_ns()
+    ENCODE_SECONDS.record_us((encoded_ns - start_ns) // 1000)
+    producer.put(payload, str(entry.get("entry_id", "default")))
+    PRODUCE_SECONDS.observe_since(encoded_ns)
+
+def push_feeds_to_kinesis(feeds: List[Dict], producer: Optional[KinesisBatchProducer] = None,
+                          encoding: str = "binary", clock: Optional[ClockSync] = None) -> None:
     """
     Pushes each feed record to the AWS Kinesis Data Stream.
 
     Args:
         feeds: List of sensor data dictionaries.
+        producer: Batching producer to hand records to. When omitted, each
+            record is sent with its own `PutRecord` call.
+        encoding: Payload encoding, see `pipeline_common.codec`.
+        clock: Clock reference sync for the corrected stamp.
     """
+    if producer is not None:
+        for entry in feeds:
+            queue_entry(entry, producer, encoding, clock)
+        print(f"[{datetime.now()}] Queued {len(feeds)} entries for Kinesis")
+        return
+
     for entry in feeds:
         try:
             partition_key = str(entry.get("entry_id", "default"))
 
             # Add EC2 processing timestamp
-            entry["ec2_timestamp"] = datetime.utcnow().isoformat() + "Z"
+            stamp_entry(entry, clock)
+
+            with ENCODE_SECONDS.time():
+                payload = encode(entry, encoding)
 
             # Send the record to Kinesis
-            kinesis_client.put_record(
-                StreamName=STREAM_NAME,
-                Data=json.dumps(entry),
-                PartitionKey=partition_key
-            )
-            print(f"[{datetime.now()}] Successfully pushed to Kinesis: Entry ID {partition_key}")
+            with PRODUCE_SECONDS.time():
+                kinesis_client.put_record(
+                    StreamName=STREAM_NAME,
+                    Data=payload,
+                    PartitionKey=partition_key
+                )
+            RECORDS_SENT.inc()
 
         except Exception as e:
-            print(f"[{datetime.now()}] Error sending entry to Kinesis: {e}")
+            RECORDS_FAILED.inc()
+            # Python unbinds `e` when the except block ends, so the closure gets its own name
+            error = e
+            error_log(lambda: f"[{datetime.now()}] Error sending entry to Kinesis: {error} "
+                              f"({RECORDS_FAILED.value:g} failed so far)")
+
+def batching_controller(args) -> LatencySLOController:
+    """
+    Controller for the batch size and age of the producer, starting from the
+    configured age; a batch never waits longer than the SLO itself.
+    """
+    slo_ms = args.latency_slo_ms
+    knobs = {
+        "max_batch_records": Knob(MAX_RECORDS_PER_CALL, 10, MAX_RECORDS_PER_CALL, step=25, integer=True),
+        "max_batch_age_ms": Knob(min(args.max_batch_age_ms, slo_ms), min(1.0, slo_ms), slo_ms),
+    }
+    return LatencySLOController(knobs, target_seconds=slo_ms / 1000.0, name="kinesis")
+
 
 def main():
     """
     Main loop to fetch and push data continuously.
     """
-    print("Starting ThingSpeak to Kinesis ingestion service...")
-    while True:
-        feeds = fetch_thing_speak_feeds()
-        if feeds:
-            push_feeds_to_kinesis(feeds)
-        else:
-            print(f"[{datetime.now()}] No feeds to process.")
-        time.sleep(FETCH_INTERVAL_SECONDS)
+    args = parser.parse_args()
+    if args.metrics_port:
+        REGISTRY.serve(args.metrics_port)
+    clock = clock_from_args(args)
+    producer = None
+    if args.mode == "batch":
+        controller = batching_controller(args) if args.latency_slo_ms > 0 else None
+        producer = KinesisBatchProducer(kinesis_client, STREAM_NAME,
+                                        max_batch_age_ms=(controller.settings["max_batch_age_ms"]
+                                                          if controller else args.max_batch_age_ms),
+                                        max_in_flight=args.max_in_flight,
+                                        aggregate_bytes=args.aggregate_bytes or None,
+                                        on_sent=controller.observe if controller else None)
+        if controller is not None:
+            controller.on_change = lambda settings: producer.set_batching(**settings)
+
+    try:
+        if args.source != "thingspeak":
+            print(f"Starting {args.source} load generator to Kinesis ({args.mode} mode)...")
+            if producer is not None:
+                run_from_args(args, lambda entry: queue_entry(entry, producer, args.encoding, clock))
+            else:
+                run_from_args(args, lambda entry: push_feeds_to_kinesis([entry], encoding=args.encoding,
+                                                                        clock=clock))
+            print(f"[{datetime.now()}] {REGISTRY.summary()}")
+            return
+
+        fetcher = ThingSpeakFetcher(results=THINGSPEAK_RESULTS, requests_per_second=args.thingspeak_rate)
+        if args.backfill_start is not None:
+            print(f"Backfilling ThingSpeak history from {args.backfill_start} to Kinesis ({args.mode} mode)...")
+            total = 0
+            for feeds in backfill_from_args(fetcher, args):
+                push_feeds_to_kinesis(feeds, producer, args.encoding, clock)
+                total += len(feeds)
+            print(f"[{datetime.now()}] Backfill complete: {total} entries")
+            print(f"[{datetime.now()}] {REGISTRY.summary()}")
+            return
+
+        print(f"Starting ThingSpeak to Kinesis ingestion service ({args.mode} mode)...")
+        while True:
+            feeds = fetch_thing_speak_feeds(fetcher)
+            feeds = [entry for entry in feeds
+                     if entry_filter.accept(entry.get("entry_id"), lambda entry=entry: len(json.dumps(entry)))]
+            print(f"[{datetime.now()}] Duplicates so far: {entry_filter.stats}")
+            if feeds:
+                push_feeds_to_kinesis(feeds, producer, args.encoding, clock)
+            else:
+                print(f"[{datetime.now()}] No feeds to process.")
+            print(f"[{datetime.now()}] {REGISTRY.summary()}")
+            time.sleep(FETCH_INTERVAL_SECONDS)
+    finally:
+        if producer is not None:
+            producer.close()
 
 # Entry Point
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+"""
+Batched Kinesis Producer
+
+Packs records into `PutRecords` calls within the API limits (500 records and
+5 MiB per call, 1 MiB per record) and sends several batches concurrently from
+a bounded thread pool. Entries rejected in a `PutRecords` response are re-sent
+on their own with exponential backoff, so a partially failed call never
+duplicates the records that were accepted.
+
+A batch is dispatched as soon as it is full or, at the latest, once its oldest
+record has waited `max_batch_age_ms`, so batching never adds more than that
+much latency to a record.
+
+With `aggregate_bytes`, user records are first packed into KPL-format
+aggregated records of up to that size (`pipeline_common.aggregation`), so
+one Kinesis record carries many entries and the shard's records/sec limit no
+longer caps the event rate. A record too large for an aggregate of its own
+is sent as a plain Kinesis record. Counts of sent and failed records are
+always in user records.
+
+The batch size and age can be changed while the producer runs
+(`set_batching`), e.g. by a `pipeline_common.adaptive.LatencySLOController`
+fed through `on_sent`, the time each record took from `put` to being
+accepted.
+
+Call latency, record latency and record outcomes are recorded in
+`pipeline_common.metrics.REGISTRY`.
+
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pipeline_common.aggregation import RecordAggregator
+from pipeline_common.metrics import REGISTRY
+
+# PutRecords API limits
+MAX_RECORDS_PER_CALL = 500
+MAX_BYTES_PER_CALL = 5 * 1024 * 1024
+MAX_BYTES_PER_RECORD = 1024 * 1024
+
+
+class KinesisBatchProducer:
+    """
+    Buffers records and ships them to Kinesis with concurrent `PutRecords` calls.
+
+    Args:
+        client: boto3 Kinesis client.
+        stream_name: Name of the target Kinesis Data Stream.
+        max_batch_records: Maximum records per `PutRecords` call.
+        max_batch_bytes: Maximum payload bytes per `PutRecords` call.
+        max_batch_age_ms: Longest time a record may wait in the buffer.
+        max_in_flight: Maximum number of concurrent `PutRecords` calls.
+        max_attempts: Attempts per record before it is counted as failed.
+        base_backoff_seconds: Initial retry backoff, doubled on every attempt.
+        aggregate_bytes: Pack user records into aggregated records of up to
+            this many bytes; None sends one Kinesis record per user record.
+        on_sent: Called from the sender threads with (seconds since `put`,
+            user records) for every Kinesis record accepted.
+    """
+
+    def __init__(self, client, stream_name: str,
+                 max_batch_records: int = MAX_RECORDS_PER_CALL,
+                 max_batch_bytes: int = MAX_BYTES_PER_CALL,
+                 max_batch_age_ms: float = 100.0,
+                 max_in_flight: int = 4,
+                 max_attempts: int = 5,
+                 base_backoff_seconds: float = 0.1,
+                 aggregate_bytes: Optional[int] = None,
+                 on_sent: Optional[Callable[[float, int], None]] = None):
+        self.client = client
+        self.stream_name = stream_name
+        self.max_batch_records = min(max_batch_records, MAX_RECORDS_PER_CALL)
+        self.max_batch_bytes = min(max_batch_bytes, MAX_BYTES_PER_CALL)
+        self.max_batch_age = max_batch_age_ms / 1000.0
+        self.on_sent = on_sent
+        self.max_attempts = max_attempts
+        self.base_backoff_seconds = base_backoff_seconds
+
+        self.records_sent = 0
+        self.records_failed = 0
+        self.call_seconds = REGISTRY.histogram("stage_seconds", stage="put_records")
+        self.record_seconds = REGISTRY.histogram("stage_seconds", stage="put_to_ack")
+        self.sent_counter = REGISTRY.counter("kinesis_records", outcome="sent")
+        self.failed_counter = REGISTRY.counter("kinesis_records", outcome="failed")
+        self.put_counter = REGISTRY.counter("kinesis_put_records", outcome="sent")
+
+        self._lock = threading.Lock()
+        self._aggregator = (RecordAggregator(min(aggregate_bytes, MAX_BYTES_PER_RECORD))
+                            if aggregate_bytes else None)
+        self._aggregate_started = 0.0
+        # (PutRecords entry, number of user records it carries, monotonic
+        # time its first user record was put)
+        self._buffer: List[Tuple[Dict, int, float]] = []
+        self._buffer_bytes = 0
+        self._buffer_started = 0.0
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight,
+                                            thread_name_prefix="kinesis-put")
+        self._futures = set()
+        self._closed = threading.Event()
+        self._linger_thread = threading.Thread(target=self._linger_loop,
+                                               name="kinesis-linger", daemon=True)
+        self._linger_thread.start()
+
+    def put(self, data: bytes, partition_key: str) -> None:
+        """
+        Adds a record to the current batch, dispatching the batch when it is full.
+
+        Args:
+            data: Record payload.
+            partition_key: Kinesis partition key for the record.
+        """
+        size = len(data) + len(partition_key.encode("utf-8"))
+        if size > MAX_BYTES_PER_RECORD:
+            raise ValueError(f"Record of {size} bytes exceeds the Kinesis 1 MiB limit")
+
+        full_batches = []
+        with self._lock:
+            aggregator = self._aggregator
+            if aggregator is None:
+                self._append(partition_key, data, 1, time.monotonic(), full_batches)
+            elif aggregator.too_large(partition_key, data):
+                # Sent on its own, behind the records put before it
+                self._drain_aggregate(full_batches)
+                self._append(partition_key, data, 1, time.monotonic(), full_batches)
+            else:
+                if not aggregator.fits(partition_key, data):
+                    self._append(*aggregator.drain(), self._aggregate_started, full_batches)
+                if not len(aggregator):
+                    self._aggregate_started = time.monotonic()
+                aggregator.add(partition_key, data)
+
+        for batch in full_batches:
+            self._dispatch(batch)
+
+    def _append(self, partition_key: str, data: bytes, count: int, queued_at: float,
+                full_batches: List) -> None:
+        """Adds one Kinesis record to the batch; holds the lock."""
+        size = len(data) + len(partition_key.encode("utf-8"))
+        if self._buffer and self._buffer_bytes + size > self.max_batch_bytes:
+            full_batches.append(self._take_buffer())
+        if not self._buffer:
+            self._buffer_started = queued_at
+        self._buffer.append(({"Data": data, "PartitionKey": partition_key}, count, queued_at))
+        self._buffer_bytes += size
+        if len(self._buffer) >= self.max_batch_records:
+            full_batches.append(self._take_buffer())
+
+    def _drain_aggregate(self, full_batches: List) -> None:
+        """Closes the open aggregate into the batch; holds the lock."""
+        if self._aggregator is not None and len(self._aggregator):
+            self._append(*self._aggregator.drain(), self._aggregate_started, full_batches)
+
+    def set_batching(self, max_batch_records: Optional[int] = None,
+                     max_batch_age_ms: Optional[float] = None) -> None:
+        """
+        Changes the batch limits of the running producer; the next record
+        put or the next linger tick applies them to the open batch.
+
+        Args:
+            max_batch_records: Maximum records per `PutRecords` call.
+            max_batch_age_ms: Longest time a record may wait in the buffer.
+        """
+        with self._lock:
+            if max_batch_records is not None:
+                self.max_batch_records = min(max(int(max_batch_records), 1), MAX_RECORDS_PER_CALL)
+            if max_batch_age_ms is not None:
+                self.max_batch_age = max(max_batch_age_ms, 0.0) / 1000.0
+
+    def flush(self) -> None:
+        """
+        Sends the buffered records and waits for every in-flight call to finish.
+        """
+        batches = []
+        with self._lock:
+            self._drain_aggregate(batches)
+            batches.append(self._take_buffer())
+        for batch in batches:
+            if batch:
+                self._dispatch(batch)
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        """
+        Flushes outstanding records and stops the background threads.
+        """
+        self.flush()
+        self._closed.set()
+        self._linger_thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _take_buffer(self) -> List[Tuple[Dict, int, float]]:
+        batch, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        return batch
+
+    def _linger_loop(self) -> None:
+        # Wake up often enough to dispatch an aged batch within max_batch_age;
+        # re-read every tick, as set_batching may change it
+        while not self._closed.wait(max(self.max_batch_age / 4, 0.001)):
+            batches = []
+            with self._lock:
+                now = time.monotonic()
+                if (self._aggregator is not None and len(self._aggregator)
+                        and now - self._aggregate_started >= self.max_batch_age):
+                    self._drain_aggregate(batches)
+                if self._buffer and now - self._buffer_started >= self.max_batch_age:
+                    batches.append(self._take_buffer())
+            for batch in batches:
+                self._dispatch(batch)
+
+    def _dispatch(self, records: List[Tuple[Dict, int, float]]) -> None:
+        # Blocks the caller once max_in_flight calls are outstanding
+        self._in_flight.acquire()
+        future = self._executor.submit(self._send, records)
+        with self._lock:
+            self._futures.add(future)
+        # Outside the lock: an already finished future runs the callback right here
+        future.add_done_callback(self._forget)
+
+    def _forget(self, future) -> None:
+        with self._lock:
+            self._futures.discard(future)
+
+    def _send(self, records: List[Tuple[Dict, int, float]]) -> None:
+        try:
+            pending = records
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    time.sleep(random.uniform(0, self.base_backoff_seconds * (2 ** attempt)))
+                try:
+                    with self.call_seconds.time():
+                        response = self.client.put_records(StreamName=self.stream_name,
+                                                           Records=[entry[0] for entry in pending])
+                except Exception as e:
+                    print(f"[{datetime.now()}] Error calling PutRecords "
+                          f"({len(pending)} records, attempt {attempt + 1}): {e}")
+                    continue
+
+                # Only the entries carrying an ErrorCode need to be re-sent
+                failed = []
+                sent = 0
+                now = time.monotonic()
+                for entry, result in zip(pending, response["Records"]):
+                    if "ErrorCode" in result:
+                        failed.append(entry)
+                        continue
+                    _record, count, queued_at = entry
+                    sent += count
+                    self.record_seconds.record_us((now - queued_at) * 1_000_000, count)
+                    if self.on_sent is not None:
+                        self.on_sent(now - queued_at, count)
+                with self._lock:
+                    self.records_sent += sent
+                self.sent_counter.inc(sent)
+                self.put_counter.inc(len(pending) - len(failed))
+                pending = failed
+                if not pending:
+                    return
+
+            dropped = sum(count for _record, count, _queued in pending)
+            with self._lock:
+                self.records_failed += dropped
+            self.failed_counter.inc(dropped)
+            print(f"[{datetime.now()}] Dropped {dropped} records after "
+                  f"{self.max_attempts} PutRecords attempts")
+        finally:
+            self._in_flight.release()
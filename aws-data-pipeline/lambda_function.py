@@ -5,29 +5,204 @@ This Lambda function processes records from an AWS Kinesis Data Stream,
 remaps ThingSpeak-style fields to human-readable field names,
 adds timestamps, and inserts the cleaned data into a DynamoDB table.
 
+Records are written with BatchWriteItem, and only the ones that failed
+transiently are reported in `batchItemFailures`, so Kinesis retries just those.
+
 """
 
-import json
 import base64
-import boto3
-from datetime import datetime, timezone
+import os
+import random
+import time
 from decimal import Decimal
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+
+from pipeline_common.aggregation import deaggregate
+from pipeline_common.clock import ClockSync
+from pipeline_common.dedupe import TTLSeenSet
+from pipeline_common.metrics import SampledLog, emf_line
+from pipeline_common.normalize import normalize_batch
 
 # AWS DynamoDB Client Initialization
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('data-storage-dynamodb')
-
-field_mapping: Dict[str, str] = {
-    "field1": "wind_direction",
-    "field2": "wind_speed",
-    "field3": "humidity_percent",
-    "field4": "temperature_fahrenheit",
-    "field5": "rain_inches_per_minute",
-    "field6": "pressure_inhg",
-    "field7": "power_level_volts",
-    "field8": "light_intensity"
-}
+TABLE_NAME = os.environ.get('DYNAMODB_TABLE', 'data-storage-dynamodb')
+# Low-level client, created by the first write and kept for warm invocations
+dynamodb = None
+
+# BatchWriteItem accepts at most 25 put requests per call
+MAX_BATCH_WRITE_ITEMS = 25
+MAX_WRITE_ATTEMPTS = 5
+BASE_BACKOFF_SECONDS = 0.05
+# The request itself is invalid (e.g. an item over 400 KB); retrying cannot help
+PERMANENT_ERROR_CODES = frozenset({'ValidationException', 'SerializationException'})
+
+# Entry IDs already stored; kept across warm invocations of this environment
+written_entries = TTLSeenSet(capacity=100000, ttl_seconds=3600)
+
+# Offset from the clock reference; a frozen environment cannot run a sync
+# thread, so it is refreshed by the invocations themselves
+clock = ClockSync(os.environ['CLOCK_REFERENCE']) if os.environ.get('CLOCK_REFERENCE') else None
+
+METRICS_NAMESPACE = 'DataPipeline'
+error_log = SampledLog(print, every=100)
+
+
+def dynamodb_client():
+    """
+    Returns the DynamoDB client, creating it on first use.
+
+    Returns:
+        A low-level DynamoDB client, as `boto3.client('dynamodb')` would
+        build, without importing boto3.
+    """
+    global dynamodb
+    if dynamodb is None:
+        import botocore.session
+        dynamodb = botocore.session.get_session().create_client('dynamodb')
+    return dynamodb
+
+
+def to_attribute_values(item: Dict) -> Dict:
+    """
+    Serializes a normalized item for the low-level client.
+
+    Args:
+        item: Item with str, int, Decimal, bool or None values.
+
+    Returns:
+        dict: The item as DynamoDB attribute values.
+    """
+    attributes = {}
+    for name, value in item.items():
+        kind = value.__class__
+        if kind is str:
+            attributes[name] = {'S': value}
+        elif kind is bool:
+            attributes[name] = {'BOOL': value}
+        elif value is None:
+            attributes[name] = {'NULL': True}
+        else:
+            attributes[name] = {'N': str(value)}
+    return attributes
+
+
+def user_records(records: List[Dict]) -> Tuple[List[str], List[bytes], List[float], int]:
+    """
+    Expands aggregated Kinesis records into their user records.
+
+    Args:
+        records: The Kinesis event's `Records` list.
+
+    Returns:
+        tuple: Sequence number, payload and arrival time (epoch ms) of every
+        user record; inner records share their aggregate's sequence number.
+        Last, the number of malformed aggregates, which are left out.
+    """
+    sequence_numbers, payloads, arrivals = [], [], []
+    malformed = 0
+    for record in records:
+        kinesis = record['kinesis']
+        payload = base64.b64decode(kinesis['data'])
+        try:
+            inner = deaggregate(payload)
+        except ValueError as e:
+            # Permanent: retrying would only block the shard
+            error_log(lambda e=e: f"Skipping malformed aggregated record {kinesis['sequenceNumber']}: {e!r}")
+            malformed += 1
+            continue
+        arrival = kinesis['approximateArrivalTimestamp'] * 1000
+        for _partition_key, data in inner:
+            sequence_numbers.append(kinesis['sequenceNumber'])
+            payloads.append(data)
+            arrivals.append(arrival)
+    return sequence_numbers, payloads, arrivals, malformed
+
+
+def map_kinesis_records(payloads: List[bytes], arrivals: List[float]) -> Tuple[List[Optional[Dict]], Dict[int, Exception]]:
+    """
+    Decodes a batch of user records and normalizes them into DynamoDB items.
+
+    Args:
+        payloads: User record payloads.
+        arrivals: Kinesis arrival time of each, epoch ms.
+
+    Returns:
+        tuple: One item per record (None where decoding failed) and the
+        error for each failed record by index.
+    """
+    return normalize_batch(payloads, arrivals, 'kinesis_timestamp', 'lambda_timestamp', number=Decimal,
+                           clock=clock)
+
+
+def is_permanent(error: Exception) -> bool:
+    """Whether DynamoDB rejected the request itself rather than failing it transiently."""
+    return getattr(error, 'response', {}).get('Error', {}).get('Code') in PERMANENT_ERROR_CODES
+
+
+def put_items(client, items: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Writes items one at a time, to tell the items DynamoDB rejects from the rest.
+
+    Returns:
+        tuple: Items that failed transiently and items DynamoDB rejected.
+    """
+    failed, rejected = [], []
+    for item in items:
+        try:
+            client.put_item(TableName=TABLE_NAME, Item=to_attribute_values(item))
+        except Exception as e:
+            if is_permanent(e):
+                error_log(lambda e=e: f"Skipping entry {item['entry_id']} rejected by DynamoDB: {e}")
+                rejected.append(item)
+            else:
+                failed.append(item)
+    return failed, rejected
+
+
+def batch_write_items(items: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Writes items to DynamoDB in batches, retrying unprocessed items with backoff.
+
+    Args:
+        items: DynamoDB items, at most one per `entry_id`.
+
+    Returns:
+        tuple: Items that could not be written after all retry attempts, and
+        items DynamoDB rejected as invalid, which no retry can write.
+    """
+    client = dynamodb_client()
+    failed, rejected = [], []
+    for start in range(0, len(items), MAX_BATCH_WRITE_ITEMS):
+        pending = items[start:start + MAX_BATCH_WRITE_ITEMS]
+        # Unprocessed items come back serialized; map them back by entry_id
+        by_entry_id = {str(item['entry_id']): item for item in pending}
+
+        for attempt in range(MAX_WRITE_ATTEMPTS):
+            if attempt:
+                # Exponential backoff with full jitter before each retry
+                time.sleep(random.uniform(0, BASE_BACKOFF_SECONDS * (2 ** attempt)))
+            try:
+                response = client.batch_write_item(RequestItems={
+                    TABLE_NAME: [{'PutRequest': {'Item': to_attribute_values(item)}} for item in pending]
+                })
+            except Exception as e:
+                if is_permanent(e):
+                    # One invalid item fails the whole batch; find it and write the rest
+                    pending, invalid = put_items(client, pending)
+                    rejected.extend(invalid)
+                    if not pending:
+                        break
+                else:
+                    print(f"Error writing batch of {len(pending)} items (attempt {attempt + 1}): {e}")
+                continue
+
+            unprocessed = response.get('UnprocessedItems', {}).get(TABLE_NAME, [])
+            pending = [by_entry_id[request['PutRequest']['Item']['entry_id']['N']] for request in unprocessed]
+            if not pending:
+                break
+
+        failed.extend(pending)
+    return failed, rejected
+
 
 def lambda_handler(event, context):
     """
@@ -38,41 +213,75 @@ def lambda_handler(event, context):
         context: Runtime information.
 
     Returns:
-        dict: API Gateway compatible response indicating success.
+        dict: Partial batch response listing the sequence numbers to retry;
+        only transient failures are listed.
     """
-    for record in event['Records']:
-        try:
-            # Decode and parse the Kinesis record payload
-            payload = base64.b64decode(record['kinesis']['data']).decode('utf-8')
-            payload_dict = json.loads(payload, parse_float=Decimal)
+    # entry_id -> item; one item per entry_id keeps BatchWriteItem from
+    # rejecting duplicate keys in one request.
+    items: Dict = {}
+    sequence_numbers: Dict = {}
+    failures: List[str] = []
 
-            # Remap fields to user-friendly names
-            mapped_payload = {}
-            for original_field, mapped_field in field_mapping.items():
-                if original_field in payload_dict:
-                    mapped_payload[mapped_field] = payload_dict[original_field]
+    if clock is not None:
+        clock.maybe_sync()
+    start = time.perf_counter()
+    record_sequence_numbers, payloads, arrivals, skipped = user_records(event['Records'])
+    mapped_payloads, errors = map_kinesis_records(payloads, arrivals)
+    transformed = time.perf_counter()
+    duplicates_before = written_entries.stats.dropped
+    for i, (sequence_number, payload, mapped_payload) in enumerate(
+            zip(record_sequence_numbers, payloads, mapped_payloads)):
+        if mapped_payload is None:
+            # Permanent: retrying would only block the shard
+            error_log(lambda: f"Skipping undecodable record {sequence_number}: {errors[i]!r}")
+            skipped += 1
+            continue
+        entry_id = mapped_payload['entry_id']
 
-            # Copy non-sensor metadata if available
-            for key in ['entry_id', 'created_at']:
-                if key in payload_dict:
-                    mapped_payload[key] = payload_dict[key]
+        size_bytes = len(payload)
+        if entry_id in items:
+            # Same entry twice in one batch: write it once, retry both on failure
+            written_entries.stats.record(True, size_bytes)
+            sequence_numbers[entry_id].append(sequence_number)
+            continue
+        if written_entries.check(entry_id, size_bytes):
+            continue
 
-            # Add timestamps
-            mapped_payload['lambda_timestamp'] = datetime.utcnow().isoformat() + "Z"
-            mapped_payload['kinesis_timestamp'] = datetime.fromtimestamp(
-                record['kinesis']['approximateArrivalTimestamp'], timezone.utc
-            ).isoformat()
+        items[entry_id] = mapped_payload
+        sequence_numbers[entry_id] = [sequence_number]
 
-            # Write the record to DynamoDB
-            table.put_item(Item=mapped_payload)
+    write_started = time.perf_counter()
+    failed_items, rejected_items = batch_write_items(list(items.values()))
+    written = time.perf_counter()
+    for item in failed_items:
+        error_log(lambda: f"Error inserting entry {item['entry_id']} after {MAX_WRITE_ATTEMPTS} attempts")
+        failures.extend(sequence_numbers[item['entry_id']])
+        del items[item['entry_id']]
+    for item in rejected_items:
+        skipped += len(sequence_numbers[item['entry_id']])
+        del items[item['entry_id']]
 
-            print(f"Successfully inserted: {mapped_payload}")
+    # Only entries that reached DynamoDB count as seen, so retries still go through
+    for entry_id in items:
+        written_entries.add(entry_id)
 
-        except Exception as e:
-            print(f"Error processing record: {e}")
-            raise
+    lags = [item['lambda_timestamp'] - item['kinesis_timestamp'] for item in mapped_payloads if item]
+    print(emf_line(METRICS_NAMESPACE, {'Stage': 'lambda'}, {
+        'KinesisRecords': len(event['Records']),
+        'Records': len(payloads),
+        'Inserted': len(items),
+        'Duplicates': written_entries.stats.dropped - duplicates_before,
+        'Failed': len(failures),
+        'Skipped': skipped,
+        'TransformMs': (transformed - start) * 1000,
+        'WriteMs': (written - write_started) * 1000,
+        'MaxKinesisLagMs': max(lags, default=0),
+    }, units={'TransformMs': 'Milliseconds', 'WriteMs': 'Milliseconds',
+              'MaxKinesisLagMs': 'Milliseconds', 'KinesisRecords': 'Count', 'Records': 'Count',
+              'Inserted': 'Count',
+              'Duplicates': 'Count', 'Failed': 'Count', 'Skipped': 'Count'}))
 
+    # Several user records of one aggregate may fail; report it once
     return {
-        'statusCode': 200,
-        'body': 'Processed all records successfully.'
+        'batchItemFailures': [{'itemIdentifier': seq} for seq in dict.fromkeys(failures)]
     }
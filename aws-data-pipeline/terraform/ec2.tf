@@ -14,7 +14,7 @@ sudo pip3 install boto3 requests
 # Run data source script
 git clone https://github.com/SunilKuruba/aws-vs-gcp-data-pipeline.git
 cd  aws-vs-gcp-data-pipeline/aws-data-pipeline
-python3 data_source.py
+PYTHONPATH=.. python3 data_source.py
 
 EOF
   vpc_security_group_ids = [aws_security_group.allow_ssh_and_https.id]
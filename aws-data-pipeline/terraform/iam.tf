@@ -79,10 +79,18 @@ resource "aws_iam_role_policy" "lambda_policy" {
       {
         Effect = "Allow",
         Action = [
-          "dynamodb:PutItem"
+          "dynamodb:PutItem",
+          "dynamodb:BatchWriteItem"
         ],
         Resource = aws_dynamodb_table.data_storage.arn
       },
+      {
+        Effect = "Allow",
+        Action = [
+          "sqs:SendMessage"
+        ],
+        Resource = aws_sqs_queue.lambda_failures.arn
+      },
       {
         Effect = "Allow",
         Action = [
@@ -21,4 +21,26 @@ resource "aws_lambda_event_source_mapping" "kinesis_trigger" {
   starting_position = "LATEST"
   batch_size        = 100
   maximum_batching_window_in_seconds = 1
+
+  # Lambda returns batchItemFailures so only failed records are retried
+  function_response_types = ["ReportBatchItemFailures"]
+
+  # Give up on a record after a few retries or an hour, so a record that keeps
+  # failing cannot hold up its shard until it expires from the stream
+  maximum_retry_attempts         = 5
+  maximum_record_age_in_seconds  = 3600
+  bisect_batch_on_function_error = true
+
+  # Records given up on are described (shard, sequence numbers) in this queue
+  destination_config {
+    on_failure {
+      destination_arn = aws_sqs_queue.lambda_failures.arn
+    }
+  }
+}
+
+# On-failure destination of the Kinesis trigger
+resource "aws_sqs_queue" "lambda_failures" {
+  name                      = "data-processing-lambda-failures"
+  message_retention_seconds = 1209600
 }
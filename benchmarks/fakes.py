@@ -0,0 +1,285 @@
+"""
+In-process stand-ins for Kinesis, DynamoDB, Kafka and Bigtable
+
+Each fake implements just the client surface the pipeline code calls and
+accepts a per-call latency (in ms) that is slept on every request, so the
+benchmarks can model a remote service without an AWS or GCP account.
+
+"""
+
+import base64
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from pipeline_common.aggregation import RecordAggregator
+from pipeline_common.codec import encode
+from pipeline_common.thingspeak import synthetic_record
+
+
+def _sleep_ms(latency_ms: float) -> None:
+    if latency_ms > 0:
+        time.sleep(latency_ms / 1000.0)
+
+
+# ---------------------------------------------------------------------------
+# AWS
+# ---------------------------------------------------------------------------
+
+def kinesis_event(records: List[Dict], arrival_times: List[float], first_sequence: int = 0,
+                  encoding: str = "json", aggregate_bytes: int = 0) -> Dict:
+    """
+    Builds the Lambda event the Kinesis event source mapping would deliver.
+
+    With aggregate_bytes, consecutive records are packed into KPL aggregates;
+    each aggregate's sequence number is that of its first user record.
+    """
+    if aggregate_bytes:
+        event = {"Records": []}
+        aggregator = RecordAggregator(aggregate_bytes)
+        first = 0
+        for i, record in enumerate(records + [None]):
+            if record is not None:
+                key, data = str(record["entry_id"]), encode(record, encoding)
+                if aggregator.fits(key, data):
+                    aggregator.add(key, data)
+                    continue
+            key, payload, count = aggregator.drain()
+            event["Records"].append({"kinesis": {
+                "data": base64.b64encode(payload).decode("ascii"),
+                "partitionKey": key,
+                "sequenceNumber": str(first_sequence + first),
+                "approximateArrivalTimestamp": arrival_times[i - 1],
+            }, "eventSource": "aws:kinesis"})
+            first = i
+            if record is not None:
+                aggregator.add(str(record["entry_id"]), encode(record, encoding))
+        return event
+
+    return {"Records": [{
+        "kinesis": {
+            "data": base64.b64encode(encode(record, encoding)).decode("ascii"),
+            "partitionKey": str(record["entry_id"]),
+            "sequenceNumber": str(first_sequence + i),
+            "approximateArrivalTimestamp": arrival,
+        },
+        "eventSource": "aws:kinesis",
+    } for i, (record, arrival) in enumerate(zip(records, arrival_times))]}
+
+
+class FakeDynamoDB:
+    """
+    Mimics `batch_write_item` on the low-level DynamoDB client.
+
+    Args:
+        latency_ms: Time slept per call.
+        unprocessed_rate: Fraction of put requests returned as UnprocessedItems.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, unprocessed_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.unprocessed_rate = unprocessed_rate
+        self.calls = 0
+        self.items: Dict = {}
+
+    def batch_write_item(self, RequestItems):
+        self.calls += 1
+        _sleep_ms(self.latency_ms)
+        unprocessed = {}
+        for table_name, requests in RequestItems.items():
+            if len(requests) > 25:
+                raise ValueError("Too many items requested for the BatchWriteItem call")
+            for request in requests:
+                if random.random() < self.unprocessed_rate:
+                    unprocessed.setdefault(table_name, []).append(request)
+                else:
+                    item = request["PutRequest"]["Item"]
+                    self.items[item["entry_id"]["N"]] = item
+        return {"UnprocessedItems": unprocessed}
+
+
+# ---------------------------------------------------------------------------
+# Kafka
+# ---------------------------------------------------------------------------
+
+class FakeMessage:
+    def __init__(self, topic, partition, offset, value, timestamp_ms):
+        self._topic, self._partition, self._offset = topic, partition, offset
+        self._value, self._timestamp_ms = value, timestamp_ms
+
+    def error(self):
+        return None
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return None
+
+    def value(self):
+        return self._value
+
+    def timestamp(self):
+        return (1, self._timestamp_ms)
+
+
+class FakeBroker:
+    """
+    Holds pre-encoded message values per partition.
+
+    Messages are stamped with the wall-clock time at which a consumer fetches
+    them, as if they had just arrived at a live broker. One extra message at
+    offset `end` is handed out after the last real one so a reader bounded to
+    [start, end) sees its restriction finish.
+    """
+
+    def __init__(self, topic: str, partitions: int, messages_per_partition: int,
+                 latency_ms: float = 0.0, encoding: str = "json"):
+        self.topic = topic
+        self.latency_ms = latency_ms
+        created = datetime.now(timezone.utc)
+        self.partitions = {}
+        for p in range(partitions):
+            self.partitions[p] = [
+                encode(synthetic_record(p * messages_per_partition + i,
+                                        created + timedelta(seconds=i)), encoding)
+                for i in range(messages_per_partition)
+            ]
+        self.committed: Dict[int, int] = {}
+        self.lock = threading.Lock()
+
+    def end_offset(self, partition: int) -> int:
+        return len(self.partitions[partition])
+
+
+# Brokers are looked up by name so the DoFns that reference them stay picklable
+BROKERS: Dict[str, FakeBroker] = {}
+
+
+class _TopicMetadata:
+    def __init__(self, partitions):
+        self.partitions = {p: None for p in partitions}
+
+
+class _ClusterMetadata:
+    def __init__(self, topic, partitions):
+        self.topics = {topic: _TopicMetadata(partitions)}
+
+
+class FakeConsumer:
+    """The subset of confluent_kafka.Consumer used by the Beam pipeline."""
+
+    def __init__(self, broker_name: str):
+        self.broker = BROKERS[broker_name]
+        self.position = {}
+
+    def list_topics(self, topic=None, timeout=None):
+        return _ClusterMetadata(self.broker.topic, list(self.broker.partitions))
+
+    def committed(self, partitions, timeout=None):
+        from confluent_kafka import TopicPartition
+        return [TopicPartition(tp.topic, tp.partition, self.broker.committed.get(tp.partition, -1001))
+                for tp in partitions]
+
+    def get_watermark_offsets(self, partition, timeout=None):
+        return 0, self.broker.end_offset(partition.partition)
+
+    def assign(self, partitions):
+        self.position = {tp.partition: tp.offset for tp in partitions}
+
+    def consume(self, num_messages=1, timeout=-1):
+        _sleep_ms(self.broker.latency_ms)
+        now_ms = int(time.time() * 1000)
+        out = []
+        for partition, offset in self.position.items():
+            values = self.broker.partitions[partition]
+            end = len(values)
+            while offset <= end and len(out) < num_messages:
+                value = values[offset] if offset < end else b"{}"
+                out.append(FakeMessage(self.broker.topic, partition, offset, value, now_ms))
+                offset += 1
+            self.position[partition] = offset
+        return out
+
+    def poll(self, timeout=None):
+        messages = self.consume(1, timeout)
+        return messages[0] if messages else None
+
+    def commit(self, offsets=None, asynchronous=True):
+        with self.broker.lock:
+            for tp in offsets or []:
+                self.broker.committed[tp.partition] = max(tp.offset, self.broker.committed.get(tp.partition, 0))
+
+    def close(self):
+        pass
+
+
+class FakeTokenProvider:
+    def get_token(self, args):
+        return "token", time.time() + 3600
+
+
+# ---------------------------------------------------------------------------
+# Bigtable
+# ---------------------------------------------------------------------------
+
+class _Status:
+    def __init__(self, code):
+        self.code = code
+
+
+class FakeDirectRow:
+    def __init__(self, row_key):
+        self.row_key = row_key
+        self.cells = []
+
+    def set_cell(self, column_family_id, column, value, timestamp=None):
+        self.cells.append((column_family_id, column, value, timestamp))
+
+
+class FakeTable:
+    """
+    Mimics `direct_row` / `mutate_rows` on a Bigtable table.
+
+    Every stored row is kept with the wall-clock time of the call that wrote
+    it, so end-to-end latencies can be computed once the run has finished.
+
+    Args:
+        latency_ms: Time slept per `mutate_rows` call.
+        failure_rate: Fraction of row entries reported as failed (code 14).
+    """
+
+    def __init__(self, latency_ms: float = 0.0, failure_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.written = []
+        self.lock = threading.Lock()
+
+    def direct_row(self, row_key):
+        return FakeDirectRow(row_key)
+
+    def mutate_rows(self, rows):
+        _sleep_ms(self.latency_ms)
+        now = time.time()
+        statuses = []
+        with self.lock:
+            self.calls += 1
+            for row in rows:
+                if random.random() < self.failure_rate:
+                    statuses.append(_Status(14))
+                else:
+                    self.written.append((row, now))
+                    statuses.append(_Status(0))
+        return statuses
+
+
+TABLES: Dict[str, FakeTable] = {}
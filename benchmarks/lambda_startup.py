@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+lambda_startup.py  Cold-start benchmark for the Lambda
+
+Every run starts a fresh interpreter, as a new Lambda execution environment
+would, and measures:
+
+  import   `import lambda_function` (the init phase)
+  first    the first `lambda_handler` call, including DynamoDB client creation
+  warm     the second call, with everything already initialized
+  resource for reference: `boto3.resource('dynamodb').Table(...)`, the
+           resource-model init the handler used to pay at import
+
+DynamoDB is a local HTTP stub (AWS_ENDPOINT_URL_DYNAMODB), so the real boto3
+client is created and sends real requests, with no network or account.
+
+Usage:
+    python lambda_startup.py --runs 20 --batch-size 100
+"""
+
+import argparse, json, os, subprocess, sys, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+
+PERCENTILES = (50, 95, 99)
+
+# Runs inside the fresh interpreter; prints its timings (ms) as JSON
+CHILD = r"""
+import contextlib, io, json, sys, time
+from datetime import datetime, timezone
+
+t0 = time.perf_counter()
+import lambda_function
+imported = time.perf_counter()
+
+import fakes
+start = datetime.now(timezone.utc)
+batch_size = int(sys.argv[1])
+timings = {"import": (imported - t0) * 1000}
+for name, first_id in (("first", 0), ("warm", batch_size)):
+    feeds = [fakes.synthetic_record(first_id + i, start) for i in range(batch_size)]
+    event = fakes.kinesis_event(feeds, [start.timestamp()] * batch_size, first_id, "binary")
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = lambda_function.lambda_handler(event, None)
+    timings[name] = (time.perf_counter() - t0) * 1000
+    assert not response["batchItemFailures"], response
+
+t0 = time.perf_counter()
+import boto3
+boto3.resource("dynamodb").Table(lambda_function.TABLE_NAME)
+timings["resource"] = (time.perf_counter() - t0) * 1000
+print(json.dumps(timings))
+"""
+
+
+class StubDynamoDB(BaseHTTPRequestHandler):
+    """Accepts every BatchWriteItem with nothing unprocessed."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b'{"UnprocessedItems":{}}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-amz-json-1.0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_once(batch_size, endpoint):
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([os.path.join(ROOT, "aws-data-pipeline"), ROOT, HERE]),
+               AWS_ENDPOINT_URL_DYNAMODB=endpoint, AWS_DEFAULT_REGION="us-east-1",
+               AWS_ACCESS_KEY_ID="bench", AWS_SECRET_ACCESS_KEY="bench",
+               DYNAMODB_TABLE="bench-table")
+    env.pop("AWS_PROFILE", None)
+    output = subprocess.run([sys.executable, "-c", CHILD, str(batch_size)], env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lambda cold-start benchmark")
+    parser.add_argument("--runs", type=int, default=20, help="fresh interpreters to start")
+    parser.add_argument("--batch-size", type=int, default=100, help="records per invocation")
+    parser.add_argument("--json", dest="json_path", help="also write the raw timings as JSON")
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubDynamoDB)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+
+    runs = [run_once(args.batch_size, endpoint) for _ in range(args.runs)]
+    server.shutdown()
+
+    for stage in ("import", "first", "warm", "resource"):
+        values = np.array([run[stage] for run in runs])
+        pct = np.percentile(values, PERCENTILES)
+        print(f"{stage:<9} " + "  ".join(f"p{p}={v:7.1f}ms" for p, v in zip(PERCENTILES, pct)))
+    cold = np.array([run["import"] + run["first"] for run in runs])
+    print(f"{'cold':<9} " + "  ".join(f"p{p}={v:7.1f}ms" for p, v in zip(PERCENTILES, np.percentile(cold, PERCENTILES)))
+          + "   (import + first invocation)")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(runs, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+run_benchmarks.py  Offline end-to-end benchmarks for both pipelines
+
+  aws  drives lambda_function.lambda_handler with synthetic Kinesis batches
+       against an in-process DynamoDB
+  gcp  runs ReadKafkaMessages -> WriteToBigtable -> CommitKafkaOffsets on the
+       Beam DirectRunner against an in-process Kafka broker and Bigtable table
+
+For every (batch size, load level) cell of the grid it reports records/sec,
+CPU time per record and record latency percentiles.
+
+AWS latency is modelled from the offered load: a record waits until its batch
+is closed (full, or 1 s after its first record, as in the event source
+mapping) and then for the measured handler duration. GCP latency is measured
+from the moment the fake broker hands a message to the consumer until the
+Bigtable flush that stored it, i.e. the time spent inside the pipeline.
+
+Usage:
+    python run_benchmarks.py aws --batch-sizes 10 100 500 --loads 100 1000 10000
+    python run_benchmarks.py gcp --batch-sizes 50 500 --loads 1000 10000 --json out.json
+"""
+
+import argparse, contextlib, io, json, os, sys, time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "aws-data-pipeline"))
+sys.path.insert(0, os.path.join(HERE, "..", "gcp-data-pipeline"))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+import fakes
+
+PERCENTILES = (50, 95, 99)
+BATCHING_WINDOW_SECONDS = 1.0
+
+
+def _summary(pipeline, batch_size, load, records, wall, cpu, latencies_ms):
+    pct = np.percentile(latencies_ms, PERCENTILES) if len(latencies_ms) else [np.nan] * 3
+    result = {
+        "pipeline": pipeline, "batch_size": batch_size, "load": load, "records": records,
+        "records_per_sec": records / wall if wall else float("inf"),
+        "cpu_us_per_record": cpu / records * 1e6 if records else float("nan"),
+    }
+    result.update({f"p{p}_ms": float(v) for p, v in zip(PERCENTILES, pct)})
+    return result
+
+
+def bench_aws(batch_size, load, records, latency_ms, unprocessed_rate, encoding="json", aggregate_bytes=0):
+    """
+    One grid cell for the Lambda. `load` is the offered rate in events/sec;
+    `batch_size` counts user records, packed into aggregates of up to
+    `aggregate_bytes` when it is set.
+    """
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    import lambda_function
+
+    fake = fakes.FakeDynamoDB(latency_ms=latency_ms, unprocessed_rate=unprocessed_rate)
+    lambda_function.dynamodb = fake
+    # Every cell reuses the same entry IDs; start each with nothing seen
+    lambda_function.written_entries = lambda_function.TTLSeenSet()
+
+    start = datetime.now(timezone.utc)
+    arrivals = np.arange(records) / float(load)
+    feeds = [fakes.synthetic_record(i, start + timedelta(seconds=float(a)))
+             for i, a in enumerate(arrivals)]
+
+    latencies = []
+    wall = cpu = 0.0
+    i = 0
+    while i < records:
+        # The event source mapping closes a batch when it is full or its window expires
+        end = min(i + batch_size, records)
+        window_end = arrivals[i] + BATCHING_WINDOW_SECONDS
+        end = min(end, int(np.searchsorted(arrivals, window_end, side="right")))
+        end = max(end, i + 1)
+        closed_at = arrivals[end - 1] if end - i == batch_size else window_end
+
+        event = fakes.kinesis_event(feeds[i:end], (start.timestamp() + arrivals[i:end]).tolist(), i, encoding,
+                                    aggregate_bytes)
+        t0, c0 = time.perf_counter(), time.process_time()
+        # The handler's CloudWatch log lines would drown the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = lambda_function.lambda_handler(event, None)
+        duration = time.perf_counter() - t0
+        wall += duration
+        cpu += time.process_time() - c0
+
+        failed = {f["itemIdentifier"] for f in response["batchItemFailures"]}
+        latencies.extend((closed_at - arrivals[i:end] + duration) * 1000.0)
+        if failed:
+            # Retried records start again from the first failure, as Lambda does
+            i = min(int(s) for s in failed)
+        else:
+            i = end
+
+    return _summary("aws", batch_size, load, records, wall, cpu, latencies)
+
+
+def bench_gcp(batch_size, load, partitions, latency_ms, failure_rate, encoding="json"):
+    """
+    One grid cell for the Beam pipeline. `load` is the number of messages
+    preloaded per partition.
+    """
+    import apache_beam as beam
+    from apache_beam.io.restriction_trackers import OffsetRange
+    from apache_beam.options.pipeline_options import PipelineOptions
+    import beam_processing as bp
+
+    name = f"bench-{batch_size}-{load}"
+    broker = fakes.FakeBroker("iot-data", partitions, load, latency_ms=latency_ms, encoding=encoding)
+    fakes.BROKERS[name] = broker
+    fakes.TABLES[name] = fakes.FakeTable(latency_ms=latency_ms, failure_rate=failure_rate)
+
+    class BenchReadKafkaMessages(bp.ReadKafkaMessages):
+        def setup(self):
+            super().setup()
+            self.Consumer = lambda conf: fakes.FakeConsumer(name)
+
+        def initial_restriction(self, element):
+            # Bounded to the preloaded messages so the pipeline terminates
+            return OffsetRange(0, fakes.BROKERS[name].end_offset(element[1]))
+
+    class BenchWriteToBigtable(bp.WriteToBigtable):
+        def open_table(self):
+            return fakes.TABLES[name]
+
+    class BenchCommitKafkaOffsets(bp.CommitKafkaOffsets):
+        def setup(self):
+            from confluent_kafka import TopicPartition
+            self.TopicPartition = TopicPartition
+            self.consumer = fakes.FakeConsumer(name)
+            self.logger = bp.logging.getLogger(__name__)
+            self.pending, self.committed = {}, {}
+            self.last_commit = time.monotonic()
+
+    t0, c0 = time.perf_counter(), time.process_time()
+    with beam.Pipeline(options=PipelineOptions(["--runner=DirectRunner"])) as pipeline:
+        (pipeline
+         | "Partitions" >> beam.Create([("iot-data", p) for p in range(partitions)])
+         | "ReadFromKafka" >> beam.ParDo(BenchReadKafkaMessages(
+             "fake:9092", "iot-data", "bench", fakes.FakeTokenProvider,
+             max_batch_messages=batch_size))
+         | "WriteToBigtable" >> beam.ParDo(BenchWriteToBigtable(
+             "project", "instance", "table", max_batch_rows=batch_size))
+         | "CommitOffsets" >> beam.ParDo(BenchCommitKafkaOffsets(
+             "fake:9092", "iot-data", "bench", fakes.FakeTokenProvider)))
+    wall, cpu = time.perf_counter() - t0, time.process_time() - c0
+
+    table = fakes.TABLES.pop(name)
+    fakes.BROKERS.pop(name)
+    latencies = []
+    for row, written_at in table.written:
+        message = json.loads(row.cells[0][2])
+        latencies.append(written_at * 1000.0 - message["kafka_timestamp"])
+
+    return _summary("gcp", batch_size, load, len(table.written), wall, cpu, latencies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmarks")
+    parser.add_argument("pipeline", choices=["aws", "gcp"])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--loads", type=int, nargs="+", default=[100, 1000, 10000],
+                        help="aws: offered events/sec; gcp: messages per partition")
+    parser.add_argument("--records", type=int, default=5000, help="aws: records per grid cell")
+    parser.add_argument("--partitions", type=int, default=2, help="gcp: Kafka partitions")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="per-call service latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="fraction of writes the fake store rejects")
+    parser.add_argument("--encoding", choices=["json", "binary"], default="json",
+                        help="payload encoding of the produced records")
+    parser.add_argument("--aggregate-bytes", type=int, default=0,
+                        help="aws: pack records into KPL aggregates of up to this size")
+    parser.add_argument("--json", dest="json_path", help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    for batch_size in args.batch_sizes:
+        for load in args.loads:
+            if args.pipeline == "aws":
+                result = bench_aws(batch_size, load, args.records, args.latency_ms, args.failure_rate,
+                                   args.encoding, args.aggregate_bytes)
+            else:
+                result = bench_gcp(batch_size, load, args.partitions, args.latency_ms, args.failure_rate,
+                                   args.encoding)
+            results.append(result)
+            print(f"{result['pipeline']}  batch={batch_size:<6} load={load:<7} "
+                  f"records={result['records']:<7} {result['records_per_sec']:>10.0f} rec/s  "
+                  f"cpu={result['cpu_us_per_record']:>7.1f} us/rec  "
+                  + "  ".join(f"p{p}={result[f'p{p}_ms']:.1f}ms" for p in PERCENTILES))
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
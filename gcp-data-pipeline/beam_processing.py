@@ -3,10 +3,24 @@ from apache_beam.options.pipeline_options import PipelineOptions, StandardOption
 import uuid
 import logging
 from tokenprovider import TokenProvider
+from bigtable_query import SALT_BUCKETS, row_key as make_row_key
+from pipeline_common.adaptive import Knob, LatencySLOController
+from pipeline_common.clock import ClockSync, add_clock_arguments
+from pipeline_common.dedupe import TTLSeenSet
+from pipeline_common.metrics import SampledLog
+from pipeline_common.normalize import normalize_batch
+from pipeline_common.thingspeak import FIELD_MAPPING, parse_created_at
 from google.cloud import bigtable
 from google.cloud.bigtable import row
-from apache_beam.utils.timestamp import MAX_TIMESTAMP, MIN_TIMESTAMP
-import time, json, argparse
+from apache_beam.io.restriction_trackers import OffsetRange, OffsetRestrictionTracker
+from apache_beam.io.watermark_estimators import ManualWatermarkEstimator
+from apache_beam.metrics import Metrics
+from apache_beam.transforms.core import RestrictionProvider
+from apache_beam.transforms.trigger import AccumulationMode, AfterCount, AfterWatermark
+from apache_beam.transforms.window import FixedWindows
+from apache_beam.utils.windowed_value import WindowedValue
+from apache_beam.utils.timestamp import MAX_TIMESTAMP, MIN_TIMESTAMP, Duration, Timestamp
+import sys, time, json, math, argparse
 from datetime import datetime, timezone
 
 parser = argparse.ArgumentParser()
@@ -17,21 +31,22 @@ parser.add_argument('-n', '--num_messages', dest='num_messages', type=int, defau
 parser.add_argument('-project_id', '--project_id', dest='project_id', type=str, default='cool-continuity-457614-b2', required=False)
 parser.add_argument('-instance_id','--instance_id',  dest='instance_id', type=str, default='iot-data-store', required=False)
 parser.add_argument('-table_id', '--table_id',  dest='table_id', type=str, default='weather-info', required=False)
-args = parser.parse_args()
-
-# For processing the records
-field_mapping =  {
-    "field1": "wind_direction",
-    "field2": "wind_speed",
-    "field3": "humidity_percent",
-    "field4": "temperature_fahrenheit",
-    "field5": "rain_inches_per_minute",
-    "field6": "pressure_inhg",
-    "field7": "power_level_volts",
-    "field8": "light_intensity"
-}
-
-def run():
+parser.add_argument('--log-every', dest='log_every', type=int, default=1000, required=False,
+                    help='log one received message in this many at DEBUG level')
+# Per-window sensor rollups
+parser.add_argument('--window-seconds', dest='window_seconds', type=int, default=60, required=False)
+parser.add_argument('--allowed-lateness-seconds', dest='allowed_lateness_seconds', type=int, default=3600, required=False)
+# Watermark bound for idle partitions (see ReadKafkaMessages)
+parser.add_argument('--idle-watermark-seconds', dest='idle_watermark_seconds', type=int, default=60, required=False)
+parser.add_argument('--rollup-column-family', dest='rollup_column_family', type=str, default='rollup', required=False)
+# p95 Kafka-to-Beam latency target for the consume batching (0: fixed)
+parser.add_argument('--latency-slo-ms', dest='latency_slo_ms', type=float, default=0.0, required=False)
+add_clock_arguments(parser)
+
+def run(argv=None):
+    # Unrecognised arguments are passed through as Beam pipeline options
+    args, pipeline_args = parser.parse_known_args(argv)
+
     # Group ID for consuming from kafka
     group_id = "beam-test-group"
     print(f"Using consumer group ID: {group_id}")
@@ -39,7 +54,7 @@ def run():
     token_provider = TokenProvider()
     
     # Set up pipeline options
-    options = PipelineOptions()
+    options = PipelineOptions(pipeline_args)
     std_options = options.view_as(StandardOptions)
     std_options.streaming = True
     
@@ -47,131 +62,694 @@ def run():
     with beam.Pipeline(options=options) as pipeline:
         messages = (
             pipeline
-            | 'Create' >> beam.Create([1])
+            | 'Topic' >> beam.Create([args.topic_name])
+            | 'DiscoverPartitions' >> beam.ParDo(DiscoverKafkaPartitions(
+                bootstrap_servers=args.bootstrap,
+                token_provider_class=TokenProvider
+            ))
+            # Spread the partitions so each worker reads its own share
+            | 'DistributePartitions' >> beam.Reshuffle()
             | 'ReadFromKafka' >> beam.ParDo(ReadKafkaMessages(
                 bootstrap_servers=args.bootstrap,
                 topic=args.topic_name,
                 group_id=group_id,
-                token_provider_class=TokenProvider
+                token_provider_class=TokenProvider,
+                latency_slo_ms=args.latency_slo_ms or None,
+                clock_reference=args.clock_reference,
+                idle_watermark_seconds=args.idle_watermark_seconds,
+                allowed_lateness_seconds=args.allowed_lateness_seconds
             ))
-            | 'LogMessages' >> beam.Map(
-                lambda msg: (print(f"Received message: {msg}") or msg)
-            )
+            | 'LogMessages' >> beam.Map(log_sampled, SampledLog(logging.getLogger(__name__).debug, args.log_every))
+        )
+
+        (
+            messages
             | 'WriteToBigtable' >> beam.ParDo(WriteToBigtable(
                 project_id=args.project_id,
                 instance_id=args.instance_id,
                 table_id=args.table_id
             ))
+            | 'CommitOffsets' >> beam.ParDo(CommitKafkaOffsets(
+                bootstrap_servers=args.bootstrap,
+                topic=args.topic_name,
+                group_id=group_id,
+                token_provider_class=TokenProvider
+            ))
         )
 
-# Custom DoFn for Kafka reading
-class ReadKafkaMessages(beam.DoFn):
-    def __init__(self, bootstrap_servers, topic, group_id, token_provider_class):
+        # Fires when the watermark passes the window end, then again for each late record
+        (
+            messages
+            | 'Records' >> beam.Values()
+            | 'FixedWindows' >> beam.WindowInto(
+                FixedWindows(args.window_seconds),
+                trigger=AfterWatermark(late=AfterCount(1)),
+                accumulation_mode=AccumulationMode.ACCUMULATING,
+                allowed_lateness=Duration(seconds=args.allowed_lateness_seconds))
+            | 'SensorRollups' >> beam.CombineGlobally(SensorRollupFn()).without_defaults()
+            | 'WriteRollupsToBigtable' >> beam.ParDo(WriteRollupsToBigtable(
+                project_id=args.project_id,
+                instance_id=args.instance_id,
+                table_id=args.table_id,
+                column_family=args.rollup_column_family
+            ))
+        )
+
+def log_sampled(msg, sampled_log):
+    sampled_log(lambda: f"Received message: {msg}")
+    return msg
+
+def kafka_config(bootstrap_servers, token_provider, group_id=None):
+    """Client configuration shared by every Kafka consumer in the pipeline."""
+    conf = {
+        'bootstrap.servers': bootstrap_servers,
+        'security.protocol': 'SASL_SSL',
+        'sasl.mechanism': 'OAUTHBEARER',
+        'oauth_cb': token_provider.get_token,
+    }
+    if group_id is not None:
+        conf.update({
+            'group.id': group_id,
+            'auto.offset.reset': 'earliest',
+            'enable.auto.commit': False,
+        })
+    return conf
+
+
+class DiscoverKafkaPartitions(beam.DoFn):
+    """Expands a topic name into one (topic, partition) element per partition."""
+    def __init__(self, bootstrap_servers, token_provider_class):
+        self.bootstrap_servers = bootstrap_servers
+        self.token_provider_class = token_provider_class
+
+    def process(self, topic):
+        from confluent_kafka import Consumer
+
+        consumer = Consumer(kafka_config(self.bootstrap_servers, self.token_provider_class()))
+        try:
+            metadata = consumer.list_topics(topic, timeout=30)
+            partitions = sorted(metadata.topics[topic].partitions)
+        finally:
+            consumer.close()
+
+        logging.getLogger(__name__).info(f"Reading {len(partitions)} partitions of topic {topic}")
+        for partition in partitions:
+            yield (topic, partition)
+
+
+# Custom splittable DoFn for Kafka reading: one unbounded restriction per partition
+class ReadKafkaMessages(beam.DoFn, RestrictionProvider):
+    """
+    Reads a single Kafka partition per element as an unbounded offset range.
+
+    Progress is checkpointed through the OffsetRestrictionTracker, so the runner
+    can resume a partition on any worker; the watermark follows the event
+    times. When a poll returns nothing and the partition is read up to its
+    high-watermark offset, the watermark moves to idle_watermark_seconds
+    before wall time, so a quiet partition (or one that never had data) does
+    not hold back the rollup windows of the others. While unread backlog
+    remains it moves at most idle_watermark_seconds past the partition's
+    newest event time, so records still to be read are not already beyond
+    the allowed lateness of the rollup windows. Records that are anyway are
+    counted in kafka/records_beyond_allowed_lateness.
+
+    Messages are fetched in batches of up to max_batch_messages. Offsets are
+    not committed here: each record is emitted as ((partition, offset),
+    record), and CommitKafkaOffsets commits the offsets once WriteToBigtable
+    has stored the rows.
+
+    With latency_slo_ms, a LatencySLOController on each worker tunes the batch
+    size (up to 4x max_batch_messages) and the poll timeout (up to
+    poll_timeout_seconds) against the p95 Kafka-to-Beam latency.
+
+    With clock_reference, each worker keeps its clock offset from the
+    reference in sync and stamps every record with it (beam_ref_us,
+    beam_error_us), so latencies against the producer's stamp are corrected
+    for clock skew.
+    """
+    def __init__(self, bootstrap_servers, topic, group_id, token_provider_class,
+                 poll_timeout_seconds=1.0, resume_delay_seconds=1.0, max_batch_messages=500,
+                 latency_slo_ms=None, clock_reference=None, idle_watermark_seconds=60,
+                 allowed_lateness_seconds=None):
         self.bootstrap_servers = bootstrap_servers
         self.topic = topic
         self.group_id = group_id
         self.token_provider_class = token_provider_class
+        self.poll_timeout_seconds = poll_timeout_seconds
+        self.resume_delay_seconds = resume_delay_seconds
+        self.max_batch_messages = max_batch_messages
+        self.latency_slo_ms = latency_slo_ms
+        self.clock_reference = clock_reference
+        self.idle_watermark_seconds = idle_watermark_seconds
+        self.allowed_lateness_seconds = allowed_lateness_seconds
     
     def setup(self):
         # Importing here to avoid serialization issues
-        from confluent_kafka import Consumer, KafkaError
-        
-        # Create token provider inside setup
-        self.token_provider = self.token_provider_class()
+        from confluent_kafka import Consumer, KafkaError, KafkaException, TopicPartition
+        self.Consumer = Consumer
+        self.KafkaError = KafkaError
+        self.KafkaException = KafkaException
+        self.TopicPartition = TopicPartition
         
-        # Configure Kafka consumer
-        self.conf = {
-            'bootstrap.servers': self.bootstrap_servers,
-            'group.id': self.group_id,
-            'auto.offset.reset': 'earliest',
-            'enable.auto.commit': False,
-            'security.protocol': 'SASL_SSL',
-            'sasl.mechanism': 'OAUTHBEARER',
-            'oauth_cb': self.token_provider.get_token,
-        }
+        self.conf = self._consumer_conf()
         
-        # Create consumer
-        self.consumer = Consumer(self.conf)
-        self.consumer.subscribe([self.topic])
+        # One consumer per partition, with the next offset it will return
+        self.consumers = {}
         
         # Set up logging
         self.logger = logging.getLogger(__name__)
-        self.logger.info(f"Kafka consumer set up for topic: {self.topic}")
-    
-    def process(self, element):
+        self.logger.info(f"Kafka reader set up for topic: {self.topic}")
+
+        # Beam metrics, aggregated by the runner across workers
+        self.records_read = Metrics.counter('kafka', 'records_read')
+        self.records_skipped = Metrics.counter('kafka', 'records_undecodable')
+        self.transform_us = Metrics.distribution('stage', 'decode_transform_us_per_batch')
+        self.kafka_to_beam_ms = Metrics.distribution('stage', 'kafka_to_beam_ms')
+        # Behind this partition's watermark by more than the allowed lateness,
+        # so the rollup windows most likely drop them (the raw rows are kept)
+        self.records_late = Metrics.counter('kafka', 'records_beyond_allowed_lateness')
+
+        # partition -> newest event time read by this worker
+        self.last_event_times = {}
+
+        self.clock = ClockSync(self.clock_reference).start() if self.clock_reference else None
+
+        self.controller = None
+        if self.latency_slo_ms:
+            self.batch_messages_gauge = Metrics.gauge('adaptive', 'max_batch_messages')
+            self.poll_timeout_ms_gauge = Metrics.gauge('adaptive', 'poll_timeout_ms')
+            knobs = {
+                'max_batch_messages': Knob(self.max_batch_messages, 10, 4 * self.max_batch_messages, integer=True),
+                'poll_timeout_seconds': Knob(self.poll_timeout_seconds, min(0.01, self.poll_timeout_seconds),
+                                             self.poll_timeout_seconds),
+            }
+            self.controller = LatencySLOController(knobs, target_seconds=self.latency_slo_ms / 1000.0,
+                                                   name='kafka_reader', on_change=self._apply_batching)
+
+    def _consumer_conf(self):
+        # Configure Kafka consumer; partitions are assigned explicitly, the
+        # group is only used to look up and store committed offsets
+        if getattr(self, 'conf', None) is None:
+            # Create token provider on the worker, not at pipeline construction
+            self.token_provider = self.token_provider_class()
+            self.conf = kafka_config(self.bootstrap_servers, self.token_provider, self.group_id)
+        return self.conf
+
+    def _apply_batching(self, settings):
+        self.max_batch_messages = settings['max_batch_messages']
+        self.poll_timeout_seconds = settings['poll_timeout_seconds']
+        self.batch_messages_gauge.set(self.max_batch_messages)
+        self.poll_timeout_ms_gauge.set(int(self.poll_timeout_seconds * 1000))
+        self.logger.info(f"Kafka batching: {self.max_batch_messages} messages, "
+                         f"{self.poll_timeout_seconds * 1000:.0f} ms poll timeout")
+
+    # RestrictionProvider methods
+    def initial_restriction(self, element):
+        # May run before setup(); needs a consumer, none of the reader's threads
+        from confluent_kafka import Consumer, TopicPartition
+        topic, partition = element
+
+        consumer = Consumer(self._consumer_conf())
         try:
-            while True:
-                msg = self.consumer.poll(timeout=25.0)
-                print(msg)
+            tp = TopicPartition(topic, partition)
+            committed = consumer.committed([tp], timeout=30)[0].offset
+            if committed >= 0:
+                start = committed
+            else:
+                # No committed offset for the group: honour auto.offset.reset=earliest
+                start, _high = consumer.get_watermark_offsets(tp, timeout=30)
+        finally:
+            consumer.close()
+        return OffsetRange(start, sys.maxsize)
 
-                if msg is None:
-                    self.logger.info("No message received, continuing...")
-                    break
-                
+    def create_tracker(self, restriction):
+        return OffsetRestrictionTracker(restriction)
+
+    def restriction_size(self, element, restriction):
+        return restriction.size()
+
+    def _consumer_for(self, topic, partition, offset):
+        consumer, next_offset = self.consumers.get((topic, partition), (None, None))
+        if consumer is None:
+            consumer = self.Consumer(self.conf)
+        if next_offset != offset:
+            consumer.assign([self.TopicPartition(topic, partition, offset)])
+        # Position is unknown until process() returns cleanly
+        self.consumers[(topic, partition)] = (consumer, None)
+        return consumer
+
+    @beam.DoFn.unbounded_per_element()
+    def process(self, element,
+                tracker=beam.DoFn.RestrictionParam(),
+                watermark_estimator=beam.DoFn.WatermarkEstimatorParam(
+                    ManualWatermarkEstimator.default_provider())):
+        topic, partition = element
+        offset = tracker.current_restriction().start
+        consumer = self._consumer_for(topic, partition, offset)
+
+        while True:
+            messages = consumer.consume(num_messages=self.max_batch_messages,
+                                        timeout=self.poll_timeout_seconds)
+
+            if not messages:
+                # Partition is idle: let the watermark move on and checkpoint
+                self._idle_watermark(consumer, topic, partition, offset, watermark_estimator)
+                self.consumers[(topic, partition)] = (consumer, offset)
+                tracker.defer_remainder(Duration.of(self.resume_delay_seconds))
+                return
+
+            claimed = []
+            exhausted = False
+            for msg in messages:
                 if msg.error():
-                    if msg.error().code() == KafkaError._PARTITION_EOF:
+                    if msg.error().code() == self.KafkaError._PARTITION_EOF:
                         self.logger.info(f"Reached end of partition: {msg.topic()}/{msg.partition()}")
                     else:
                         self.logger.error(f"Error: {msg.error()}")
-                else:
-                    # Process the message
-                    key = msg.key().decode('utf-8') if msg.key() else None
-                    value = msg.value().decode('utf-8')
-                    formatted_data =  self.process_helper(json.loads(value), msg.timestamp()[1])
-                    
-                    self.consumer.commit(asynchronous=False)
-
-                    yield formatted_data
-        except Exception as e:
-            self.logger.error(f"Error processing Kafka messages: {e}")
-
-    def process_helper(self, records, kafka_timestamp_ms):
-        formatted_data = {} 
-
-        for (field, value) in records.items():
-            key = field_mapping.get(field, field)
-            formatted_data[key] = value
-        
-        # adding kafka and beam time stamps
-        formatted_data['kafka_timestamp'] = kafka_timestamp_ms
-        formatted_data['beam_timestamp'] = int(time.time_ns())//1_000_000
+                    continue
+
+                if not tracker.try_claim(msg.offset()):
+                    exhausted = True
+                    break
+                offset = msg.offset() + 1
+                claimed.append(msg)
+
+            yield from self.process_helper(claimed, partition, watermark_estimator)
+            if exhausted:
+                self.consumers[(topic, partition)] = (consumer, None)
+                return
+
+    @staticmethod
+    def event_time(record, kafka_timestamp_ms):
+        """When the reading was taken (created_at), else when Kafka received it."""
+        created_at = record.get('created_at')
+        if created_at:
+            try:
+                return Timestamp.of(parse_created_at(created_at).timestamp())
+            except ValueError:
+                pass
+        return Timestamp.of(kafka_timestamp_ms / 1000.0)
+
+    @staticmethod
+    def _advance_watermark(watermark_estimator, timestamp):
+        # Kafka timestamps are not strictly ordered; never move the watermark back
+        current = watermark_estimator.current_watermark()
+        if current is None or timestamp > current:
+            watermark_estimator.set_watermark(timestamp)
+
+    def _caught_up(self, consumer, topic, partition, offset):
+        """Whether nothing is left to read before the partition's high-watermark offset."""
+        try:
+            _low, high = consumer.get_watermark_offsets(self.TopicPartition(topic, partition),
+                                                        timeout=self.poll_timeout_seconds, cached=False)
+        except self.KafkaException as e:
+            self.logger.warning(f"Could not fetch the high-watermark offset of {topic}/{partition}: {e}")
+            return False
+        return offset >= high
 
-        return formatted_data
+    def _idle_watermark(self, consumer, topic, partition, offset, watermark_estimator):
+        now = Timestamp.now()
+        bound = Duration(seconds=self.idle_watermark_seconds)
+        if self._caught_up(consumer, topic, partition, offset):
+            # Whatever is written next is stamped about now
+            self._advance_watermark(watermark_estimator, now - bound)
+            return
+
+        # Backlog remains: a partition resumed on this worker starts from its restored watermark
+        last = self.last_event_times.get(partition)
+        if last is None:
+            last = watermark_estimator.current_watermark()
+        if last is None:
+            # Nothing read yet to bound it by; the backlog sets it once read
+            return
+        self._advance_watermark(watermark_estimator, min(last + bound, now))
+
+    def process_helper(self, messages, partition, watermark_estimator):
+        if not messages:
+            return
+        # One call normalizes the whole batch, exactly as the Lambda does
+        start_ns = time.perf_counter_ns()
+        kafka_timestamps_ms = [msg.timestamp()[1] for msg in messages]
+        records, errors = normalize_batch([msg.value() for msg in messages], kafka_timestamps_ms,
+                                          'kafka_timestamp', 'beam_timestamp', clock=self.clock)
+        self.transform_us.update((time.perf_counter_ns() - start_ns) // 1000)
+        self.records_read.inc(len(messages))
+
+        for msg, kafka_timestamp_ms, formatted_data in zip(messages, kafka_timestamps_ms, records):
+            if formatted_data is None:
+                continue
+            kafka_to_beam_ms = formatted_data['beam_timestamp'] - kafka_timestamp_ms
+            self.kafka_to_beam_ms.update(kafka_to_beam_ms)
+            if self.controller is not None:
+                self.controller.observe(kafka_to_beam_ms / 1000.0)
+
+            event_time = self.event_time(formatted_data, kafka_timestamp_ms)
+            watermark = watermark_estimator.current_watermark()
+            if (self.allowed_lateness_seconds is not None and watermark is not None
+                    and event_time < watermark - Duration(seconds=self.allowed_lateness_seconds)):
+                self.records_late.inc()
+            if event_time > self.last_event_times.get(partition, MIN_TIMESTAMP):
+                self.last_event_times[partition] = event_time
+            self._advance_watermark(watermark_estimator, event_time)
+            yield beam.window.TimestampedValue(((partition, msg.offset()), formatted_data), event_time)
+
+        self.records_skipped.inc(len(errors))
+        for i, error in errors.items():
+            self.logger.error(f"Skipping undecodable message {partition}/{messages[i].offset()}: {error!r}")
     
     def teardown(self):
-        if hasattr(self, 'consumer'):
-            self.consumer.close()
-            self.logger.info("Kafka consumer closed")
+        if getattr(self, 'clock', None) is not None:
+            self.clock.stop()
+        for consumer, _offset in getattr(self, 'consumers', {}).values():
+            consumer.close()
+        if getattr(self, 'consumers', None):
+            self.logger.info("Kafka consumers closed")
 
 
 class WriteToBigtable(beam.DoFn):
-    def __init__(self, project_id, instance_id, table_id, column_family='cf1'):
+    """
+    Buffers Bigtable mutations across a bundle and sends them with mutate_rows.
+
+    The buffer is flushed when it reaches max_batch_rows or max_batch_bytes,
+    when its oldest row is older than max_batch_age_seconds, and at the end of
+    every bundle. Row entries that fail inside a flush are retried on their own
+    with backoff; if any still fail, the bundle fails so Beam retries it.
+
+    Takes ((partition, offset), record) elements from ReadKafkaMessages and
+    stores the record alone. After each successful flush it emits
+    (partition, next_offset) for the Kafka records stored, so offsets are only
+    committed once their rows are written.
+
+    Rows are keyed salt#event-time#entry_id (see bigtable_query.py), so
+    bigtable_query.query_range can read any time window without a full scan.
+    Entry IDs already written (or waiting in the buffer) are dropped, counted
+    in the `dedupe` Beam metrics.
+    """
+    def __init__(self, project_id, instance_id, table_id, column_family='cf1',
+                 max_batch_rows=500, max_batch_bytes=4 * 1024 * 1024,
+                 max_batch_age_seconds=1.0, max_attempts=5,
+                 dedupe_capacity=100000, dedupe_ttl_seconds=3600, salt_buckets=SALT_BUCKETS):
         self.project_id = project_id
         self.instance_id = instance_id
         self.table_id = table_id
         self.column_family = column_family
+        self.max_batch_rows = max_batch_rows
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_age_seconds = max_batch_age_seconds
+        self.max_attempts = max_attempts
+        self.dedupe_capacity = dedupe_capacity
+        self.dedupe_ttl_seconds = dedupe_ttl_seconds
+        self.salt_buckets = salt_buckets
 
     def setup(self):
+        self.table    = self.open_table()
+        self.logger   = logging.getLogger(__name__)
+        # Entry IDs already stored by this worker
+        self.written  = TTLSeenSet(self.dedupe_capacity, self.dedupe_ttl_seconds)
+        self.duplicates_dropped = Metrics.counter('dedupe', 'records_dropped')
+        self.duplicate_bytes_saved = Metrics.counter('dedupe', 'bytes_saved')
+        self.rows_written = Metrics.counter('bigtable', 'rows_written')
+        self.flush_us = Metrics.distribution('stage', 'sink_write_us_per_flush')
+        self.flush_rows = Metrics.distribution('bigtable', 'rows_per_flush')
+
+    def open_table(self):
         self.client   = bigtable.Client(project=self.project_id, admin=True)
         self.instance = self.client.instance(self.instance_id)
-        self.table    = self.instance.table(self.table_id)
+        return self.instance.table(self.table_id)
 
-    def process(self, element, timestamp=beam.DoFn.TimestampParam):
+    def start_bundle(self):
+        self.rows = []
+        self.batch_bytes = 0
+        self.batch_started = None
+        # partition -> highest Kafka offset in the current buffer
+        self.batch_offsets = {}
+        self.batch_entry_ids = set()
+        self.last_timestamp = None
+        self.last_window = None
+
+    def process(self, element, timestamp=beam.DoFn.TimestampParam, window=beam.DoFn.WindowParam):
         if timestamp in (MAX_TIMESTAMP, MIN_TIMESTAMP):
             event_dt = datetime.utcnow().replace(tzinfo=timezone.utc)
         else:
             event_dt = timestamp.to_utc_datetime()   
-        row_key = uuid.uuid4().bytes
-        bt_row  = self.table.direct_row(row_key)
-
-        bt_row.set_cell(
-            self.column_family,
-            b"message",
-            json.dumps(element).encode(),
-            timestamp=event_dt # Datatime
-        )
-        bt_row.commit()
+        (partition, offset), record = element
+        entry_id = record.get('entry_id')
+        value = json.dumps(record).encode()
+
+        if entry_id is not None and (entry_id in self.batch_entry_ids or entry_id in self.written):
+            self.duplicates_dropped.inc()
+            self.duplicate_bytes_saved.inc(len(value))
+        else:
+            # Derived from the entry alone, so a copy that slips through overwrites the same row
+            row_key = make_row_key(entry_id if entry_id is not None else uuid.uuid4().hex,
+                                   event_dt.replace(tzinfo=timezone.utc).timestamp() * 1000,
+                                   self.salt_buckets)
+            bt_row  = self.table.direct_row(row_key)
+
+            bt_row.set_cell(
+                self.column_family,
+                b"message",
+                value,
+                timestamp=event_dt # Datatime
+            )
+
+            if not self.rows:
+                self.batch_started = time.monotonic()
+            self.rows.append(bt_row)
+            self.batch_bytes += len(row_key) + len(value)
+            if entry_id is not None:
+                self.batch_entry_ids.add(entry_id)
+
+        # A dropped duplicate is done as soon as the copy before it is stored
+        self.batch_offsets[partition] = max(offset, self.batch_offsets.get(partition, -1))
+        self.last_timestamp, self.last_window = timestamp, window
+
+        if self.rows and (len(self.rows) >= self.max_batch_rows
+                          or self.batch_bytes >= self.max_batch_bytes
+                          or time.monotonic() - self.batch_started >= self.max_batch_age_seconds):
+            yield from self.flush()
+
+    def finish_bundle(self):
+        for committable in self.flush():
+            yield WindowedValue(committable, self.last_timestamp, [self.last_window])
+
+    def flush(self):
+        """Writes the buffered rows and returns the (partition, next_offset) now safe to commit."""
+        rows, self.rows, self.batch_bytes = self.rows, [], 0
+        offsets, self.batch_offsets = self.batch_offsets, {}
+        entry_ids, self.batch_entry_ids = self.batch_entry_ids, set()
+        written = len(rows)
+        start = time.monotonic()
+        for attempt in range(self.max_attempts):
+            if not rows:
+                break
+            if attempt:
+                # Exponential backoff before retrying the failed entries only
+                time.sleep(min(0.1 * (2 ** attempt), 5.0))
+            statuses = self.table.mutate_rows(rows)
+            rows = [bt_row for bt_row, status in zip(rows, statuses) if status.code != 0]
+            if rows:
+                self.logger.warning(f"{len(rows)} Bigtable row mutations failed (attempt {attempt + 1})")
+
+        if rows:
+            raise RuntimeError(f"{len(rows)} Bigtable row mutations failed after {self.max_attempts} attempts")
+
+        if written:
+            self.flush_us.update(int((time.monotonic() - start) * 1_000_000))
+            self.flush_rows.update(written)
+            self.rows_written.inc(written)
+        for entry_id in entry_ids:
+            self.written.add(entry_id)
+        return [(partition, offset + 1) for partition, offset in offsets.items()]
+
+
+class SensorRollupFn(beam.CombineFn):
+    """
+    Per sensor field: count, min, max, mean and an approximate p95.
+
+    The p95 comes from a log-bucketed sketch (every value within
+    RELATIVE_ACCURACY of its bucket's midpoint), so accumulators stay small
+    and merge by adding bucket counts however many records a window holds.
+    """
+    RELATIVE_ACCURACY = 0.01
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    LOG_GAMMA = math.log(GAMMA)
+    FIELDS = tuple(FIELD_MAPPING.values())
+
+    def create_accumulator(self):
+        # field -> [count, min, max, sum, {bucket: count}]
+        return {}
+
+    def add_input(self, accumulator, record):
+        for field in self.FIELDS:
+            value = record.get(field)
+            if value is None:
+                continue
+            value = float(value)
+            stats = accumulator.get(field)
+            if stats is None:
+                accumulator[field] = [1, value, value, value, {self.bucket(value): 1}]
+                continue
+            stats[0] += 1
+            if value < stats[1]:
+                stats[1] = value
+            if value > stats[2]:
+                stats[2] = value
+            stats[3] += value
+            key = self.bucket(value)
+            stats[4][key] = stats[4].get(key, 0) + 1
+        return accumulator
+
+    def merge_accumulators(self, accumulators):
+        merged = {}
+        for accumulator in accumulators:
+            for field, (count, low, high, total, buckets) in accumulator.items():
+                stats = merged.get(field)
+                if stats is None:
+                    merged[field] = [count, low, high, total, dict(buckets)]
+                    continue
+                stats[0] += count
+                stats[1] = min(stats[1], low)
+                stats[2] = max(stats[2], high)
+                stats[3] += total
+                for key, n in buckets.items():
+                    stats[4][key] = stats[4].get(key, 0) + n
+        return merged
+
+    def extract_output(self, accumulator):
+        return {field: {'count': count, 'min': low, 'max': high, 'mean': total / count,
+                        'p95': self.quantile(buckets, count, 0.95, low, high)}
+                for field, (count, low, high, total, buckets) in accumulator.items()}
+
+    @classmethod
+    def bucket(cls, value):
+        if value == 0:
+            return 0
+        index = math.ceil(math.log(abs(value)) / cls.LOG_GAMMA)
+        # Offset keeps the positive and negative halves apart; the sign orders them
+        return int(math.copysign(index + 1_000_000, value))
+
+    @classmethod
+    def bucket_value(cls, key):
+        if key == 0:
+            return 0.0
+        index = abs(key) - 1_000_000
+        return math.copysign(2 * cls.GAMMA ** index / (cls.GAMMA + 1), key)
 
+    @classmethod
+    def quantile(cls, buckets, count, q, low, high):
+        rank = q * (count - 1)
+        seen = 0
+        for key in sorted(buckets, key=cls.bucket_value):
+            seen += buckets[key]
+            if seen > rank:
+                # Clamp to the exact extremes, which the sketch can overshoot
+                return min(max(cls.bucket_value(key), low), high)
+        return high
+
+
+class WriteRollupsToBigtable(beam.DoFn):
+    """
+    Writes one row per window, keyed rollup#<window start, UTC>, with one JSON
+    cell per sensor field in the rollup column family. Late firings rewrite
+    the same row with the updated accumulation.
+    """
+    def __init__(self, project_id, instance_id, table_id, column_family='rollup', max_attempts=5):
+        self.project_id = project_id
+        self.instance_id = instance_id
+        self.table_id = table_id
+        self.column_family = column_family
+        self.max_attempts = max_attempts
+
+    def setup(self):
+        self.table = self.open_table()
+        self.logger = logging.getLogger(__name__)
+
+    def open_table(self):
+        self.client = bigtable.Client(project=self.project_id, admin=True)
+        return self.client.instance(self.instance_id).table(self.table_id)
+
+    def start_bundle(self):
+        self.rows = []
+
+    def process(self, rollup, window=beam.DoFn.WindowParam):
+        window_start = window.start.to_utc_datetime()
+        bt_row = self.table.direct_row(f"rollup#{window_start:%Y-%m-%dT%H:%M:%S}".encode())
+        cell_time = window.end.to_utc_datetime()
+        window_seconds = (window.end - window.start).micros // 1_000_000
+        bt_row.set_cell(self.column_family, b"window_seconds",
+                        str(window_seconds).encode(), timestamp=cell_time)
+        for field, stats in rollup.items():
+            bt_row.set_cell(self.column_family, field.encode(), json.dumps(stats).encode(),
+                            timestamp=cell_time)
+        self.rows.append(bt_row)
+
+    def finish_bundle(self):
+        rows = self.rows
+        for attempt in range(self.max_attempts):
+            if not rows:
+                return
+            if attempt:
+                time.sleep(min(0.1 * (2 ** attempt), 5.0))
+            statuses = self.table.mutate_rows(rows)
+            rows = [bt_row for bt_row, status in zip(rows, statuses) if status.code != 0]
+        if rows:
+            raise RuntimeError(f"{len(rows)} rollup rows failed after {self.max_attempts} attempts")
+
+
+class CommitKafkaOffsets(beam.DoFn):
+    """
+    Commits Kafka offsets asynchronously once their records are in Bigtable.
+
+    Receives (partition, next_offset) pairs from WriteToBigtable, keeps the
+    highest per partition and commits them at most every commit_interval_seconds
+    and at the end of each bundle. A commit that lands out of order can only
+    move an offset backwards, which means re-reading records, never losing them.
+    """
+    def __init__(self, bootstrap_servers, topic, group_id, token_provider_class,
+                 commit_interval_seconds=5.0):
+        self.bootstrap_servers = bootstrap_servers
+        self.topic = topic
+        self.group_id = group_id
+        self.token_provider_class = token_provider_class
+        self.commit_interval_seconds = commit_interval_seconds
+
+    def setup(self):
+        from confluent_kafka import Consumer, TopicPartition
+        self.TopicPartition = TopicPartition
+        self.token_provider = self.token_provider_class()
+        self.consumer = Consumer(kafka_config(self.bootstrap_servers, self.token_provider, self.group_id))
+        self.logger = logging.getLogger(__name__)
+        self.pending = {}
+        self.committed = {}
+        self.last_commit = time.monotonic()
+
+    def process(self, element):
+        partition, next_offset = element
+        if next_offset > max(self.pending.get(partition, -1), self.committed.get(partition, -1)):
+            self.pending[partition] = next_offset
+        if time.monotonic() - self.last_commit >= self.commit_interval_seconds:
+            self.commit()
+
+    def finish_bundle(self):
+        self.commit()
+
+    def commit(self):
+        self.last_commit = time.monotonic()
+        # Serve callbacks of earlier asynchronous commits
+        self.consumer.poll(0)
+        if not self.pending:
+            return
+        offsets = [self.TopicPartition(self.topic, partition, offset)
+                   for partition, offset in self.pending.items()]
+        self.consumer.commit(offsets=offsets, asynchronous=True)
+        self.committed.update(self.pending)
+        self.pending = {}
+
+    def teardown(self):
+        if hasattr(self, 'consumer'):
+            self.commit()
+            self.consumer.close()
 
 if __name__ == "__main__":
     run()
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+Bigtable row keys and time-range queries for the raw readings
+
+Raw rows are keyed  <salt>#<event time, epoch ms>#<entry_id>
+
+    salt        entry_id % salt_buckets, two digits; spreads consecutive
+                writes over salt_buckets tablets instead of one hot tablet
+    event time  13-digit epoch ms of created_at, so rows sort by time
+                within each salt bucket
+    entry_id    zero-padded; keeps re-sent copies of an entry on one row
+
+Salt, time and entry_id are all derived from the entry itself, so writing
+the same entry twice always hits the same row. Rollup rows (`rollup#...`)
+sort after every salt bucket and are never touched by a raw range scan.
+
+A time-range query runs one range scan per salt bucket in parallel and
+merges the buckets back into one time-ordered stream.
+
+Usage (writes an export that plots/analytics.py reads like GCP_result.csv):
+    python bigtable_query.py --start 2025-05-06T20:00:00Z --end 2025-05-06T21:00:00Z --out window.csv
+"""
+
+import argparse
+import csv
+import heapq
+import json
+import logging
+import queue
+import threading
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Tuple
+
+SALT_BUCKETS = 8
+TIME_DIGITS = 13
+ENTRY_ID_DIGITS = 12
+
+# Rows each bucket may read ahead of the merge
+READ_AHEAD_ROWS = 1000
+
+_DONE = object()
+
+
+def salt_for(entry_id, salt_buckets: int = SALT_BUCKETS) -> int:
+    if isinstance(entry_id, int):
+        return entry_id % salt_buckets
+    return zlib.crc32(str(entry_id).encode()) % salt_buckets
+
+
+def row_key(entry_id, event_time_ms: int, salt_buckets: int = SALT_BUCKETS) -> bytes:
+    """Row key of a raw reading taken at event_time_ms."""
+    entry = f"{entry_id:0{ENTRY_ID_DIGITS}d}" if isinstance(entry_id, int) else str(entry_id)
+    return f"{salt_for(entry_id, salt_buckets):02d}#{int(event_time_ms):0{TIME_DIGITS}d}#{entry}".encode()
+
+
+def parse_row_key(key: bytes) -> Tuple[int, int, str]:
+    """(salt, event time ms, entry_id) of a raw row key."""
+    salt, event_time_ms, entry = key.decode().split("#", 2)
+    return int(salt), int(event_time_ms), entry
+
+
+def key_range(salt: int, start_ms: int, end_ms: int) -> Tuple[bytes, bytes]:
+    """[start_key, end_key) covering event times start_ms <= t < end_ms in one bucket."""
+    return (f"{salt:02d}#{int(start_ms):0{TIME_DIGITS}d}".encode(),
+            f"{salt:02d}#{int(end_ms):0{TIME_DIGITS}d}".encode())
+
+
+def _epoch_ms(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def _scan_bucket(table, salt, start_ms, end_ms, column_family, out: queue.Queue):
+    from google.cloud.bigtable.row_filters import CellsColumnLimitFilter
+    try:
+        start_key, end_key = key_range(salt, start_ms, end_ms)
+        for bt_row in table.read_rows(start_key=start_key, end_key=end_key,
+                                      filter_=CellsColumnLimitFilter(1)):
+            cell = bt_row.cells[column_family][b"message"][0]
+            out.put((bt_row.row_key, cell.value))
+    except Exception as e:
+        out.put(e)
+    finally:
+        out.put(_DONE)
+
+
+def _drain(out: queue.Queue) -> Iterator[Tuple[int, bytes, bytes]]:
+    while True:
+        item = out.get()
+        if item is _DONE:
+            return
+        if isinstance(item, Exception):
+            raise item
+        key, value = item
+        # Sort on (time, key) so buckets interleave in event-time order
+        yield parse_row_key(key)[1], key, value
+
+
+def query_range(table, start: datetime, end: datetime, salt_buckets: int = SALT_BUCKETS,
+                column_family: str = 'cf1') -> Iterator[Tuple[bytes, Dict]]:
+    """
+    Yields (row key, record) for every raw reading with start <= event time < end,
+    in event-time order.
+
+    One thread scans each salt bucket; each can read READ_AHEAD_ROWS ahead of
+    the merge, so memory stays bounded however long the range is.
+    """
+    start_ms, end_ms = _epoch_ms(start), _epoch_ms(end)
+    queues = [queue.Queue(maxsize=READ_AHEAD_ROWS) for _ in range(salt_buckets)]
+    for salt, out in enumerate(queues):
+        threading.Thread(target=_scan_bucket, args=(table, salt, start_ms, end_ms, column_family, out),
+                         name=f"bigtable-scan-{salt}", daemon=True).start()
+
+    for _event_time_ms, key, value in heapq.merge(*(_drain(out) for out in queues)):
+        yield key, json.loads(value)
+
+
+def open_table(project_id, instance_id, table_id):
+    from google.cloud import bigtable
+    client = bigtable.Client(project=project_id)
+    return client.instance(instance_id).table(table_id)
+
+
+def parse_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time-range reads of the raw readings")
+    parser.add_argument('-project_id', '--project_id', dest='project_id', type=str, default='cool-continuity-457614-b2', required=False)
+    parser.add_argument('-instance_id', '--instance_id', dest='instance_id', type=str, default='iot-data-store', required=False)
+    parser.add_argument('-table_id', '--table_id', dest='table_id', type=str, default='weather-info', required=False)
+    parser.add_argument('--salt-buckets', dest='salt_buckets', type=int, default=SALT_BUCKETS, required=False)
+    parser.add_argument('--start', dest='start', type=parse_time, required=True, help='UTC, inclusive')
+    parser.add_argument('--end', dest='end', type=parse_time, required=True, help='UTC, exclusive')
+    parser.add_argument('--out', dest='out', type=str, default=None, required=False,
+                        help='CSV export in the GCP_result.csv layout; JSON lines on stdout when omitted')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    table = open_table(args.project_id, args.instance_id, args.table_id)
+    rows = query_range(table, args.start, args.end, args.salt_buckets)
+
+    count = 0
+    if args.out:
+        with open(args.out, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            writer.writerow(["_key", "cf1"])
+            for key, record in rows:
+                writer.writerow([key.decode(), json.dumps({"message": record}, indent=2)])
+                count += 1
+    else:
+        for key, record in rows:
+            print(json.dumps(record))
+            count += 1
+    logging.getLogger(__name__).info(f"Read {count} rows between {args.start} and {args.end}")
+
+
+if __name__ == "__main__":
+    main()
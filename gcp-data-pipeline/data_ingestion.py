@@ -1,9 +1,15 @@
 import confluent_kafka
 import argparse
 import time 
-import requests
 from tokenprovider import TokenProvider
-import requests, json, uuid
+from kafka_producer import SpillingProducer
+import json, uuid
+from pipeline_common.clock import add_clock_arguments, clock_from_args
+from pipeline_common.codec import ENCODINGS, encode
+from pipeline_common.dedupe import EntryIdFilter
+from pipeline_common.load_generator import add_load_arguments, run_from_args
+from pipeline_common.metrics import REGISTRY, SampledLog
+from pipeline_common.thingspeak import ThingSpeakFetcher, add_backfill_arguments, backfill_from_args
 
 # Custom arguments to start producing events
 parser = argparse.ArgumentParser()
@@ -12,6 +18,21 @@ parser.add_argument('-b', '--bootstrap-servers', dest='bootstrap', type=str,  de
 parser.add_argument('-t', '--topic-name', dest='topic_name', type=str, default='iot-data', required=False)
 parser.add_argument('-n', '--num_messages', dest='num_messages', type=int, default=2, required=False)
 parser.add_argument('--delay', dest='delay', type=float, default=5.0, required=False)
+parser.add_argument('--metrics-port', dest='metrics_port', type=int, default=0, required=False,
+                    help='serve OpenMetrics text on this port (0: off)')
+# Messages librdkafka may hold unacknowledged; beyond that (or when its queue is full) they spill to disk
+parser.add_argument('--max-in-flight', dest='max_in_flight', type=int, default=10000, required=False)
+parser.add_argument('--spill-dir', dest='spill_dir', type=str, default='/var/tmp/kafka-spill', required=False)
+# librdkafka fixes linger.ms when the producer is created; it cannot be tuned at runtime
+parser.add_argument('--linger-ms', dest='linger_ms', type=float, default=5.0, required=False)
+# Message values: compact binary records (JSON for entries that do not fit the schema) or JSON
+parser.add_argument('--encoding', dest='encoding', choices=ENCODINGS, default='binary', required=False)
+# --source synthetic|replay replaces the ThingSpeak poll with the open-loop load generator
+add_load_arguments(parser)
+# --backfill-start replays ThingSpeak history in concurrent, rate-limited pages
+add_backfill_arguments(parser)
+# --clock-reference adds the VM's skew-corrected clock stamp (vm_ref_us, vm_error_us) to every message
+add_clock_arguments(parser)
 args = parser.parse_args()
 
 
@@ -24,47 +45,106 @@ config = {
     'oauth_cb': token_provider.get_token,
     'acks': 'all',
     'retries': 5,
-    'linger.ms': 5,
+    'linger.ms': args.linger_ms,
 }
 
 
-URL = f'https://api.thingspeak.com/channels/12397/feeds.json?results={args.num_messages}'
+# Pooled session; after the first poll only entries newer than the last one seen are fetched
+fetcher = ThingSpeakFetcher(results=args.num_messages, requests_per_second=args.thingspeak_rate)
 
-print(URL)
+print(fetcher.url)
 
-producer = confluent_kafka.Producer(config)
+
+# Consecutive polls return mostly the same entries; only new entry IDs are produced
+entry_filter = EntryIdFilter()
+
+# Per-stage timings and delivery counters instead of a print per message
+FETCH_SECONDS = REGISTRY.histogram('stage_seconds', stage='fetch')
+ENCODE_SECONDS = REGISTRY.histogram('stage_seconds', stage='encode')
+PRODUCE_SECONDS = REGISTRY.histogram('stage_seconds', stage='produce')
+DELIVERY_SECONDS = REGISTRY.histogram('stage_seconds', stage='delivery')
+DELIVERED = REGISTRY.counter('kafka_messages', outcome='delivered')
+FAILED = REGISTRY.counter('kafka_messages', outcome='failed')
+IN_FLIGHT = REGISTRY.gauge('kafka_in_flight')
+SPILLED = REGISTRY.gauge('kafka_spilled_messages')
+REPLAYED = REGISTRY.gauge('kafka_replayed_messages')
+SPILL_BACKLOG = REGISTRY.gauge('kafka_spill_backlog_bytes')
+failure_log = SampledLog(print, every=100)
+clock = clock_from_args(args)
+if args.metrics_port:
+    REGISTRY.serve(args.metrics_port)
 
 
 def callBack(err, msg):
     if err is not None:
-        print(f'Msg delivery to Kafka failed: {err}')
+        # Already spilled by the producer and replayed later
+        FAILED.inc()
+        failure_log(lambda: f'Msg delivery to Kafka failed: {err} ({FAILED.value:g} failed so far)')
     else:
-        print(f'Delivered message to {msg.topic()} [{msg.partition()}] at offset {msg.offset()}')
-
-
-while True:
-    resp = requests.get(URL, timeout=10).json()
-    feeds_data = resp['feeds']
-
-    for feed in feeds_data:
-        uid = uuid.uuid1()
-        key = f"key-{uid}".encode('utf-8')
-        
-        # current_time = time.gmtime()
-        # formatted_time = time.strftime("%Y-%m-%dT%H:%M:%SZ", current_time)
-        # feed['vm_timestamp'] = formatted_time
-
-        
-        # Epoch millisecond
-        feed['vm_timestamp'] = int(time.time_ns())//1_000_000
-        
-        value = json.dumps(feed).encode('utf-8')
-        producer.produce(args.topic_name, key=key, value=value, callback=callBack)
-        # Internal queue handling
-        producer.poll(0)
-    
-    producer.flush()
-    print(f"Successfully produced {args.num_messages} messages to topic '{args.topic_name}' with {args.delay} sec delay between each.")
+        DELIVERED.inc()
+        latency = msg.latency()
+        if latency is not None:
+            DELIVERY_SECONDS.observe(latency)
+
+
+# A poll thread serves delivery callbacks; produce never blocks or raises BufferError
+producer = SpillingProducer(confluent_kafka.Producer(config), args.topic_name, args.spill_dir,
+                            max_in_flight=args.max_in_flight, on_delivery=callBack)
+
+
+def producer_summary():
+    IN_FLIGHT.set(producer.in_flight)
+    SPILLED.set(producer.spilled)
+    REPLAYED.set(producer.replayed)
+    SPILL_BACKLOG.set(producer.log.backlog_bytes())
+    return REGISTRY.summary()
+
+
+def produce_feed(feed):
+    # Keyed by entry_id so any copy of an entry lands on the same partition
+    entry_id = feed.get('entry_id')
+    key = (f"{entry_id}" if entry_id is not None else f"key-{uuid.uuid1()}").encode('utf-8')
+
+    # Epoch millisecond
+    feed['vm_timestamp'] = int(time.time_ns())//1_000_000
+    if clock is not None:
+        clock.stamp(feed, 'vm_timestamp')
+
+    start_ns = time.perf_counter_ns()
+    value = encode(feed, args.encoding)
+    encoded_ns = time.perf_counter_ns()
+    ENCODE_SECONDS.record_us((encoded_ns - start_ns) // 1000)
+    producer.produce(key, value)
+    PRODUCE_SECONDS.observe_since(encoded_ns)
+
+
+if args.source != 'thingspeak':
+    print(f"Producing {args.source} load to topic '{args.topic_name}' ({args.profile}, {args.rate} ev/s)")
+    run_from_args(args, produce_feed)
+    producer.close()
+    print(producer_summary())
+
+if args.source == 'thingspeak' and args.backfill_start is not None:
+    total = 0
+    for feeds_data in backfill_from_args(fetcher, args):
+        for feed in feeds_data:
+            produce_feed(feed)
+        total += len(feeds_data)
+    producer.close()
+    print(f"Backfilled {total} messages from {args.backfill_start} to topic '{args.topic_name}'.")
+    print(producer_summary())
+
+while args.source == 'thingspeak' and args.backfill_start is None:
+    with FETCH_SECONDS.time():
+        feeds_data = fetcher.fetch_new()
+
+    new_feeds = [feed for feed in feeds_data if entry_filter.accept(feed['entry_id'], lambda feed=feed: len(json.dumps(feed)))]
+    for feed in new_feeds:
+        produce_feed(feed)
+
+    # No flush: deliveries complete in the background while the next poll waits
+    print(f"Queued {len(new_feeds)} of {len(feeds_data)} messages for topic '{args.topic_name}' with {args.delay} sec delay between each (duplicates: {entry_filter.stats}).")
+    print(producer_summary())
     
     # Pause between calls to thingspeak API
     if args.delay > 0:
@@ -0,0 +1,350 @@
+"""
+Kafka producer with a bounded in-flight window and an on-disk spill log
+
+`SpillingProducer` wraps a confluent_kafka.Producer:
+
+  - a daemon thread calls `poll` continuously, so delivery callbacks are
+    served at the broker's pace and the caller never has to `flush` between
+    batches;
+  - at most `max_in_flight` messages are handed to librdkafka at a time;
+  - when the window is full, librdkafka raises BufferError, or a delivery
+    finally fails, the message is appended to a memory-mapped segment log on
+    local disk instead of being dropped;
+  - while the log holds messages, new ones are appended behind them, and the
+    delivery thread replays the log into the producer whenever the window has
+    room again.
+
+`produce` therefore never blocks and never loses a message while the broker
+is slow or down; memory stays bounded by the window, the backlog lives on
+disk. A replayed record stays on disk until the broker acknowledges it: the
+committed cursor is the oldest record without a successful delivery, and
+segments are deleted only once the cursor has passed them. The records
+after the cursor that were acknowledged out of order are listed in the
+cursor file too, so after a crash the log replays exactly the records
+without an acknowledgement: spilled messages are delivered at least once.
+Messages that went straight to librdkafka were never on disk; the ones in
+flight at a crash are lost.
+
+Segment frame layout (little-endian): I payload length, I crc32, H key
+length, key, value. Segment files are pre-sized, so a zero length marks the
+end of the written part. A frame whose payload fails its checksum is
+skipped.
+
+Cursor file: one "segment offset" line for the cursor, then one per record
+after it that is already acknowledged.
+"""
+
+import collections
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, List, Optional, Set, Tuple
+
+_FRAME = struct.Struct("<IIH")
+_CURSOR_FILE = "cursor"
+
+
+class SegmentLog:
+    """
+    Append-only log of (key, value) records in fixed-size mmap'd segments.
+
+    Records read with `peek`/`advance` count as unacknowledged until `ack`;
+    `commit` persists the start of the oldest of them (the low-water mark),
+    along with the records acknowledged after it, and deletes the segments
+    before it, so a restarted process replays exactly the records that were
+    not acknowledged.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(directory, exist_ok=True)
+
+        segments = self._segments()
+        (self.read_seq, self.read_offset), acked = self._load_cursor(segments)
+        for seq in segments:
+            if seq < self.read_seq:
+                # Acknowledged, but a crash cut the deletion short
+                os.remove(self._path(seq))
+        # Never append to a segment a crashed writer may have left torn
+        self.write_seq = (segments[-1] + 1) if segments else self.read_seq
+        if self.write_seq == self.read_seq:
+            self.read_offset = 0
+        self.write_offset = 0
+        self.writer = self._map(self.write_seq, create=True)
+        self.reader = self.writer if self.read_seq == self.write_seq else self._map(self.read_seq)
+        self._committed = (self.read_seq, self.read_offset)
+        # Positions of the records read and not yet acknowledged, oldest first
+        self._unacked = collections.deque()
+        # Acknowledged, but behind an unacknowledged record
+        self._acked = set()
+        # Acknowledged before a restart; `peek` passes over them
+        self._skip = acked
+        self._dirty = False
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"segment-{seq:012d}.log")
+
+    def _segments(self) -> List[int]:
+        return sorted(int(name[8:20]) for name in os.listdir(self.directory)
+                      if name.startswith("segment-") and name.endswith(".log"))
+
+    def _load_cursor(self, segments: List[int]) -> Tuple[Tuple[int, int], Set[Tuple[int, int]]]:
+        """The committed cursor and the positions acknowledged after it."""
+        try:
+            with open(os.path.join(self.directory, _CURSOR_FILE)) as f:
+                cursor, *acked = (tuple(int(part) for part in line.split()) for line in f if line.strip())
+            if cursor[0] in segments:
+                return cursor, set(acked)
+        except (OSError, ValueError):
+            pass
+        return ((segments[0], 0) if segments else (0, 0)), set()
+
+    def _map(self, seq: int, create: bool = False) -> mmap.mmap:
+        fd = os.open(self._path(seq), os.O_RDWR | (os.O_CREAT if create else 0), 0o600)
+        try:
+            if create:
+                os.ftruncate(fd, self.segment_bytes)
+            return mmap.mmap(fd, self.segment_bytes)
+        finally:
+            os.close(fd)
+
+    def empty(self) -> bool:
+        return self.read_seq == self.write_seq and self.read_offset == self.write_offset
+
+    def backlog_bytes(self) -> int:
+        return ((self.write_seq - self.read_seq) * self.segment_bytes
+                + self.write_offset - self.read_offset)
+
+    def append(self, key: Optional[bytes], value: bytes) -> None:
+        key = key or b""
+        size = _FRAME.size + len(key) + len(value)
+        if size > self.segment_bytes:
+            raise ValueError(f"Record of {size} bytes does not fit a {self.segment_bytes}-byte segment")
+        if self.write_offset + size > self.segment_bytes:
+            self._roll()
+        offset = self.write_offset
+        payload = key + value
+        _FRAME.pack_into(self.writer, offset, len(payload), zlib.crc32(payload), len(key))
+        self.writer[offset + _FRAME.size:offset + size] = payload
+        self.write_offset = offset + size
+
+    def _roll(self) -> None:
+        self.writer.flush()
+        if self.writer is not self.reader:
+            self.writer.close()
+        self.write_seq += 1
+        self.write_offset = 0
+        self.writer = self._map(self.write_seq, create=True)
+
+    def peek(self) -> Optional[Tuple[Optional[bytes], bytes]]:
+        """The oldest unread record, or None when the log is empty."""
+        while not self.empty():
+            if self.read_offset + _FRAME.size > self.segment_bytes:
+                self._next_segment()
+                continue
+            length, crc, key_length = _FRAME.unpack_from(self.reader, self.read_offset)
+            if length == 0 or self.read_offset + _FRAME.size + length > self.segment_bytes:
+                self._next_segment()
+                continue
+            start = self.read_offset + _FRAME.size
+            payload = self.reader[start:start + length]
+            if zlib.crc32(payload) != crc:
+                self.logger.error(f"Corrupt record in spill segment {self.read_seq} at {self.read_offset}; "
+                                  f"skipping it")
+                self.read_offset = start + length
+                continue
+            if self._skip and self.position in self._skip:
+                # Delivered before a restart
+                self._skip.remove(self.position)
+                self.read_offset = start + length
+                continue
+            return (payload[:key_length] or None), payload[key_length:]
+        return None
+
+    @property
+    def position(self) -> Tuple[int, int]:
+        """(segment, offset) of the record returned by `peek`; the token `ack` takes."""
+        return self.read_seq, self.read_offset
+
+    def advance(self) -> None:
+        """Moves past the record returned by `peek`; it stays on disk until acknowledged."""
+        length, _crc, _key_length = _FRAME.unpack_from(self.reader, self.read_offset)
+        self._unacked.append(self.position)
+        self.read_offset += _FRAME.size + length
+
+    def ack(self, position: Tuple[int, int]) -> None:
+        """Marks the record read at `position` as delivered, in any order."""
+        self._acked.add(position)
+        unacked, acked = self._unacked, self._acked
+        while unacked and unacked[0] in acked:
+            acked.remove(unacked.popleft())
+        self._dirty = True
+
+    def unacked(self) -> int:
+        return len(self._unacked)
+
+    def _next_segment(self) -> None:
+        if self.read_seq == self.write_seq:
+            # Torn tail of the segment being written: drop it and start over
+            self.read_offset = self.write_offset
+            return
+        # The file stays until `commit` passes it; its records may be in flight
+        self.reader.close()
+        self.read_seq += 1
+        self.read_offset = 0
+        self.reader = self.writer if self.read_seq == self.write_seq else self._map(self.read_seq)
+
+    def commit(self) -> None:
+        """Persists the low-water mark and deletes the segments before it."""
+        seq, offset = self._unacked[0] if self._unacked else self.position
+        if (seq, offset) == self._committed and not self._dirty:
+            return
+        # Records acknowledged before a restart and not yet passed by `peek` still count
+        self._skip = {position for position in self._skip if position >= (seq, offset)}
+        path = os.path.join(self.directory, _CURSOR_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{seq} {offset}\n")
+            for acked_seq, acked_offset in sorted(self._acked | self._skip):
+                f.write(f"{acked_seq} {acked_offset}\n")
+        os.replace(path + ".tmp", path)
+        self._dirty = False
+        for done in range(self._committed[0], seq):
+            os.remove(self._path(done))
+        self._committed = (seq, offset)
+
+    def close(self) -> None:
+        self.commit()
+        self.writer.flush()
+        if self.reader is not self.writer:
+            self.reader.close()
+        self.writer.close()
+        if self.empty() and not self._unacked:
+            # Nothing left to replay; the next run starts from a clean directory
+            for seq in self._segments():
+                os.remove(self._path(seq))
+
+
+class SpillingProducer:
+    """
+    Never-blocking producer front end; see the module docstring.
+
+    Args:
+        producer: confluent_kafka.Producer to send through.
+        topic: Topic every message goes to.
+        spill_dir: Directory of the segment log.
+        max_in_flight: Messages handed to librdkafka and not yet acknowledged.
+        segment_bytes: Size of each spill segment file.
+        poll_interval_seconds: Longest `poll` wait of the delivery thread.
+        on_delivery: Called as on_delivery(err, msg) for every final delivery
+            result; failed messages have already been spilled for replay.
+    """
+
+    def __init__(self, producer, topic: str, spill_dir: str, max_in_flight: int = 10000,
+                 segment_bytes: int = 64 * 1024 * 1024, poll_interval_seconds: float = 0.05,
+                 on_delivery: Optional[Callable] = None):
+        self.producer = producer
+        self.topic = topic
+        self.max_in_flight = max_in_flight
+        self.poll_interval_seconds = poll_interval_seconds
+        self.on_delivery = on_delivery
+        self.logger = logging.getLogger(__name__)
+
+        self.log = SegmentLog(spill_dir, segment_bytes)
+        self.in_flight = 0
+        self.spilled = 0
+        self.replayed = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        if not self.log.empty():
+            self.logger.info(f"Replaying {self.log.backlog_bytes()} bytes spilled by a previous run")
+
+        self._thread = threading.Thread(target=self._delivery_loop, name="kafka-delivery", daemon=True)
+        self._thread.start()
+
+    def produce(self, key: Optional[bytes], value: bytes) -> None:
+        with self._lock:
+            # Anything already spilled goes first, so new messages queue behind it
+            if self.log.empty() and self.in_flight < self.max_in_flight and self._send(key, value):
+                return
+            self.log.append(key, value)
+            self.spilled += 1
+
+    def _send(self, key, value, position: Optional[Tuple[int, int]] = None) -> bool:
+        """
+        Hands one message to librdkafka; False if its queue is full. Holds the lock.
+
+        `position` is the spill log position of a replayed message, acknowledged
+        in the log once the delivery callback has run.
+        """
+        try:
+            self.producer.produce(self.topic, key=key, value=value,
+                                  on_delivery=lambda err, msg: self._delivered(err, msg, position))
+        except BufferError:
+            return False
+        self.in_flight += 1
+        return True
+
+    def _delivered(self, err, msg, position: Optional[Tuple[int, int]] = None) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if err is not None:
+                # librdkafka has exhausted its retries; keep the message for replay
+                self.log.append(msg.key(), msg.value())
+                self.spilled += 1
+            if position is not None:
+                # Delivered, or appended again above: the old frame may go
+                self.log.ack(position)
+        if self.on_delivery is not None:
+            self.on_delivery(err, msg)
+
+    def _replay(self) -> None:
+        with self._lock:
+            replayed = 0
+            while self.in_flight < self.max_in_flight:
+                record = self.log.peek()
+                if record is None or not self._send(*record, position=self.log.position):
+                    break
+                self.log.advance()
+                replayed += 1
+            self.replayed += replayed
+
+    def _delivery_loop(self) -> None:
+        while not self._closed.is_set():
+            self.producer.poll(self.poll_interval_seconds)
+            if not self.log.empty() and self.in_flight < self.max_in_flight // 2:
+                self._replay()
+            with self._lock:
+                # No-op unless acknowledgements moved the low-water mark
+                self.log.commit()
+
+    def pending(self) -> int:
+        """Messages in flight, plus one while the spill log is not empty."""
+        with self._lock:
+            return self.in_flight + (0 if self.log.empty() else 1)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every message (spilled ones included) is acknowledged."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval_seconds)
+        return True
+
+    def close(self, timeout: Optional[float] = 30.0) -> None:
+        if not self.flush(timeout):
+            replayed = self.log.unacked()
+            self.logger.warning(f"Closing with {self.in_flight - replayed} unacknowledged messages (lost), "
+                                f"{replayed} unacknowledged replays and {self.log.backlog_bytes()} spilled "
+                                f"bytes (both replayed on the next run)")
+        self._closed.set()
+        self._thread.join()
+        self.producer.flush(0)
+        with self._lock:
+            self.log.close()
@@ -22,4 +22,33 @@ resource "google_bigtable_table" "bt_table" {
   column_family {
     family = "cf1"
   }
+
+  # Per-window sensor rollups (count/min/max/mean/p95), rows keyed rollup#<window start>
+  column_family {
+    family = "rollup"
+  }
+}
+
+# Rows are keyed salt#event time#entry_id, all derived from the entry, so a
+# re-sent entry lands on its own row; keep only the latest cell so it
+# overwrites instead of piling up versions
+resource "google_bigtable_gc_policy" "cf1_latest" {
+  instance_name = google_bigtable_instance.bt_instance.name
+  table         = google_bigtable_table.bt_table.name
+  column_family = "cf1"
+
+  max_version {
+    number = 1
+  }
+}
+
+# Late data rewrites a window's rollup row; only the latest accumulation matters
+resource "google_bigtable_gc_policy" "rollup_latest" {
+  instance_name = google_bigtable_instance.bt_instance.name
+  table         = google_bigtable_table.bt_table.name
+  column_family = "rollup"
+
+  max_version {
+    number = 1
+  }
 }
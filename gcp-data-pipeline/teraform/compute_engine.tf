@@ -40,6 +40,8 @@ resource "google_compute_instance" "vm" {
     cd aws-vs-gcp-data-pipeline
     git checkout gcp
     cd gcp-data-pipeline
+    # Shared pipeline_common package lives at the repository root
+    export PYTHONPATH=..
 
     touch /var/log/publisher.log
     sudo chmod 666 /var/log/publisher.log
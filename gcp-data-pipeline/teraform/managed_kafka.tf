@@ -29,6 +29,6 @@ resource "google_managed_kafka_topic" "iot-topic" {
   cluster            = google_managed_kafka_cluster.kafka[0].cluster_id
   location           = var.region
   topic_id           = var.kafka_topic
-  partition_count    = 1
+  partition_count    = var.kafka_partitions
   replication_factor = 3
 }
@@ -40,6 +40,12 @@ variable "kafka_topic" {
   default = "iot-data"
 }
 
+# Beam reads every partition in parallel, so this bounds consumer parallelism
+variable "kafka_partitions" {
+  type    = number
+  default = 1
+}
+
 # VM - Instance
 
 variable "vm_name" {
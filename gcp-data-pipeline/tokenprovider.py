@@ -2,6 +2,9 @@ import base64
 import datetime
 import http.server
 import json
+import logging
+import os
+import threading
 import google.auth
 from google.auth.transport.urllib3 import Request
 import urllib3
@@ -11,24 +14,84 @@ def encode(source):
   """Safe base64 encoding."""
   return base64.urlsafe_b64encode(source.encode('utf-8')).decode('utf-8').rstrip('=')
 
+def expiry_epoch(creds):
+  """Credential expiry as epoch seconds (google-auth keeps it as naive UTC)."""
+  return creds.expiry.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+class _TokenCache(object):
+  """
+  Process-wide Kafka OAuth token, refreshed by a daemon thread before it expires.
+
+  Application Default credentials are resolved once per process, and the
+  encoded token is rebuilt only when the credentials are refreshed, so
+  reading it never blocks on the network.
+  """
+  # Refresh this long before expiry; GCE hands out a new token in the last 5 min
+  REFRESH_MARGIN_SECONDS = 240
+  # Wait between attempts when a refresh fails or returns the same token
+  RETRY_SECONDS = 10
+
+  _instance = None
+  _instance_lock = threading.Lock()
+
+  @classmethod
+  def instance(cls):
+    with cls._instance_lock:
+      # A forked worker inherits the cache but not its refresh thread
+      if cls._instance is None or cls._instance.pid != os.getpid():
+        cls._instance = cls()
+      return cls._instance
+
+  def __init__(self):
+    self.pid = os.getpid()
+    self.logger = logging.getLogger(__name__)
+    self.credentials, _project = google.auth.default()
+    self.http_client = urllib3.PoolManager()
+    self.token = None
+    self.refresh()
+
+    self.thread = threading.Thread(target=self._refresh_loop, name='kafka-token-refresh', daemon=True)
+    self.thread.start()
+
+  def refresh(self):
+    self.credentials.refresh(Request(self.http_client))
+    creds = self.credentials
+    token = '.'.join([
+      encode(TokenProvider.HEADER),
+      encode(TokenProvider.get_jwt(creds)),
+      encode(creds.token)
+    ])
+    # Single assignment, so readers always see a matching token and expiry
+    self.token = (token, expiry_epoch(creds))
+
+  def _refresh_loop(self):
+    while True:
+      _token, expiry = self.token
+      time.sleep(max(expiry - time.time() - self.REFRESH_MARGIN_SECONDS, self.RETRY_SECONDS))
+      try:
+        self.refresh()
+      except Exception as e:
+        self.logger.warning(f"Kafka OAuth token refresh failed, retrying: {e}")
+
 class TokenProvider(object):
   """
   Provides OAuth tokens from Google Cloud Application Default credentials.
+
+  All instances in a process share one cached token that a background thread
+  keeps fresh, so `get_token` returns immediately from librdkafka's callback.
   """
   HEADER = json.dumps({'typ':'JWT', 'alg':'GOOG_OAUTH2_TOKEN'})
 
   def __init__(self, **config):
-    self.credentials, _project = google.auth.default()
-    self.http_client = urllib3.PoolManager()
+    self.cache = _TokenCache.instance()
 
   def get_credentials(self):
-    if not self.credentials.valid:
-      self.credentials.refresh(Request(self.http_client))
-    return self.credentials
+    return self.cache.credentials
 
-  def get_jwt(self, creds):
+  @staticmethod
+  def get_jwt(creds):
     token_data = dict(
-            exp=creds.expiry.timestamp(),
+            exp=expiry_epoch(creds),
             iat=datetime.datetime.now(datetime.timezone.utc).timestamp(),
             iss='Google',
             scope='kafka',
@@ -37,15 +100,4 @@ class TokenProvider(object):
     return json.dumps(token_data)
 
   def get_token(self, args):
-    creds = self.get_credentials()
-    token = '.'.join([
-      encode(self.HEADER),
-      encode(self.get_jwt(creds)),
-      encode(creds.token)
-    ])
-
-    # compute expiry time explicitly
-    utc_expiry = creds.expiry.replace(tzinfo=datetime.timezone.utc)
-    expiry_seconds = (utc_expiry - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
-
-    return token, time.time() + expiry_seconds
\ No newline at end of file
+    return self.cache.token
@@ -0,0 +1,6 @@
+"""
+Code shared by the AWS and GCP pipelines.
+
+The pipeline scripts import it from the repository root, so run them with
+the root on PYTHONPATH, e.g. `PYTHONPATH=.. python3 data_source.py`.
+"""
@@ -0,0 +1,215 @@
+"""
+Adaptive Batching Against a Latency SLO
+
+Batching trades latency for throughput and cost: bigger batches and longer
+lingers mean fewer calls (PutRecords, consume, invocations) per record, but
+every record waits longer. No fixed setting suits both the quiet night and
+the daytime bursts, so `LatencySLOController` moves the batching knobs at
+runtime, AIMD style, like TCP congestion control:
+
+    p95 > target              every knob shrinks by `decrease` (x0.5)
+    p95 < target * headroom   every knob grows by its `step`
+    otherwise                 hold
+
+so the knobs settle at the largest batches that still meet the SLO, and back
+off within one window when a burst breaks it. Each window needs
+`min_samples` observations, so a quiet source is judged over a longer span
+instead of on a handful of records.
+
+Smaller batches only help while waiting to fill them is what makes records
+late. When the stage is overloaded, latency comes from the backlog, and
+smaller batches cut throughput and make it worse. So when a decrease leaves
+the latency barely better (by less than half the cut) and the throughput
+lower, the controller restores the
+settings from before it and holds them (`saturated`) until the latency is
+back under the target.
+
+    controller = LatencySLOController(
+        {"max_batch_records": Knob(500, 10, 500, step=25, integer=True),
+         "max_batch_age_ms": Knob(100, 1, 250)},
+        target_seconds=0.3, on_change=lambda s: producer.set_batching(**s))
+    ...
+    controller.observe(latency_seconds, records)
+
+The current settings, the last window's percentile and the saturated flag
+are exported as `adaptive_setting`, `adaptive_latency_seconds` and
+`adaptive_saturated` gauges in `pipeline_common.metrics.REGISTRY`.
+
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from pipeline_common.metrics import REGISTRY, Histogram
+
+
+class Knob:
+    """
+    A setting the controller may move between `low` and `high`.
+
+    Args:
+        value: Starting value.
+        low: Smallest value.
+        high: Largest value.
+        step: Additive increase; a twentieth of the range when None.
+        integer: Round the value to an integer.
+    """
+
+    def __init__(self, value: float, low: float, high: float,
+                 step: Optional[float] = None, integer: bool = False):
+        if not low <= value <= high:
+            raise ValueError(f"Knob value {value} outside [{low}, {high}]")
+        self.low = low
+        self.high = high
+        self.step = step if step is not None else (high - low) / 20
+        self.integer = integer
+        self.value = value
+        self.set(value)
+
+    def set(self, value: float) -> None:
+        value = min(max(value, self.low), self.high)
+        self.value = int(round(value)) if self.integer else value
+
+    def __repr__(self):
+        return f"Knob({self.value}, {self.low}, {self.high})"
+
+
+class LatencySLOController:
+    """
+    AIMD controller that keeps a latency percentile under a target.
+
+    Args:
+        knobs: Name -> Knob; all of them move together.
+        target_seconds: Latency target for the percentile.
+        percentile: Quantile the target applies to.
+        interval_seconds: Shortest observation window.
+        min_samples: Observations a window needs before it is judged.
+        headroom: Knobs only grow while the percentile is below
+            target_seconds * headroom, so they do not oscillate at the target.
+        decrease: Factor the knobs shrink by when the target is missed.
+        on_change: Called with {name: value} after every change, outside the
+            controller's lock.
+        name: `controller` label of the exported gauges.
+        clock: Monotonic time source, in seconds.
+    """
+
+    def __init__(self, knobs: Dict[str, Knob], target_seconds: float,
+                 percentile: float = 0.95,
+                 interval_seconds: float = 5.0,
+                 min_samples: int = 50,
+                 headroom: float = 0.8,
+                 decrease: float = 0.5,
+                 on_change: Optional[Callable[[Dict[str, float]], None]] = None,
+                 name: str = "batching",
+                 clock: Callable[[], float] = time.monotonic):
+        if target_seconds <= 0:
+            raise ValueError("target_seconds must be positive")
+        self.knobs = knobs
+        self.target_seconds = target_seconds
+        self.percentile = percentile
+        self.interval_seconds = interval_seconds
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.decrease = decrease
+        self.on_change = on_change
+        self.clock = clock
+
+        self.increases = 0
+        self.decreases = 0
+        self.saturated = False
+        self.last_latency: Optional[float] = None
+        self.last_throughput = 0.0
+        # (latency, throughput, settings) of the window that led to the last
+        # decrease, while the windows since have all missed the target
+        self._last_decrease = None
+
+        self._lock = threading.Lock()
+        self._window = Histogram()
+        self._window_start = clock()
+        self._latency_gauge = REGISTRY.gauge("adaptive_latency_seconds", controller=name)
+        self._saturated_gauge = REGISTRY.gauge("adaptive_saturated", controller=name)
+        self._setting_gauges = {knob: REGISTRY.gauge("adaptive_setting", controller=name, knob=knob)
+                                for knob in knobs}
+        self._publish()
+
+    @property
+    def settings(self) -> Dict[str, float]:
+        return {name: knob.value for name, knob in self.knobs.items()}
+
+    def observe(self, latency_seconds: float, count: int = 1) -> None:
+        """
+        Records the latency of `count` records and, once the window is over,
+        adjusts the knobs.
+        """
+        # Under the lock, so the sample cannot land in a window update() has taken
+        with self._lock:
+            self._window.record_us(latency_seconds * 1_000_000, count)
+            due = self.clock() - self._window_start >= self.interval_seconds
+        if due:
+            self.update()
+
+    def update(self) -> Optional[Dict[str, float]]:
+        """
+        Judges the current window if it is long and full enough.
+
+        Returns:
+            dict: The new settings, or None when nothing changed.
+        """
+        with self._lock:
+            now = self.clock()
+            elapsed = now - self._window_start
+            window = self._window
+            if elapsed < self.interval_seconds or window.count < self.min_samples:
+                return None
+            self._window = Histogram()
+            self._window_start = now
+
+            latency = window.quantile(self.percentile)
+            throughput = window.count / elapsed
+            self.last_latency = latency
+            self.last_throughput = throughput
+            before = self.settings
+            if latency <= self.target_seconds:
+                self.saturated = False
+                self._last_decrease = None
+                if latency < self.target_seconds * self.headroom:
+                    for knob in self.knobs.values():
+                        knob.set(knob.value + knob.step)
+                    self.increases += before != self.settings
+            elif self.saturated:
+                pass
+            elif self._is_saturated(latency, throughput):
+                for name, value in self._last_decrease[2].items():
+                    self.knobs[name].set(value)
+                self.saturated = True
+                self._last_decrease = None
+            else:
+                for knob in self.knobs.values():
+                    knob.set(knob.value * self.decrease)
+                self.decreases += before != self.settings
+                self._last_decrease = (latency, throughput, before)
+            settings = self.settings
+            changed = settings != before
+            self._publish()
+
+        if not changed:
+            return None
+        if self.on_change is not None:
+            self.on_change(settings)
+        return settings
+
+    def _is_saturated(self, latency: float, throughput: float) -> bool:
+        """Whether the last decrease left latency barely better and throughput lower."""
+        if self._last_decrease is None:
+            return False
+        previous_latency, previous_throughput, _settings = self._last_decrease
+        return (latency > previous_latency * (1 + self.decrease) / 2
+                and throughput < previous_throughput * 0.9)
+
+    def _publish(self) -> None:
+        self._saturated_gauge.set(int(self.saturated))
+        if self.last_latency is not None:
+            self._latency_gauge.set(self.last_latency)
+        for name, gauge in self._setting_gauges.items():
+            gauge.set(self.knobs[name].value)
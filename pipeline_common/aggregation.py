@@ -0,0 +1,268 @@
+"""
+Kinesis Record Aggregation in the KPL format
+
+Many small user records are packed into one Kinesis record, so a shard's
+1,000 records/sec limit stops being the bottleneck long before its 1 MiB/sec
+one. The layout is the Kinesis Producer Library's, so KCL consumers and the
+AWS de-aggregation libraries read it too:
+
+    magic     F3 89 9A C2
+    message   protobuf AggregatedRecord
+    checksum  MD5 of the message (16 bytes)
+
+    message AggregatedRecord {
+        repeated string partition_key_table     = 1;
+        repeated string explicit_hash_key_table = 2;
+        repeated Record records                 = 3;
+    }
+    message Record {
+        required uint64 partition_key_index     = 1;
+        optional uint64 explicit_hash_key_index = 2;
+        required bytes  data                    = 3;
+    }
+
+The protobuf is written and read by hand (no protobuf dependency in the
+producer or the Lambda package). A payload without the magic bytes, or whose
+checksum does not match, is a plain user record, as in the KCL.
+
+"""
+
+import hashlib
+from typing import List, Optional, Tuple
+
+MAGIC = b"\xf3\x89\x9a\xc2"
+DIGEST_BYTES = 16
+
+# One PUT payload unit is 25 KB, so larger aggregates cost more per call
+DEFAULT_MAX_AGGREGATE_BYTES = 25 * 1024
+
+_PARTITION_KEY_TABLE = (1 << 3) | 2
+_RECORDS = (3 << 3) | 2
+_PARTITION_KEY_INDEX = (1 << 3) | 0
+_DATA = (3 << 3) | 2
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _varint_size(value: int) -> int:
+    return max(1, (value.bit_length() + 6) // 7)
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+        if shift > 63:
+            raise ValueError("Malformed varint")
+
+
+def _field_size(payload_bytes: int) -> int:
+    """Bytes of a length-delimited field with a one-byte tag."""
+    return 1 + _varint_size(payload_bytes) + payload_bytes
+
+
+class RecordAggregator:
+    """
+    Packs user records into KPL aggregated records of at most `max_bytes`.
+
+    The aggregate is routed by the partition key of its first user record.
+
+    Args:
+        max_bytes: Largest aggregated record, magic and checksum included.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_AGGREGATE_BYTES):
+        self.max_bytes = max_bytes
+        self._reset()
+
+    def _reset(self) -> None:
+        self._keys: List[bytes] = []
+        self._key_index = {}
+        self._records: List[bytes] = []
+        self._size = len(MAGIC) + DIGEST_BYTES
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    @property
+    def partition_key(self) -> Optional[str]:
+        return self._keys[0].decode("utf-8") if self._keys else None
+
+    def _added_size(self, key: bytes, data: bytes) -> Tuple[int, bytes]:
+        index = self._key_index.get(key)
+        key_size = 0
+        if index is None:
+            index = len(self._keys)
+            key_size = _field_size(len(key))
+        record = (bytes((_PARTITION_KEY_INDEX,)) + _varint(index)
+                  + bytes((_DATA,)) + _varint(len(data)) + data)
+        return key_size + _field_size(len(record)), record
+
+    def too_large(self, partition_key: str, data: bytes) -> bool:
+        """Whether the record exceeds max_bytes even in an aggregate of its own."""
+        record_size = 3 + _varint_size(len(data)) + len(data)
+        size = (len(MAGIC) + DIGEST_BYTES + _field_size(len(partition_key.encode("utf-8")))
+                + _field_size(record_size))
+        return size > self.max_bytes
+
+    def fits(self, partition_key: str, data: bytes) -> bool:
+        """Whether the record can join the current aggregate."""
+        if not self._records:
+            return True
+        size, _record = self._added_size(partition_key.encode("utf-8"), data)
+        return self._size + size <= self.max_bytes
+
+    def add(self, partition_key: str, data: bytes) -> None:
+        """
+        Adds a user record; call `fits` first, and `drain` when it does not.
+
+        Raises:
+            ValueError: The record alone exceeds max_bytes (see `too_large`);
+                send it as a plain Kinesis record instead.
+        """
+        key = partition_key.encode("utf-8")
+        size, record = self._added_size(key, data)
+        if self._size + size > self.max_bytes:
+            if self._records:
+                raise ValueError("Aggregate is full; drain it first")
+            raise ValueError(f"Record of {len(data)} bytes does not fit a {self.max_bytes}-byte aggregate")
+        if key not in self._key_index:
+            self._key_index[key] = len(self._keys)
+            self._keys.append(key)
+        self._records.append(record)
+        self._size += size
+
+    def drain(self) -> Tuple[Optional[str], Optional[bytes], int]:
+        """
+        Returns (partition key, aggregated payload, user record count) and
+        starts a new aggregate; (None, None, 0) when empty.
+        """
+        if not self._records:
+            return None, None, 0
+        parts = []
+        for key in self._keys:
+            parts += [bytes((_PARTITION_KEY_TABLE,)), _varint(len(key)), key]
+        for record in self._records:
+            parts += [bytes((_RECORDS,)), _varint(len(record)), record]
+        message = b"".join(parts)
+        payload = MAGIC + message + hashlib.md5(message).digest()
+        result = self.partition_key, payload, len(self._records)
+        self._reset()
+        return result
+
+
+def aggregate(records: List[Tuple[str, bytes]], max_bytes: int = DEFAULT_MAX_AGGREGATE_BYTES
+              ) -> List[Tuple[str, bytes, int]]:
+    """
+    Packs (partition key, data) pairs into as few aggregates as fit; a record
+    too large for any aggregate is passed through as it is, with a count of 1.
+    """
+    aggregator = RecordAggregator(max_bytes)
+    out = []
+    for partition_key, data in records:
+        if aggregator.too_large(partition_key, data):
+            if len(aggregator):
+                out.append(aggregator.drain())
+            out.append((partition_key, data, 1))
+            continue
+        if not aggregator.fits(partition_key, data):
+            out.append(aggregator.drain())
+        aggregator.add(partition_key, data)
+    if len(aggregator):
+        out.append(aggregator.drain())
+    return out
+
+
+def is_aggregated(payload: bytes) -> bool:
+    return (len(payload) >= len(MAGIC) + DIGEST_BYTES and payload[:len(MAGIC)] == MAGIC
+            and hashlib.md5(payload[len(MAGIC):-DIGEST_BYTES]).digest() == payload[-DIGEST_BYTES:])
+
+
+def deaggregate(payload: bytes) -> List[Tuple[Optional[str], bytes]]:
+    """
+    User records of a Kinesis record payload.
+
+    Returns:
+        list: (partition key, data) of every inner record; a payload that is
+        not a valid aggregate comes back as its only record, with key None.
+
+    Raises:
+        ValueError: The checksum matches but the message is malformed.
+    """
+    if not is_aggregated(payload):
+        return [(None, payload)]
+
+    data = bytes(payload)
+    keys: List[str] = []
+    records: List[Tuple[int, bytes]] = []
+    offset, end = len(MAGIC), len(data) - DIGEST_BYTES
+    try:
+        while offset < end:
+            tag, offset = _read_varint(data, offset)
+            wire_type = tag & 7
+            if wire_type == 0:
+                _value, offset = _read_varint(data, offset)
+                continue
+            if wire_type != 2:
+                raise ValueError(f"Unexpected wire type {wire_type} in aggregated record")
+            length = data[offset]
+            if length < 0x80:
+                offset += 1
+            else:
+                length, offset = _read_varint(data, offset)
+            field_end = offset + length
+            if field_end > end:
+                raise ValueError("Truncated aggregated record")
+            field = tag >> 3
+            if field == 3:
+                records.append(_read_record(data, offset, field_end))
+            elif field == 1:
+                keys.append(data[offset:field_end].decode("utf-8"))
+            offset = field_end
+    except IndexError:
+        raise ValueError("Truncated aggregated record") from None
+
+    return [(keys[index] if index < len(keys) else None, value) for index, value in records]
+
+
+def _read_record(data: bytes, offset: int, end: int) -> Tuple[int, bytes]:
+    index, value = 0, None
+    while offset < end:
+        tag = data[offset]
+        if tag < 0x80:
+            offset += 1
+        else:
+            tag, offset = _read_varint(data, offset)
+        wire_type = tag & 7
+        if wire_type == 0:
+            number, offset = _read_varint(data, offset)
+            if tag >> 3 == 1:
+                index = number
+        elif wire_type == 2:
+            length = data[offset]
+            if length < 0x80:
+                offset += 1
+            else:
+                length, offset = _read_varint(data, offset)
+            if offset + length > end:
+                raise ValueError("Truncated aggregated record")
+            if tag >> 3 == 3:
+                value = data[offset:offset + length]
+            offset += length
+        else:
+            raise ValueError(f"Unexpected wire type {wire_type} in aggregated record")
+    if value is None:
+        raise ValueError("Aggregated record without data")
+    return index, value
@@ -0,0 +1,295 @@
+"""
+Clock-Skew-Corrected Stamps
+
+A record is stamped on several hosts (the producer VM, the Lambda or Beam
+worker), and a latency between stamps from two hosts includes the skew
+between their wall clocks, which can be many milliseconds or worse. Every
+stamping host therefore estimates the offset from its monotonic clock to one
+reference clock, with NTP-style ping exchanges:
+
+    client     t1 = monotonic at send     ->   reference  t2 = wall at receive
+    client     t4 = monotonic at receive  <-   reference  t3 = wall at send
+
+    offset = ((t2 - t1) + (t3 - t4)) / 2
+    delay  = (t4 - t1) - (t3 - t2)
+
+Of a burst of pings, the one with the smallest delay wins (NTP's clock
+filter). The true offset is within delay / 2 of that estimate, and the bound
+grows by `max_drift_ppm` of the time since the sync.
+
+Because the offset is to the monotonic clock, stamps do not jump when the
+host's wall clock is stepped. A stamp goes into the record as two integers
+next to the stage's wall-clock `<stage>_timestamp`:
+
+    <stage>_ref_us     reference time, epoch microseconds (monotonic + offset)
+    <stage>_error_us   bound on the difference from the true reference time
+
+The latency between two stamps is then accurate to the sum of their errors.
+Hosts that are not synced (no reference, or none reachable yet) write no
+stamp, and reports fall back to the wall clock for them.
+
+The reference is any host running
+
+    python -m pipeline_common.clock serve --port 12300
+
+preferably one that is itself disciplined by chrony or Amazon Time Sync.
+Clients find it through `--clock-reference host:port` or the CLOCK_REFERENCE
+variable; `python -m pipeline_common.clock check host:port` prints the
+offset and delay seen from the current host.
+
+"""
+
+import argparse
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_PORT = 12300
+
+_MAGIC = b"CLK1"
+# magic, sequence, t1
+_REQUEST = struct.Struct("<4sIq")
+# magic, sequence, t1, t2, t3
+_RESPONSE = struct.Struct("<4sIqqq")
+
+
+def clock_fields(timestamp_field: str) -> Tuple[str, str]:
+    """Reference time and error columns of a stage, e.g. "ec2_timestamp" -> ("ec2_ref_us", "ec2_error_us")."""
+    stage = timestamp_field[:-len("_timestamp")] if timestamp_field.endswith("_timestamp") else timestamp_field
+    return f"{stage}_ref_us", f"{stage}_error_us"
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """"host:port" or "host" (default port)."""
+    host, _sep, port = address.rpartition(":")
+    if not host:
+        return address, DEFAULT_PORT
+    return host, int(port)
+
+
+class ReferenceServer:
+    """
+    Answers clock pings with its wall clock, from a daemon thread.
+
+    Args:
+        host: Address to bind.
+        port: UDP port; 0 picks a free one (see `address`).
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = DEFAULT_PORT):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.address = self.sock.getsockname()
+        self.answered = 0
+        self._thread = None
+
+    def serve_forever(self) -> None:
+        sock = self.sock
+        while True:
+            try:
+                data, peer = sock.recvfrom(64)
+            except OSError:
+                return  # closed
+            received = time.time_ns()
+            if len(data) != _REQUEST.size:
+                continue
+            magic, sequence, t1 = _REQUEST.unpack(data)
+            if magic != _MAGIC:
+                continue
+            sock.sendto(_RESPONSE.pack(_MAGIC, sequence, t1, received, time.time_ns()), peer)
+            self.answered += 1
+
+    def start(self) -> "ReferenceServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="clock-reference", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class ClockSync:
+    """
+    Offset of this host's monotonic clock from a reference clock.
+
+    Args:
+        reference: "host:port" of a `ReferenceServer`.
+        pings: Exchanges per sync; the one with the smallest delay is kept.
+        timeout_seconds: Wait for each reply. A timeout ends the sync early,
+            so an unreachable reference costs one timeout per attempt.
+        resync_seconds: Age after which `maybe_sync` (and the background
+            thread started by `start`) syncs again.
+        max_drift_ppm: Assumed worst frequency error of the monotonic clock,
+            added to the error bound as the sync ages.
+    """
+
+    def __init__(self, reference: str, pings: int = 8, timeout_seconds: float = 0.1,
+                 resync_seconds: float = 60.0, max_drift_ppm: float = 20.0):
+        self.reference = parse_address(reference)
+        self.pings = pings
+        self.timeout_seconds = timeout_seconds
+        self.resync_seconds = resync_seconds
+        self.max_drift_ppm = max_drift_ppm
+
+        self.offset_ns: Optional[int] = None
+        self.delay_ns: Optional[int] = None
+        self.synced_at_ns: Optional[int] = None
+        self.attempted_at_ns: Optional[int] = None
+        self.syncs = 0
+        self.failures = 0
+
+        self._sequence = 0
+        self._sock = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @property
+    def synced(self) -> bool:
+        return self.offset_ns is not None
+
+    def _socket(self) -> socket.socket:
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.connect(self.reference)
+        return self._sock
+
+    def _exchange(self, sock: socket.socket) -> Optional[Tuple[int, int]]:
+        """One ping; (offset, delay) in ns, or None on timeout."""
+        self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+        t1 = time.monotonic_ns()
+        sock.send(_REQUEST.pack(_MAGIC, self._sequence, t1))
+        deadline = t1 + int(self.timeout_seconds * 1e9)
+        while True:
+            remaining = deadline - time.monotonic_ns()
+            if remaining <= 0:
+                return None
+            sock.settimeout(remaining / 1e9)
+            try:
+                data = sock.recv(64)
+            except (socket.timeout, ConnectionRefusedError):
+                return None
+            t4 = time.monotonic_ns()
+            if len(data) != _RESPONSE.size:
+                continue
+            magic, sequence, echoed, t2, t3 = _RESPONSE.unpack(data)
+            # Late replies to earlier pings are skipped
+            if magic == _MAGIC and sequence == self._sequence and echoed == t1:
+                return ((t2 - t1) + (t3 - t4)) // 2, (t4 - t1) - (t3 - t2)
+
+    def sync(self) -> bool:
+        """
+        Runs one burst of pings and keeps the best estimate.
+
+        Returns:
+            bool: Whether any ping was answered. On failure the previous
+            estimate stays in use, its error bound still growing.
+        """
+        with self._lock:
+            self.attempted_at_ns = time.monotonic_ns()
+            best = None
+            try:
+                sock = self._socket()
+                for _ in range(self.pings):
+                    sample = self._exchange(sock)
+                    if sample is None:
+                        break
+                    if best is None or sample[1] < best[1]:
+                        best = sample
+            except OSError:
+                best = None
+            if best is None:
+                self.failures += 1
+                return False
+            self.offset_ns, self.delay_ns = best
+            self.synced_at_ns = time.monotonic_ns()
+            self.syncs += 1
+            return True
+
+    def maybe_sync(self) -> bool:
+        """Syncs if the last attempt is older than `resync_seconds`; for hosts without a background thread."""
+        last = self.attempted_at_ns
+        if last is None or time.monotonic_ns() - last >= self.resync_seconds * 1e9:
+            return self.sync()
+        return self.synced
+
+    def start(self) -> "ClockSync":
+        """Syncs now and then every `resync_seconds` from a daemon thread."""
+        self.sync()
+
+        def loop():
+            while not self._stopped.wait(self.resync_seconds):
+                self.sync()
+
+        threading.Thread(target=loop, name="clock-sync", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def now(self) -> Optional[Tuple[int, int]]:
+        """
+        Returns:
+            tuple: (reference time, error bound) in epoch microseconds, or
+            None before the first successful sync.
+        """
+        offset_ns, delay_ns, synced_at_ns = self.offset_ns, self.delay_ns, self.synced_at_ns
+        if offset_ns is None:
+            return None
+        mono = time.monotonic_ns()
+        error_ns = delay_ns / 2 + (mono - synced_at_ns) * self.max_drift_ppm / 1e6
+        return (mono + offset_ns) // 1000, int(error_ns // 1000) + 1
+
+    def stamp(self, record: Dict, timestamp_field: str) -> Dict:
+        """Adds the stage's reference time and error to the record, when synced."""
+        now = self.now()
+        if now is not None:
+            ref_field, error_field = clock_fields(timestamp_field)
+            record[ref_field], record[error_field] = now
+        return record
+
+
+def add_clock_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the clock reference option shared by the producers and the Beam reader."""
+    parser.add_argument('--clock-reference', dest='clock_reference', type=str,
+                        default=os.environ.get("CLOCK_REFERENCE"), required=False,
+                        help='host:port of a clock reference (python -m pipeline_common.clock serve); '
+                             'stamps carry skew-corrected times when set')
+
+
+def clock_from_args(args: argparse.Namespace) -> Optional[ClockSync]:
+    """A started ClockSync for `--clock-reference`, or None without one."""
+    if not args.clock_reference:
+        return None
+    return ClockSync(args.clock_reference).start()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Clock reference for skew-corrected pipeline stamps")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="answer clock pings")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    check = commands.add_parser("check", help="print this host's offset from a reference")
+    check.add_argument("reference", help="host:port")
+    check.add_argument("--pings", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = ReferenceServer(args.host, args.port)
+        print(f"Clock reference listening on {server.address[0]}:{server.address[1]}/udp")
+        server.serve_forever()
+        return
+
+    clock = ClockSync(args.reference, pings=args.pings, timeout_seconds=1.0)
+    if not clock.sync():
+        raise SystemExit(f"No reply from {args.reference}")
+    wall_offset_ms = (clock.now()[0] / 1000) - time.time() * 1000
+    print(f"reference - wall clock {wall_offset_ms:+.3f} ms  ±{clock.delay_ns / 2e6:.3f} ms  "
+          f"(round trip {clock.delay_ns / 1e6:.3f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Entry-ID Deduplication
+
+ThingSpeak polls overlap, so the same `entry_id` reaches every stage several
+times. Two filters drop those copies as early as possible:
+
+    EntryIdFilter  producers: a high-water mark over the monotonically
+                   increasing entry IDs plus an LRU of the most recent IDs
+    TTLSeenSet     Lambda / Beam sinks: a bounded set of IDs already written,
+                   each forgotten after a TTL
+
+Sinks must only `add` an ID once its write succeeded; otherwise a retried
+batch would drop the very records it is retrying.
+
+"""
+
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Union
+
+# A size, or a callable returning it; called only for dropped records, so
+# passed records never pay for measuring themselves
+Size = Union[int, Callable[[], int]]
+
+
+class DedupeStats:
+    """Counters for records passed and dropped, and the bytes not re-sent."""
+
+    def __init__(self):
+        self.passed = 0
+        self.dropped = 0
+        self.bytes_saved = 0
+
+    def record(self, duplicate: bool, size_bytes: Size = 0) -> None:
+        if duplicate:
+            self.dropped += 1
+            self.bytes_saved += size_bytes() if callable(size_bytes) else size_bytes
+        else:
+            self.passed += 1
+
+    def as_dict(self):
+        return {"passed": self.passed, "dropped": self.dropped, "bytes_saved": self.bytes_saved}
+
+    def __str__(self):
+        return f"passed={self.passed} dropped={self.dropped} bytes_saved={self.bytes_saved}"
+
+
+class EntryIdFilter:
+    """
+    Producer-side filter for a source whose entry IDs only ever increase.
+
+    IDs within `window` of the high-water mark are checked exactly against an
+    LRU of recently sent IDs; anything further below the mark is assumed to
+    have been sent already.
+
+    Args:
+        window: Number of recent entry IDs to remember.
+    """
+
+    def __init__(self, window: int = 10000):
+        self.window = window
+        self.high_water = None
+        self.recent = OrderedDict()
+        self.stats = DedupeStats()
+
+    def accept(self, entry_id: Optional[int], size_bytes: Size = 0) -> bool:
+        """
+        Returns True the first time an entry ID is offered, False for repeats.
+        An entry without an ID cannot be told apart from others and is always
+        accepted, without being remembered.
+        """
+        if entry_id is None:
+            self.stats.record(False)
+            return True
+        duplicate = entry_id in self.recent or (
+            self.high_water is not None and entry_id <= self.high_water - self.window)
+        self.stats.record(duplicate, size_bytes)
+        if duplicate:
+            return False
+
+        self.recent[entry_id] = None
+        if len(self.recent) > self.window:
+            self.recent.popitem(last=False)
+        if self.high_water is None or entry_id > self.high_water:
+            self.high_water = entry_id
+        return True
+
+
+class TTLSeenSet:
+    """
+    Bounded set of recently written keys; a key expires `ttl_seconds` after it
+    was added, and the oldest keys are evicted beyond `capacity`.
+    """
+
+    def __init__(self, capacity: int = 100000, ttl_seconds: float = 3600.0):
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.stats = DedupeStats()
+
+    def __contains__(self, key: Hashable) -> bool:
+        expires = self.entries.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self.entries[key]
+            return False
+        return True
+
+    def check(self, key: Hashable, size_bytes: Size = 0) -> bool:
+        """
+        Returns True (and counts a drop) if the key was already written.
+        """
+        duplicate = key in self
+        self.stats.record(duplicate, size_bytes)
+        return duplicate
+
+    def add(self, key: Hashable) -> None:
+        now = time.monotonic()
+        self.entries[key] = now + self.ttl_seconds
+        self.entries.move_to_end(key)
+        # Entries are kept in insertion order, so expired ones are at the front
+        while self.entries and (len(self.entries) > self.capacity
+                                or next(iter(self.entries.values())) < now):
+            self.entries.popitem(last=False)
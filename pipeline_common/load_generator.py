@@ -0,0 +1,253 @@
+"""
+Open-loop, Rate-controlled Load Generator
+
+Emits ThingSpeak-shaped records at a target events/sec, either synthetic or
+replayed from the result exports in `plots/`, following one of these profiles:
+
+    constant  fixed rate
+    ramp      linear from --rate to --peak-rate over --duration
+    step      --rate, raised by --rate every --step-seconds up to --peak-rate
+    poisson   exponential inter-arrival times around a mean of --rate
+    burst     --rate with --peak-rate bursts of --burst-seconds every --burst-period
+
+Scheduling is open-loop: every record has a send time fixed in advance, and a
+sink that falls behind does not push the schedule back. Records are sent late
+(never dropped), each one carries its `scheduled_timestamp`, and the generator
+reports how far behind the schedule the sink is, so a slow sink shows up as
+lag instead of quietly lowering the offered load.
+
+Usage (checks how fast the generator itself can go):
+    python -m pipeline_common.load_generator --source synthetic --profile ramp \
+        --rate 100 --peak-rate 50000 --duration 60 --sink null
+"""
+
+import argparse
+import csv
+import json
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional
+
+from pipeline_common.thingspeak import CREATED_AT_FORMAT, REVERSE_FIELD_MAPPING, synthetic_record
+
+PROFILES = ("constant", "ramp", "step", "poisson", "burst")
+
+# How long to wait before re-checking a profile whose current rate is zero
+IDLE_STEP_SECONDS = 0.01
+
+csv.field_size_limit(sys.maxsize)
+
+
+def rate_function(profile: str, rate: float, peak_rate: Optional[float] = None,
+                  duration: Optional[float] = None, step_seconds: float = 60.0,
+                  burst_seconds: float = 5.0, burst_period: float = 60.0) -> Callable[[float], float]:
+    """
+    Returns the target rate (events/sec) as a function of seconds since start.
+    """
+    peak_rate = rate if peak_rate is None else peak_rate
+
+    if profile in ("constant", "poisson"):
+        return lambda t: rate
+    if profile == "ramp":
+        if not duration:
+            raise ValueError("The ramp profile needs a --duration")
+        return lambda t: rate + (peak_rate - rate) * min(t / duration, 1.0)
+    if profile == "step":
+        return lambda t: min(rate * (1 + int(t // step_seconds)), peak_rate)
+    if profile == "burst":
+        return lambda t: peak_rate if (t % burst_period) < burst_seconds else rate
+    raise ValueError(f"Unknown load profile: {profile}")
+
+
+def arrival_offsets(rate_fn: Callable[[float], float], duration: Optional[float] = None,
+                    poisson: bool = False) -> Iterator[float]:
+    """
+    Yields scheduled send times, in seconds since start, for the given rate.
+
+    Args:
+        rate_fn: Target events/sec at a given offset.
+        duration: Stop after this many seconds; run forever when None.
+        poisson: Draw exponential gaps instead of evenly spaced ones.
+    """
+    t = 0.0
+    while duration is None or t < duration:
+        current = rate_fn(t)
+        if current <= 0:
+            t += IDLE_STEP_SECONDS
+            continue
+        t += random.expovariate(current) if poisson else 1.0 / current
+        if duration is not None and t >= duration:
+            return
+        yield t
+
+
+def synthetic_source(start_entry_id: int) -> Callable[[float], Dict]:
+    """Record factory for synthetic entries with consecutive entry IDs."""
+    next_id = [start_entry_id]
+
+    def make(scheduled_epoch: float) -> Dict:
+        record = synthetic_record(next_id[0], datetime.fromtimestamp(scheduled_epoch, timezone.utc))
+        next_id[0] += 1
+        return record
+    return make
+
+
+def load_recorded_feeds(paths: List[str]) -> List[Dict]:
+    """
+    Reads feed entries back out of AWS (DynamoDB) or GCP (Bigtable) result
+    exports, restoring the original ThingSpeak field names.
+
+    Returns:
+        list: Feed entries ordered by `created_at`, one per `entry_id`.
+    """
+    feeds = {}
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if "cf1" in row:
+                    message = json.loads(row["cf1"])
+                    row = message.get("message", message)
+                if not row.get("entry_id"):
+                    continue
+                feed = {"created_at": row.get("created_at"), "entry_id": int(row["entry_id"])}
+                for name, field in REVERSE_FIELD_MAPPING.items():
+                    if name in row:
+                        feed[field] = str(row[name])
+                feeds[feed["entry_id"]] = feed
+    return sorted(feeds.values(), key=lambda feed: (feed["created_at"] or "", feed["entry_id"]))
+
+
+def replay_source(paths: List[str]) -> Callable[[float], Dict]:
+    """
+    Record factory that plays recorded feeds back in order, looping over them.
+    Every pass shifts the entry IDs past the previous pass so replays are not
+    mistaken for duplicates, and every record's `created_at` becomes the time
+    it is offered: it is the event time downstream (windows, row keys), and
+    the recorded one would put every replayed record far behind the watermark.
+    """
+    feeds = load_recorded_feeds(paths)
+    if not feeds:
+        raise ValueError(f"No feed entries found in {paths}")
+    span = feeds[-1]["entry_id"] - feeds[0]["entry_id"] + 1
+    position = [0]
+
+    def make(scheduled_epoch: float) -> Dict:
+        replay_pass, index = divmod(position[0], len(feeds))
+        position[0] += 1
+        record = dict(feeds[index])
+        record["entry_id"] += replay_pass * span
+        record["created_at"] = datetime.fromtimestamp(scheduled_epoch, timezone.utc).strftime(CREATED_AT_FORMAT)
+        return record
+    return make
+
+
+def run_open_loop(send: Callable[[Dict], None], make_record: Callable[[float], Dict],
+                  offsets: Iterator[float], report_interval: float = 10.0,
+                  log: Callable[[str], None] = print) -> Dict:
+    """
+    Sends one record per scheduled offset, never waiting on the sink to set the pace.
+
+    Args:
+        send: Hands one record to the sink.
+        make_record: Builds the record for a scheduled epoch time.
+        offsets: Scheduled send times in seconds since start.
+        report_interval: Seconds between progress reports.
+        log: Where progress reports go.
+
+    Returns:
+        dict: Totals for the run (sent, elapsed seconds, max lag).
+    """
+    start = time.monotonic()
+    wall_start = time.time()
+    sent = 0
+    max_lag = window_max_lag = 0.0
+    window_sent = 0
+    next_report = start + report_interval
+
+    for offset in offsets:
+        due = start + offset
+        now = time.monotonic()
+        if due > now:
+            time.sleep(due - now)
+        else:
+            lag = now - due
+            window_max_lag = max(window_max_lag, lag)
+
+        scheduled_epoch = wall_start + offset
+        record = make_record(scheduled_epoch)
+        record["scheduled_timestamp"] = int(scheduled_epoch * 1000)
+        send(record)
+        sent += 1
+        window_sent += 1
+
+        now = time.monotonic()
+        if now >= next_report:
+            elapsed = now - (next_report - report_interval)
+            behind = " — sink is behind schedule" if window_max_lag > 1.0 else ""
+            log(f"[{datetime.now()}] offered {window_sent / elapsed:.0f} ev/s, "
+                f"max lag {window_max_lag * 1000:.0f} ms{behind}")
+            max_lag = max(max_lag, window_max_lag)
+            window_sent, window_max_lag = 0, 0.0
+            next_report = now + report_interval
+
+    max_lag = max(max_lag, window_max_lag)
+    elapsed = time.monotonic() - start
+    log(f"[{datetime.now()}] sent {sent} records in {elapsed:.1f}s "
+        f"({sent / elapsed if elapsed else 0:.0f} ev/s), max lag {max_lag * 1000:.0f} ms")
+    return {"sent": sent, "elapsed": elapsed, "max_lag": max_lag}
+
+
+def add_load_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the load-generator options shared by both producers."""
+    parser.add_argument('--source', dest='source', choices=['thingspeak', 'synthetic', 'replay'],
+                        default='thingspeak', required=False)
+    parser.add_argument('--profile', dest='profile', choices=PROFILES, default='constant', required=False)
+    parser.add_argument('--rate', dest='rate', type=float, default=100.0, required=False,
+                        help='target (base) events per second')
+    parser.add_argument('--peak-rate', dest='peak_rate', type=float, default=None, required=False)
+    parser.add_argument('--duration', dest='duration', type=float, default=None, required=False,
+                        help='seconds to run; forever when omitted')
+    parser.add_argument('--step-seconds', dest='step_seconds', type=float, default=60.0, required=False)
+    parser.add_argument('--burst-seconds', dest='burst_seconds', type=float, default=5.0, required=False)
+    parser.add_argument('--burst-period', dest='burst_period', type=float, default=60.0, required=False)
+    parser.add_argument('--replay-files', dest='replay_files', nargs='+', default=[], required=False)
+    parser.add_argument('--start-entry-id', dest='start_entry_id', type=int, default=None, required=False,
+                        help='first synthetic entry_id; defaults to the current epoch ms')
+
+
+def run_from_args(args: argparse.Namespace, send: Callable[[Dict], None],
+                  log: Callable[[str], None] = print) -> Dict:
+    """Runs the open-loop generator configured by `add_load_arguments`."""
+    if args.source == 'replay':
+        make_record = replay_source(args.replay_files)
+    else:
+        start_id = args.start_entry_id if args.start_entry_id is not None else int(time.time() * 1000)
+        make_record = synthetic_source(start_id)
+
+    rate_fn = rate_function(args.profile, args.rate, args.peak_rate, args.duration,
+                            args.step_seconds, args.burst_seconds, args.burst_period)
+    offsets = arrival_offsets(rate_fn, args.duration, poisson=args.profile == 'poisson')
+    return run_open_loop(send, make_record, offsets, log=log)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Open-loop ThingSpeak load generator")
+    add_load_arguments(parser)
+    parser.add_argument('--sink', dest='sink', choices=['stdout', 'null'], default='stdout')
+    args = parser.parse_args(argv)
+    if args.source == 'thingspeak':
+        parser.error("--source must be synthetic or replay")
+
+    if args.sink == 'stdout':
+        send = lambda record: sys.stdout.write(json.dumps(record) + "\n")
+        log = lambda line: print(line, file=sys.stderr)
+    else:
+        send = lambda record: None
+        log = print
+    run_from_args(args, send, log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Lightweight Pipeline Metrics
+
+Counters, gauges and HDR-style latency histograms cheap enough to update on
+every record, replacing the per-record prints:
+
+    REGISTRY.counter("records", stage="produce").inc()
+    with REGISTRY.histogram("stage_seconds", stage="encode").time():
+        payload = encode(entry)
+
+Histograms are log-linear: values (microseconds) are bucketed by power of two
+and each power of two is split into 64 linear sub-buckets, so every recorded
+value is kept to within 1/64 (~1.6%) whatever its magnitude, in a few KB.
+
+Exports:
+    openmetrics()   Prometheus / OpenMetrics text; `serve(port)` exposes it
+                    on http://<host>:<port>/metrics from a daemon thread
+    summary()       one log line with count and p50/p95/p99 per histogram
+    emf_line(...)   CloudWatch Embedded Metric Format line, for the Lambda,
+                    where printing it is the cheapest way to publish metrics
+
+Debug logging on the hot path goes through `SampledLog`, which only builds
+and emits one message in every N.
+
+"""
+
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+SUB_BUCKET_BITS = 7
+_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+# Upper bounds (seconds) of the cumulative buckets in the OpenMetrics export
+EXPORT_BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _bucket_index(value: int) -> int:
+    if value < 2 * _HALF:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * _HALF + (value >> shift)
+
+
+def _bucket_bounds(index: int) -> Tuple[int, int]:
+    """Lowest and highest value (inclusive) that land in a bucket."""
+    if index < 2 * _HALF:
+        return index, index
+    shift = index // _HALF - 1
+    mantissa = index - shift * _HALF
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    """
+    Log-linear latency histogram over microseconds.
+
+    `observe` takes seconds, `record_us` integer microseconds; quantiles come
+    back in seconds.
+    """
+
+    def __init__(self):
+        self.counts: List[int] = []
+        self.count = 0
+        self.total_us = 0
+        self.min_us: Optional[int] = None
+        self.max_us = 0
+        self._lock = threading.Lock()
+
+    def record_us(self, value_us: int, count: int = 1) -> None:
+        value_us = max(int(value_us), 0)
+        index = _bucket_index(value_us)
+        with self._lock:
+            counts = self.counts
+            if index >= len(counts):
+                counts.extend([0] * (index + 1 - len(counts)))
+            counts[index] += count
+            self.count += count
+            self.total_us += value_us * count
+            if self.min_us is None or value_us < self.min_us:
+                self.min_us = value_us
+            if value_us > self.max_us:
+                self.max_us = value_us
+
+    def observe(self, seconds: float) -> None:
+        self.record_us(seconds * 1_000_000)
+
+    def observe_since(self, start_ns: int) -> None:
+        """Records the time elapsed since a `time.perf_counter_ns()` reading."""
+        self.record_us((time.perf_counter_ns() - start_ns) // 1000)
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+    def merge(self, other: "Histogram") -> None:
+        for index, n in enumerate(other.counts):
+            if n:
+                low, high = _bucket_bounds(index)
+                self.record_us((low + high) // 2, n)
+
+    def quantile(self, q: float) -> float:
+        """Approximate q-quantile in seconds (the midpoint of its bucket)."""
+        if not self.count:
+            return float("nan")
+        rank = q * (self.count - 1)
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen > rank:
+                low, high = _bucket_bounds(index)
+                value = min(max((low + high) / 2, self.min_us), self.max_us)
+                return value / 1_000_000
+        return self.max_us / 1_000_000
+
+    def cumulative(self, bounds_seconds: Iterable[float]) -> List[int]:
+        """Number of values at or below each bound, for a Prometheus-style export."""
+        out = []
+        seen = 0
+        index = 0
+        counts = list(self.counts)
+        for bound in bounds_seconds:
+            limit = bound * 1_000_000
+            while index < len(counts) and _bucket_bounds(index)[1] <= limit:
+                seen += counts[index]
+                index += 1
+            out.append(seen)
+        return out
+
+
+class _Timer:
+    __slots__ = ("histogram", "start_ns")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe_since(self.start_ns)
+        return False
+
+
+class Registry:
+    """Named, labelled metrics of one process."""
+
+    def __init__(self):
+        self.metrics: Dict[Tuple[str, Labels], object] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name: str, labels: Dict[str, str]):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.setdefault(key, kind())
+        return metric
+
+    def _snapshot(self):
+        # Copied under the lock: another thread may be adding a metric
+        with self._lock:
+            return sorted(self.metrics.items(), key=lambda item: item[0])
+
+    def counter(self, name: str, **labels) -> Counter:
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name: str, **labels) -> Gauge:
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        return self._get(Histogram, name, labels)
+
+    def openmetrics(self) -> str:
+        """All metrics in the OpenMetrics text format."""
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        lines = []
+        typed = set()
+        for (name, labels), metric in self._snapshot():
+            if isinstance(metric, Histogram):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, n in zip(EXPORT_BOUNDS, metric.cumulative(EXPORT_BOUNDS)):
+                    lines.append(f"{name}_bucket{label_text(labels, [('le', repr(bound))])} {n}")
+                lines.append(f"{name}_bucket{label_text(labels, [('le', '+Inf')])} {metric.count}")
+                lines.append(f"{name}_sum{label_text(labels)} {metric.total_us / 1_000_000}")
+                lines.append(f"{name}_count{label_text(labels)} {metric.count}")
+            elif isinstance(metric, Counter):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}_total{label_text(labels)} {metric.value}")
+            else:
+                if name not in typed:
+                    lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name}{label_text(labels)} {metric.value}")
+            typed.add(name)
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """Counters, gauges and histogram percentiles (ms) on one line."""
+        parts = []
+        for (name, labels), metric in self._snapshot():
+            label = ",".join(v for _k, v in labels)
+            title = f"{name}[{label}]" if label else name
+            if isinstance(metric, Histogram):
+                if metric.count:
+                    parts.append(f"{title} n={metric.count} "
+                                 f"p50={metric.quantile(0.5) * 1000:.2f}ms "
+                                 f"p95={metric.quantile(0.95) * 1000:.2f}ms "
+                                 f"p99={metric.quantile(0.99) * 1000:.2f}ms")
+            else:
+                parts.append(f"{title}={metric.value:g}")
+        return " | ".join(parts)
+
+    def serve(self, port: int, host: str = "0.0.0.0"):
+        """Serves `openmetrics()` on /metrics from a daemon thread."""
+        # Imported here so the Lambda's cold start does not pay for it
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.openmetrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+
+# Process-wide registry used by the producers and the Lambda
+REGISTRY = Registry()
+
+
+def emf_line(namespace: str, dimensions: Dict[str, str], values: Dict[str, float],
+             units: Optional[Dict[str, str]] = None) -> str:
+    """
+    A CloudWatch Embedded Metric Format log line; CloudWatch turns every
+    value into a metric (with percentiles) without any API call.
+    """
+    units = units or {}
+    document = dict(dimensions)
+    document.update(values)
+    document["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [{
+            "Namespace": namespace,
+            "Dimensions": [list(dimensions)],
+            "Metrics": [{"Name": name, "Unit": units.get(name, "None")} for name in values],
+        }],
+    }
+    return json.dumps(document)
+
+
+class SampledLog:
+    """
+    Emits one message in every `every` calls. The message is passed as a
+    callable so skipped calls never pay for formatting it. Safe to share
+    between threads; picklable, as Beam ships it to the workers.
+    """
+
+    def __init__(self, log: Callable[[str], None], every: int = 1000):
+        self.log = log
+        self.every = max(int(every), 1)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, message: Callable[[], str]) -> None:
+        with self._lock:
+            self.calls += 1
+            emit = self.calls % self.every == 1 or self.every == 1
+        # Outside the lock: a slow log call must not hold up the other threads
+        if emit:
+            self.log(message())
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
@@ -0,0 +1,122 @@
+"""
+Record Normalization shared by the Lambda and the Beam reader
+
+Turns a batch of raw Kinesis or Kafka payloads (binary or JSON, see
+`pipeline_common.codec`) into stored records, with the same rules on both
+platforms so their latency exports compare like with like:
+
+    field1..field8        renamed via FIELD_MAPPING and parsed as numbers;
+                          empty or non-numeric values are left out
+    entry_id              required, int
+    created_at            kept as the ThingSpeak UTC string
+    producer timestamps   scheduled / ec2 / vm timestamp, as epoch ms, and
+                          the producer's clock stamp (ec2 / vm _ref_us and
+                          _error_us, see `pipeline_common.clock`)
+    arrival, processed    broker arrival time and processing time, as epoch
+                          ms, under the platform's own column names, plus
+                          the processing host's clock stamp when synced
+    anything else         dropped
+
+Every raw key is resolved through one precompiled table, and the processing
+time is read once per batch rather than once per record.
+
+"""
+
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from pipeline_common.clock import ClockSync, clock_fields
+from pipeline_common.codec import STAMP_FIELDS, Buffer, decode, epoch_ms
+from pipeline_common.thingspeak import FIELD_MAPPING
+
+# What to do with each raw key
+_SENSOR, _ENTRY_ID, _CREATED_AT, _STAMP = range(4)
+
+KEY_TABLE: Dict[str, Tuple[str, int]] = {raw: (name, _SENSOR) for raw, name in FIELD_MAPPING.items()}
+KEY_TABLE["entry_id"] = ("entry_id", _ENTRY_ID)
+KEY_TABLE["created_at"] = ("created_at", _CREATED_AT)
+KEY_TABLE.update({name: (name, _STAMP) for name in STAMP_FIELDS})
+
+
+def normalize_record(raw: Dict, number: Callable = float) -> Dict:
+    """
+    Normalizes one decoded payload (without the arrival/processed stamps).
+
+    Args:
+        raw: Decoded ThingSpeak entry.
+        number: Numeric type for sensor values; called with the value's text.
+
+    Returns:
+        dict: The normalized record.
+
+    Raises:
+        KeyError: The entry has no entry_id.
+        ValueError: entry_id or a timestamp is malformed.
+    """
+    record = {}
+    table = KEY_TABLE
+    for key, value in raw.items():
+        spec = table.get(key)
+        if spec is None or value is None:
+            continue
+        name, kind = spec
+        if kind == _SENSOR:
+            try:
+                value = number(value if value.__class__ is str else repr(value))
+            except (ValueError, ArithmeticError):
+                # Empty or non-numeric readings are left out
+                continue
+            # NaN is the only value not equal to itself; DynamoDB rejects it
+            if value == value:
+                record[name] = value
+        elif kind == _ENTRY_ID:
+            record[name] = int(value)
+        elif kind == _CREATED_AT:
+            record[name] = value
+        else:
+            record[name] = epoch_ms(value)
+
+    if "entry_id" not in record:
+        raise KeyError("entry_id")
+    return record
+
+
+def normalize_batch(payloads: Sequence[Buffer], arrival_ms: Sequence[int],
+                    arrival_field: str, processed_field: str,
+                    number: Callable = float,
+                    clock: Optional[ClockSync] = None) -> Tuple[List[Optional[Dict]], Dict[int, Exception]]:
+    """
+    Decodes and normalizes a batch of payloads.
+
+    Args:
+        payloads: Raw record payloads.
+        arrival_ms: Broker arrival time of each payload, epoch ms.
+        arrival_field: Column for the arrival time (e.g. "kafka_timestamp").
+        processed_field: Column for the processing time (e.g. "beam_timestamp").
+        number: Numeric type for sensor values (`Decimal` for DynamoDB).
+        clock: Adds its stamp for processed_field (e.g. "beam_ref_us" and
+            "beam_error_us") to every record, once it is synced.
+
+    Returns:
+        tuple: Records in input order, with None for payloads that could not
+        be normalized, and the error for each of those by index.
+    """
+    processed_ms = time.time_ns() // 1_000_000
+    clock_stamp = clock.now() if clock is not None else None
+    if clock_stamp is not None:
+        ref_field, error_field = clock_fields(processed_field)
+    records: List[Optional[Dict]] = []
+    errors: Dict[int, Exception] = {}
+    for i, (payload, arrived) in enumerate(zip(payloads, arrival_ms)):
+        try:
+            record = normalize_record(decode(payload), number)
+        except Exception as e:
+            records.append(None)
+            errors[i] = e
+            continue
+        record[arrival_field] = int(arrived)
+        record[processed_field] = processed_ms
+        if clock_stamp is not None:
+            record[ref_field], record[error_field] = clock_stamp
+        records.append(record)
+    return records, errors
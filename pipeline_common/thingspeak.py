@@ -0,0 +1,267 @@
+"""
+ThingSpeak records and fetcher
+
+Field mapping of the weather-station channel (12397) used by both pipelines
+and a generator for synthetic feed entries in the same shape: `created_at`,
+an integer `entry_id` and `field1`..`field8` carried as strings.
+
+`ThingSpeakFetcher` reads the channel through one pooled keep-alive session:
+
+    fetch_new  entries after the last one seen (ThingSpeak `start=`), so a
+               poll only downloads what was added since the previous poll
+    backfill   a historical date range split into pages that are fetched
+               concurrently under a request-rate limit and yielded in order
+
+"""
+
+import argparse
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional
+
+CHANNEL_ID = 12397
+FEEDS_URL = "https://api.thingspeak.com/channels/{channel_id}/feeds.json"
+
+# ThingSpeak returns at most this many entries per request
+MAX_RESULTS = 8000
+# Format of the `start` / `end` query parameters (UTC)
+QUERY_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+CREATED_AT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+FIELD_MAPPING: Dict[str, str] = {
+    "field1": "wind_direction",
+    "field2": "wind_speed",
+    "field3": "humidity_percent",
+    "field4": "temperature_fahrenheit",
+    "field5": "rain_inches_per_minute",
+    "field6": "pressure_inhg",
+    "field7": "power_level_volts",
+    "field8": "light_intensity"
+}
+
+REVERSE_FIELD_MAPPING: Dict[str, str] = {v: k for k, v in FIELD_MAPPING.items()}
+
+
+def synthetic_record(entry_id: int, created_at: datetime) -> Dict:
+    """
+    Builds a feed entry with plausible values for every sensor field.
+
+    Args:
+        entry_id: Entry ID to assign.
+        created_at: Creation time of the entry (UTC).
+
+    Returns:
+        dict: ThingSpeak-shaped feed entry.
+    """
+    return {
+        "created_at": created_at.strftime(CREATED_AT_FORMAT),
+        "entry_id": entry_id,
+        "field1": str(random.randint(0, 359)),
+        "field2": f"{random.uniform(0, 10):.1f}",
+        "field3": str(random.randint(20, 100)),
+        "field4": f"{random.uniform(30, 90):.1f}",
+        "field5": "0",
+        "field6": f"{random.uniform(29.5, 30.5):.2f}",
+        "field7": f"{random.uniform(4.0, 4.2):.3f}",
+        "field8": str(random.randint(0, 1500)),
+    }
+
+
+def parse_created_at(value: str) -> datetime:
+    """Parses a ThingSpeak `created_at` (or a plain ISO date) as UTC."""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+class RateLimiter:
+    """
+    Spaces calls at least `1 / requests_per_second` apart across all threads.
+    """
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ThingSpeakFetcher:
+    """
+    Reads feed entries of a ThingSpeak channel over a pooled HTTP session.
+
+    The session keeps connections alive between polls and retries throttled
+    (429) and server-side (5xx) responses with exponential backoff.
+
+    Args:
+        channel_id: ThingSpeak channel to read.
+        results: Entries requested by the first poll, before anything was seen.
+        timeout: Per-request timeout in seconds.
+        pool_size: Connections kept open to the API host.
+        requests_per_second: Request-rate limit shared by every call.
+        api_key: Read API key, for private channels.
+    """
+
+    def __init__(self, channel_id: int = CHANNEL_ID, results: int = 100, timeout: float = 10.0,
+                 pool_size: int = 8, requests_per_second: float = 4.0,
+                 api_key: Optional[str] = None):
+        self.url = FEEDS_URL.format(channel_id=channel_id)
+        self.results = results
+        self.timeout = timeout
+        self.api_key = api_key
+        self.rate_limiter = RateLimiter(requests_per_second)
+
+        # Imported here: the Lambda and Beam workers only need the field mapping
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # Position of the newest entry returned so far
+        self.last_entry_id: Optional[int] = None
+        self.last_created_at: Optional[datetime] = None
+
+    def get_feeds(self, **params) -> List[Dict]:
+        """
+        One rate-limited request to the feeds endpoint.
+
+        Returns:
+            list: Feed entries in ascending `entry_id` order.
+        """
+        if self.api_key:
+            params["api_key"] = self.api_key
+        self.rate_limiter.acquire()
+        response = self.session.get(self.url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get("feeds") or []
+
+    def fetch_new(self) -> List[Dict]:
+        """
+        Returns the entries added since the previous call.
+
+        The first call returns the latest `results` entries. Later calls ask
+        for everything from the last seen `created_at` on (`start` is
+        inclusive and only has second resolution, so entries up to the last
+        seen `entry_id` are dropped), paging until the channel is caught up.
+        """
+        if self.last_created_at is None:
+            feeds = self.get_feeds(results=self.results)
+        else:
+            feeds = []
+            start = self.last_created_at
+            while True:
+                page = self.get_feeds(start=start.strftime(QUERY_TIME_FORMAT), results=MAX_RESULTS)
+                feeds.extend(page)
+                if len(page) < MAX_RESULTS:
+                    break
+                next_start = parse_created_at(page[-1]["created_at"])
+                # A full page within one second cannot be paged any further
+                start = next_start if next_start > start else start + timedelta(seconds=1)
+
+        if self.last_entry_id is not None:
+            feeds = [feed for feed in feeds if feed["entry_id"] > self.last_entry_id]
+        if feeds:
+            self.last_entry_id = feeds[-1]["entry_id"]
+            self.last_created_at = parse_created_at(feeds[-1]["created_at"])
+        return feeds
+
+    def fetch_range(self, start: datetime, end: datetime) -> List[Dict]:
+        """
+        Returns every entry created in [start, end], both ends inclusive.
+
+        A page that comes back full was truncated by the API, so the range is
+        halved and each half fetched separately.
+        """
+        feeds = self.get_feeds(start=start.strftime(QUERY_TIME_FORMAT),
+                               end=end.strftime(QUERY_TIME_FORMAT), results=MAX_RESULTS)
+        if len(feeds) < MAX_RESULTS or end - start < timedelta(seconds=2):
+            return feeds
+        middle = start + (end - start) / 2
+        middle = middle.replace(microsecond=0)
+        return self.fetch_range(start, middle) + self.fetch_range(middle + timedelta(seconds=1), end)
+
+    def backfill(self, start: datetime, end: datetime, page: timedelta = timedelta(hours=6),
+                 concurrency: int = 4) -> Iterator[List[Dict]]:
+        """
+        Streams the history between `start` and `end` page by page.
+
+        Up to `concurrency` pages are fetched at once (every request still
+        goes through the rate limiter), and pages are yielded in time order
+        as soon as they and all earlier pages have arrived.
+
+        Args:
+            start: First creation time to include (UTC).
+            end: Last creation time to include (UTC).
+            page: Time span requested per page.
+            concurrency: Pages fetched in parallel.
+
+        Yields:
+            list: Feed entries of one page, in ascending `entry_id` order.
+        """
+        def pages():
+            page_start = start
+            while page_start <= end:
+                page_end = min(page_start + page - timedelta(seconds=1), end)
+                yield page_start, page_end
+                page_start = page_end + timedelta(seconds=1)
+
+        last_entry_id = None
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="thingspeak-backfill") as pool:
+            pending = deque()
+            for page_start, page_end in pages():
+                pending.append(pool.submit(self.fetch_range, page_start, page_end))
+                # Bound read-ahead so a slow consumer does not buffer the whole range
+                if len(pending) >= 2 * concurrency:
+                    feeds, last_entry_id = self._new_entries(pending.popleft().result(), last_entry_id)
+                    yield feeds
+            while pending:
+                feeds, last_entry_id = self._new_entries(pending.popleft().result(), last_entry_id)
+                yield feeds
+
+    @staticmethod
+    def _new_entries(feeds: List[Dict], last_entry_id: Optional[int]):
+        if last_entry_id is not None:
+            feeds = [feed for feed in feeds if feed["entry_id"] > last_entry_id]
+        return feeds, (feeds[-1]["entry_id"] if feeds else last_entry_id)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def add_backfill_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the historical backfill options shared by both producers."""
+    parser.add_argument('--backfill-start', dest='backfill_start', type=parse_created_at, default=None,
+                        required=False, help='replay ThingSpeak history from this UTC time, then exit')
+    parser.add_argument('--backfill-end', dest='backfill_end', type=parse_created_at, default=None,
+                        required=False, help='end of the backfill range; defaults to now')
+    parser.add_argument('--backfill-page-hours', dest='backfill_page_hours', type=float, default=6.0,
+                        required=False)
+    parser.add_argument('--backfill-concurrency', dest='backfill_concurrency', type=int, default=4,
+                        required=False)
+    parser.add_argument('--thingspeak-rate', dest='thingspeak_rate', type=float, default=4.0,
+                        required=False, help='ThingSpeak requests per second')
+
+
+def backfill_from_args(fetcher: ThingSpeakFetcher, args: argparse.Namespace) -> Iterator[List[Dict]]:
+    """Runs the backfill configured by `add_backfill_arguments`."""
+    end = args.backfill_end or datetime.now(timezone.utc)
+    return fetcher.backfill(args.backfill_start, end, page=timedelta(hours=args.backfill_page_hours),
+                            concurrency=args.backfill_concurrency)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+analytics.py  Per-stage latency analytics over the pipeline result exports
+
+Streams an export row by row (the GCP Bigtable export carries multi-line JSON
+in its `cf1` column, so it is read with the csv module rather than pandas),
+parses every stage timestamp exactly once into columnar float64 NumPy arrays
+of epoch milliseconds, and derives per-stage / end-to-end latency percentiles
+and throughput per time bucket from those arrays.
+
+Stamps from different hosts disagree by their clock skew. Records stamped
+with a clock reference (`pipeline_common.clock`: `<stage>_ref_us` and
+`<stage>_error_us`) also get skew-corrected latencies, each with an error
+bound. A percentile of the corrected latencies is reported with the range
+the true percentile must lie in: the same percentile of latency - error and
+of latency + error.
+
+Inputs:
+    AWS_result.csv   DynamoDB export, one column per attribute
+    GCP_result.csv   Bigtable export, `_key` + JSON `cf1` message
+
+Usage:
+    python analytics.py AWS_result.csv GCP_result.csv [--bucket 60] [--service-clock-error-ms 1]
+"""
+
+import argparse, csv, json, sys
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+
+AWS, GCP = "aws", "gcp"
+
+# Timestamp columns per platform, in pipeline order
+TIMESTAMP_COLUMNS = {
+    AWS: ["created_at", "ec2_timestamp", "kinesis_timestamp", "lambda_timestamp", "dynamodb_timestamp"],
+    GCP: ["created_at", "vm_timestamp", "kafka_timestamp", "beam_timestamp"],
+}
+
+# (stage name, start column, end column)
+STAGES = {
+    AWS: [("ec2→kinesis",     "ec2_timestamp",     "kinesis_timestamp"),
+          ("kinesis→lambda",  "kinesis_timestamp", "lambda_timestamp"),
+          ("lambda→dynamodb", "lambda_timestamp",  "dynamodb_timestamp")],
+    GCP: [("vm→kafka",        "vm_timestamp",      "kafka_timestamp"),
+          ("kafka→beam",      "kafka_timestamp",   "beam_timestamp")],
+}
+
+# End-to-end runs from the first stamp that exists on the ingest side to the
+# final write. AWS exports from before ec2_timestamp was persisted only carry
+# the Kinesis arrival time.
+END_TO_END = {
+    AWS: (["ec2_timestamp", "kinesis_timestamp"], "dynamodb_timestamp"),
+    GCP: (["vm_timestamp"], "beam_timestamp"),
+}
+
+# Clock-reference stamp prefix of the timestamps taken on a synced host
+CLOCK_STAMPS = {
+    AWS: {"ec2_timestamp": "ec2", "lambda_timestamp": "lambda"},
+    GCP: {"vm_timestamp": "vm", "beam_timestamp": "beam"},
+}
+# Kafka's CreateTime is the producer's wall clock, so it is corrected with the
+# producer's offset (its ms truncation adds 1 ms to the error). Other broker
+# stamps, like the Kinesis arrival time, are the service's clock, taken as
+# accurate to --service-clock-error-ms.
+SHARED_CLOCK = {"kafka_timestamp": "vm"}
+WALL_TRUNCATION_MS = 1.0
+
+# Corrected end-to-end: producer stamp to processing stamp
+CORRECTED_END_TO_END = {
+    AWS: ("ec2_timestamp", "lambda_timestamp"),
+    GCP: ("vm_timestamp", "beam_timestamp"),
+}
+
+PERCENTILES = (50, 95, 99)
+
+csv.field_size_limit(sys.maxsize)
+
+
+def parse_timestamp_ms(value):
+    """Epoch milliseconds for an epoch-ms number or an ISO-8601 string; NaN if absent."""
+    if value is None or value == "":
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp() * 1000.0
+
+
+def detect_platform(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f))
+    return GCP if "cf1" in header else AWS
+
+
+def _iter_records(path, platform):
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if platform == AWS:
+            yield from reader
+        else:
+            for row in reader:
+                message = json.loads(row["cf1"])
+                yield message.get("message", message)
+
+
+def load_export(path, platform=None):
+    """
+    Reads an export into columnar arrays without materialising it in memory.
+
+    Returns:
+        dict: column name -> float64 array of epoch ms (NaN where missing),
+              the clock-reference stamps in µs, and `entry_id`, all float64
+              with NaN where missing.
+    """
+    platform = platform or detect_platform(path)
+    columns = TIMESTAMP_COLUMNS[platform]
+    clock_columns = [f"{prefix}_{suffix}" for prefix in CLOCK_STAMPS[platform].values()
+                     for suffix in ("ref_us", "error_us")]
+    buffers = {c: array("d") for c in columns + clock_columns + ["entry_id"]}
+
+    for record in _iter_records(path, platform):
+        for c in columns:
+            buffers[c].append(parse_timestamp_ms(record.get(c)))
+        for c in clock_columns:
+            value = record.get(c)
+            buffers[c].append(float(value) if value not in (None, "") else np.nan)
+        entry_id = record.get("entry_id")
+        buffers["entry_id"].append(float(entry_id) if entry_id not in (None, "") else np.nan)
+
+    data = {c: np.frombuffer(buf, dtype=np.float64) for c, buf in buffers.items()}
+    data["platform"] = platform
+    return data
+
+
+def _first_present(data, candidates):
+    out = np.full(len(data["entry_id"]), np.nan)
+    for c in reversed(candidates):
+        col = data.get(c)
+        if col is not None:
+            out = np.where(np.isnan(col), out, col)
+    return out
+
+
+def stage_latencies(data):
+    """Per-stage and end-to-end latency arrays in ms (NaN where a stamp is missing)."""
+    platform = data["platform"]
+    latencies = {name: data[end] - data[start] for name, start, end in STAGES[platform]}
+    starts, end = END_TO_END[platform]
+    latencies["end_to_end"] = data[end] - _first_present(data, starts)
+    return latencies
+
+
+def latency_summary(data, percentiles=PERCENTILES):
+    """
+    Returns:
+        dict: stage -> {"count": n, "p50": ..., "p95": ..., "p99": ...} in ms.
+    """
+    summary = {}
+    for stage, values in stage_latencies(data).items():
+        values = values[~np.isnan(values)]
+        stats = {"count": int(values.size)}
+        pct = np.percentile(values, percentiles) if values.size else [np.nan] * len(percentiles)
+        stats.update({f"p{p}": float(v) for p, v in zip(percentiles, pct)})
+        summary[stage] = stats
+    return summary
+
+
+def corrected_time(data, column, service_clock_error_ms=1.0):
+    """
+    Reference-clock time of a stamp and its error bound, in ms.
+
+    Returns:
+        (time_ms, error_ms) arrays; NaN where the record has no
+        clock-reference stamp to correct this one with.
+    """
+    platform = data["platform"]
+    prefix = CLOCK_STAMPS[platform].get(column)
+    if prefix is not None:
+        ref, error = data.get(f"{prefix}_ref_us"), data.get(f"{prefix}_error_us")
+        if ref is None:
+            nan = np.full(len(data["entry_id"]), np.nan)
+            return nan, nan
+        return ref / 1000.0, error / 1000.0
+
+    prefix = SHARED_CLOCK.get(column)
+    if prefix is not None:
+        wall = next(c for c, p in CLOCK_STAMPS[platform].items() if p == prefix)
+        producer_ms, producer_error_ms = corrected_time(data, wall)
+        offset = producer_ms - data[wall]
+        return data[column] + offset, producer_error_ms + WALL_TRUNCATION_MS
+
+    return data[column], np.full(len(data[column]), float(service_clock_error_ms))
+
+
+def corrected_latencies(data, service_clock_error_ms=1.0):
+    """
+    Skew-corrected per-stage and end-to-end latencies.
+
+    Returns:
+        dict: stage -> (latency_ms, error_ms) arrays, NaN where a stamp of
+        the stage is missing or cannot be corrected.
+    """
+    platform = data["platform"]
+    pairs = [(name, start, end) for name, start, end in STAGES[platform]]
+    pairs.append(("end_to_end",) + CORRECTED_END_TO_END[platform])
+    out = {}
+    for name, start, end in pairs:
+        if start not in data or end not in data:
+            continue
+        start_ms, start_error = corrected_time(data, start, service_clock_error_ms)
+        end_ms, end_error = corrected_time(data, end, service_clock_error_ms)
+        out[name] = (end_ms - start_ms, start_error + end_error)
+    return out
+
+
+def corrected_summary(data, percentiles=PERCENTILES, service_clock_error_ms=1.0):
+    """
+    Percentiles of the corrected latencies with bounds on the true values.
+
+    Returns:
+        dict: stage -> {"count", "p50", "p50_low", "p50_high", ..., "error_max",
+        "skew"} in ms, for the stages with corrected records; `skew` is the
+        median of raw minus corrected latency over those records.
+    """
+    raw = stage_latencies(data)
+    raw["end_to_end"] = (data[CORRECTED_END_TO_END[data["platform"]][1]]
+                         - data[CORRECTED_END_TO_END[data["platform"]][0]])
+    summary = {}
+    for stage, (latency, error) in corrected_latencies(data, service_clock_error_ms).items():
+        keep = ~np.isnan(latency) & ~np.isnan(error)
+        if not keep.any():
+            continue
+        latency, error = latency[keep], error[keep]
+        stats = {"count": int(latency.size)}
+        for p, mid, low, high in zip(percentiles, np.percentile(latency, percentiles),
+                                     np.percentile(latency - error, percentiles),
+                                     np.percentile(latency + error, percentiles)):
+            stats.update({f"p{p}": float(mid), f"p{p}_low": float(low), f"p{p}_high": float(high)})
+        stats["error_max"] = float(error.max())
+        skew = raw[stage][keep] - latency
+        skew = skew[~np.isnan(skew)]
+        stats["skew"] = float(np.median(skew)) if skew.size else np.nan
+        summary[stage] = stats
+    return summary
+
+
+def _bucket_index(times_ms, bucket_seconds):
+    valid = ~np.isnan(times_ms)
+    t0 = np.nanmin(times_ms) if valid.any() else 0.0
+    idx = np.full(times_ms.shape, -1, dtype=np.int64)
+    idx[valid] = ((times_ms[valid] - t0) // (bucket_seconds * 1000.0)).astype(np.int64)
+    return t0, idx
+
+
+def throughput(data, column=None, bucket_seconds=60):
+    """
+    Events per second in fixed buckets of the given timestamp column
+    (defaults to the final write stamp).
+
+    Returns:
+        (bucket_start_ms, events_per_second) arrays.
+    """
+    column = column or END_TO_END[data["platform"]][1]
+    t0, idx = _bucket_index(data[column], bucket_seconds)
+    counts = np.bincount(idx[idx >= 0]) if (idx >= 0).any() else np.zeros(0, dtype=np.int64)
+    starts = t0 + np.arange(counts.size) * bucket_seconds * 1000.0
+    return starts, counts / float(bucket_seconds)
+
+
+def load_latency_curve(data, stage="end_to_end", bucket_seconds=60, percentile=95):
+    """
+    Offered load vs latency: for every bucket of the final write stamp, the
+    events/minute written and the given latency percentile of that bucket.
+
+    Returns:
+        (events_per_minute, latency_ms) arrays sorted by load.
+    """
+    latency = stage_latencies(data)[stage]
+    _t0, idx = _bucket_index(data[END_TO_END[data["platform"]][1]], bucket_seconds)
+    keep = (idx >= 0) & ~np.isnan(latency)
+    idx, latency = idx[keep], latency[keep]
+    if not idx.size:
+        return np.zeros(0), np.zeros(0)
+
+    order = np.argsort(idx, kind="stable")
+    idx, latency = idx[order], latency[order]
+    buckets, first = np.unique(idx, return_index=True)
+    groups = np.split(latency, first[1:])
+    load = np.array([g.size for g in groups]) * (60.0 / bucket_seconds)
+    lat = np.array([np.percentile(g, percentile) for g in groups])
+    order = np.argsort(load, kind="stable")
+    return load[order], lat[order]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("exports", nargs="+")
+    parser.add_argument("--bucket", type=int, default=60, help="throughput bucket (seconds)")
+    parser.add_argument("--service-clock-error-ms", type=float, default=1.0,
+                        help="error bound of broker arrival stamps (e.g. Kinesis) against the clock reference")
+    args = parser.parse_args(argv)
+
+    for path in args.exports:
+        data = load_export(path)
+        print(f"\n=== {path} ({data['platform'].upper()}, {len(data['entry_id'])} records) ===")
+        for stage, stats in latency_summary(data).items():
+            print(f"  {stage:<16} n={stats['count']:<8} "
+                  + "  ".join(f"p{p}={stats[f'p{p}']:.1f}ms" for p in PERCENTILES))
+        corrected = corrected_summary(data, service_clock_error_ms=args.service_clock_error_ms)
+        if corrected:
+            print("  skew-corrected (clock reference; true value within the range):")
+        for stage, stats in corrected.items():
+            print(f"  {stage:<16} n={stats['count']:<8} "
+                  + "  ".join(f"p{p}={stats[f'p{p}']:.1f}ms [{stats[f'p{p}_low']:.1f}, {stats[f'p{p}_high']:.1f}]"
+                              for p in PERCENTILES)
+                  + f"  error≤{stats['error_max']:.2f}ms  skew={stats['skew']:+.1f}ms")
+        _starts, eps = throughput(data, bucket_seconds=args.bucket)
+        if eps.size:
+            print(f"  throughput      mean={eps.mean():.2f} ev/s  peak={eps.max():.2f} ev/s "
+                  f"({args.bucket}s buckets)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+capacity_sim.py  Capacity and cost simulator for both pipelines
+
+Replays a load trace (events/sec per time step, measured from a result export
+or synthetic) through a fluid model of each pipeline and reports, per step,
+end-to-end latency, backlog, provisioned/used resources and cost:
+
+    AWS  producer → Kinesis shards → Lambda pollers (batch size, batching
+         window, parallelization factor) → DynamoDB on-demand writes
+    GCP  producer → Kafka partitions → Dataflow workers (autoscaled on
+         throughput and backlog, with a reaction lag) → Bigtable nodes
+
+Every configuration parameter may be a scalar or an array; arrays are
+broadcast to one simulated configuration each, and the time loop runs once
+over all of them, so a sweep of thousands of configurations takes seconds.
+Latency per step is the mean latency of the events arriving in that step.
+Within a step, a record's latency is modelled as a fixed part plus a batch
+wait, uniform up to the time a batch takes to close, plus a queueing wait,
+exponential around the M/D/1 mean; summary percentiles are those of every
+record, i.e. of the event-weighted mixture of the steps' distributions.
+
+Model constants (per-record CPU cost, service limits, list prices) are in
+AWS_DEFAULTS, GCP_DEFAULTS and PRICES; per-record costs come from the
+benchmarks in ../benchmarks, prices are on-demand list prices (us-east-1,
+us-central1, 2025). `--billing GCP-billing-info.csv` prints the measured GCP
+bill next to the simulated one for the same resources.
+
+Usage:
+    python capacity_sim.py aws --trace AWS_result.csv --scale 200 --shards 1 2 4 8 \
+        --batch-size 10 100 500 --parallelization 1 2 5 --slo-ms 2000
+    python capacity_sim.py gcp --profile burst --rate 2000 --peak-rate 20000 --hours 6 \
+        --partitions 1 4 8 16 --bigtable-nodes 1 2 3 --max-workers 2 5 10
+"""
+
+import argparse, csv, inspect, itertools, os, sys
+
+import numpy as np
+
+import analytics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pipeline_common.load_generator import PROFILES, rate_function
+
+PRICES = {
+    "kinesis_shard_hour":         0.015,
+    "kinesis_put_unit_million":   0.014,      # per million 25 KB PUT payload units
+    "lambda_request_million":     0.20,
+    "lambda_gb_second":           0.0000166667,
+    "dynamodb_wru_million":       0.625,      # on-demand, per million 1 KB writes
+    "kafka_vcpu_hour":            0.09,
+    "kafka_gib_hour":             0.02,
+    "dataflow_vcpu_hour":         0.069,
+    "dataflow_gb_hour":           0.003557,
+    "dataflow_streaming_gb":      0.018,      # Streaming Engine, per GB processed
+    "bigtable_node_hour":         0.65,
+}
+
+AWS_DEFAULTS = {
+    "record_bytes":         100,     # binary payload (pipeline_common/codec.py)
+    "shards":               1,
+    "parallelization":      1,       # concurrent Lambda pollers per shard, 1-10
+    "batch_size":           100,
+    "batching_window_s":    1.0,
+    "lambda_memory_gb":     0.128,
+    "invoke_overhead_s":    0.005,
+    "per_record_s":         18e-6,   # decode + normalize at one full vCPU, measured
+    "ddb_call_s":           0.008,   # one BatchWriteItem of up to 25 items
+    "ddb_max_wru":          40000,   # per-table on-demand write ceiling
+    "put_latency_s":        0.02,
+    "poll_interval_s":      1.0,     # GetRecords cadence of an idle poller
+}
+
+GCP_DEFAULTS = {
+    "record_bytes":         100,
+    "partitions":           1,
+    "kafka_vcpus":          4,
+    "kafka_gib":            8,
+    "kafka_mb_per_vcpu":    20.0,    # broker ingress per vCPU, MB/s
+    "partition_mb":         10.0,    # write ceiling of one partition, MB/s
+    "linger_s":             0.005,
+    "ack_s":                0.015,
+    "min_workers":          1,
+    "max_workers":          10,
+    "worker_vcpus":         2,
+    "worker_gb":            7.5,
+    "eps_per_vcpu":         4000,    # records/s one reader thread decodes and writes
+    "target_utilization":   0.8,
+    "scale_lag_s":          180,     # autoscaler reaction time
+    "drain_s":              300,     # backlog the autoscaler aims to clear in this time
+    "max_batch_messages":   500,
+    "poll_timeout_s":       1.0,
+    "flush_age_s":          1.0,
+    "bigtable_nodes":       1,
+    "writes_per_node":      10000,
+    "bigtable_write_s":     0.006,
+}
+
+# Highest utilization used in the queueing-delay approximation
+MAX_UTILIZATION = 0.95
+
+
+# ---------------------------------------------------------------- traces ---
+
+def trace_from_export(path, step_seconds=60, platform=None):
+    """
+    Events/sec per step at the ingest stamp of a result export (the earliest
+    producer-side stamp that the export carries).
+
+    Returns:
+        float64 array, one rate per step.
+    """
+    return trace_from_data(analytics.load_export(path, platform), step_seconds)
+
+
+def trace_from_data(data, step_seconds=60):
+    """`trace_from_export` for an already loaded export."""
+    starts, _end = analytics.END_TO_END[data["platform"]]
+    arrival = analytics.STAGES[data["platform"]][0][2]
+    for column in starts + [arrival]:
+        if np.isfinite(data[column]).any():
+            return analytics.throughput(data, column, step_seconds)[1]
+    raise ValueError("The export has no ingest timestamps")
+
+
+def _profile_edges(profile, duration_s, **kwargs):
+    """Times where a profile's rate jumps; it is linear between them."""
+    options = {name: p.default for name, p in inspect.signature(rate_function).parameters.items()}
+    options.update(kwargs)
+    if profile == "step":
+        return np.arange(0, duration_s, options["step_seconds"])
+    if profile == "burst":
+        starts = np.arange(0, duration_s, options["burst_period"])
+        return np.concatenate([starts, starts + options["burst_seconds"]])
+    return np.empty(0)
+
+
+def synthetic_trace(profile, rate, peak_rate=None, duration_s=3600, step_seconds=60, seed=0, **kwargs):
+    """
+    Events/sec per step for one of the load generator's profiles: the exact
+    mean rate of each step, however short its bursts.
+    """
+    rate_fn = rate_function(profile, rate, peak_rate, duration_s, **kwargs)
+    t = np.arange(0, duration_s, step_seconds, dtype=np.float64)
+    # Split the steps where the rate jumps; the midpoint rate of each piece is
+    # then its mean, as every profile is linear between jumps
+    edges = _profile_edges(profile, duration_s, **kwargs)
+    bounds = np.union1d(np.append(t, float(duration_s)), edges[(edges > 0) & (edges < duration_s)])
+    events = np.array([rate_fn(m) for m in (bounds[:-1] + bounds[1:]) / 2]) * np.diff(bounds)
+    step = np.searchsorted(t, bounds[:-1], side="right") - 1
+    rates = np.bincount(step, weights=events, minlength=t.size) / np.diff(np.append(t, float(duration_s)))
+    if profile == "poisson":
+        rng = np.random.default_rng(seed)
+        rates = rng.poisson(rates * step_seconds) / step_seconds
+    return rates
+
+
+def fit_trace(rates, steps, scale=1.0):
+    """Tiles (or truncates) a trace to `steps` steps and scales it."""
+    rates = np.asarray(rates, dtype=np.float64)
+    if not rates.size:
+        raise ValueError("Empty load trace")
+    return np.resize(rates, steps) * scale
+
+
+# ------------------------------------------------------------- simulation ---
+
+def _configs(defaults, overrides):
+    unknown = set(overrides) - set(defaults)
+    if unknown:
+        raise TypeError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    params = dict(defaults, **overrides)
+    names = list(params)
+    arrays = np.broadcast_arrays(*(np.atleast_1d(np.asarray(params[n], dtype=np.float64)) for n in names))
+    return {n: a.copy() for n, a in zip(names, arrays)}
+
+
+def _queue_step(backlog, arrivals, capacity):
+    """One step of a fluid queue; returns (served, new backlog)."""
+    queued = backlog + arrivals
+    served = np.minimum(queued, capacity)
+    return served, queued - served
+
+
+def _batch_wait(per_batcher_rate, max_batch, max_wait):
+    """Mean wait of a record in a batch closed at max_batch records or after max_wait."""
+    fill = np.where(per_batcher_rate > 0, max_batch / np.maximum(per_batcher_rate, 1e-9), max_wait)
+    return np.minimum(fill, max_wait) / 2
+
+
+def _queueing_time(service, utilization):
+    """Mean time waiting for a server with fixed service times (M/D/1)."""
+    rho = np.minimum(utilization, MAX_UTILIZATION)
+    return service * rho / (2 * (1 - rho))
+
+
+def simulate_aws(rates, step_seconds=60, prices=PRICES, **params):
+    """
+    Kinesis → Lambda → DynamoDB over a load trace.
+
+    Args:
+        rates: Events/sec per step.
+        step_seconds: Length of a step.
+        prices: Price table (see PRICES).
+        **params: Overrides of AWS_DEFAULTS, scalars or arrays (one config each).
+
+    Returns:
+        dict of (configs, steps) arrays: latency_ms (mean; batch_wait_ms and
+        queueing_ms are its random parts), backlog, concurrency,
+        shards, cost_usd (per step; also split as cost_kinesis etc.), and
+        `params`, the broadcast configuration arrays.
+    """
+    p = _configs(AWS_DEFAULTS, params)
+    rates = np.asarray(rates, dtype=np.float64)
+    n, steps, dt = p["shards"].size, rates.size, float(step_seconds)
+
+    ingest_cap = p["shards"] * np.minimum(1000.0, 1024 * 1024 / p["record_bytes"])
+    pollers = p["shards"] * p["parallelization"]
+    batch = p["batch_size"]
+    # Lambda gets a full vCPU at 1769 MB and a proportional share below that
+    cpu_share = np.minimum(p["lambda_memory_gb"] / 1.769, 1.0)
+
+    def duration(b):
+        return (p["invoke_overhead_s"] + b * p["per_record_s"] / cpu_share
+                + np.ceil(b / 25) * p["ddb_call_s"])
+
+    write_units = np.ceil(p["record_bytes"] / 1024)
+    process_cap = np.minimum(pollers * batch / duration(batch), p["ddb_max_wru"] / write_units)
+    put_units = np.ceil(p["record_bytes"] / 25600)
+
+    out = {k: np.zeros((n, steps)) for k in ("latency_ms", "batch_wait_ms", "queueing_ms", "backlog",
+                                             "concurrency", "cost_kinesis", "cost_lambda", "cost_dynamodb")}
+    producer_backlog = np.zeros(n)
+    stream_backlog = np.zeros(n)
+    for t in range(steps):
+        ingested, producer_backlog = _queue_step(producer_backlog, rates[t] * dt, ingest_cap * dt)
+        processed, stream_backlog = _queue_step(stream_backlog, ingested, process_cap * dt)
+
+        # Pollers wait for a full batch or the batching window, polling at least once a second
+        per_poller = processed / dt / pollers
+        max_wait = np.maximum(p["batching_window_s"], p["poll_interval_s"])
+        batch_eff = np.clip(per_poller * max_wait, 1, batch)
+        busy = np.minimum(per_poller * duration(batch_eff) / batch_eff, 1.0)
+        invocations = processed / batch_eff
+
+        queue_delay = producer_backlog / ingest_cap + stream_backlog / process_cap
+        batch_wait = _batch_wait(per_poller, batch, max_wait)
+        queueing = _queueing_time(duration(batch_eff), busy)
+        out["latency_ms"][:, t] = 1000 * (p["put_latency_s"] + batch_wait + duration(batch_eff)
+                                          + queueing + queue_delay)
+        out["batch_wait_ms"][:, t] = 1000 * batch_wait
+        out["queueing_ms"][:, t] = 1000 * queueing
+        out["backlog"][:, t] = producer_backlog + stream_backlog
+        out["concurrency"][:, t] = np.where(stream_backlog > 0, pollers, pollers * busy)
+
+        out["cost_kinesis"][:, t] = (p["shards"] * prices["kinesis_shard_hour"] * dt / 3600
+                                     + ingested * put_units * prices["kinesis_put_unit_million"] / 1e6)
+        out["cost_lambda"][:, t] = (invocations * prices["lambda_request_million"] / 1e6
+                                    + invocations * duration(batch_eff) * p["lambda_memory_gb"]
+                                    * prices["lambda_gb_second"])
+        out["cost_dynamodb"][:, t] = processed * write_units * prices["dynamodb_wru_million"] / 1e6
+
+    out["shards"] = np.repeat(p["shards"][:, None], steps, axis=1)
+    out["cost_usd"] = out["cost_kinesis"] + out["cost_lambda"] + out["cost_dynamodb"]
+    out["params"] = p
+    return out
+
+
+def simulate_gcp(rates, step_seconds=60, prices=PRICES, **params):
+    """
+    Kafka → Dataflow → Bigtable over a load trace.
+
+    Args:
+        rates: Events/sec per step.
+        step_seconds: Length of a step.
+        prices: Price table (see PRICES).
+        **params: Overrides of GCP_DEFAULTS, scalars or arrays (one config each).
+
+    Returns:
+        dict of (configs, steps) arrays: latency_ms (mean; batch_wait_ms and
+        queueing_ms are its random parts), backlog, workers,
+        bigtable_nodes, cost_usd (per step; also split as cost_kafka etc.),
+        and `params`, the broadcast configuration arrays.
+    """
+    p = _configs(GCP_DEFAULTS, params)
+    rates = np.asarray(rates, dtype=np.float64)
+    n, steps, dt = p["partitions"].size, rates.size, float(step_seconds)
+
+    ingest_cap = np.minimum(p["kafka_vcpus"] * p["kafka_mb_per_vcpu"],
+                            p["partitions"] * p["partition_mb"]) * 1e6 / p["record_bytes"]
+    bigtable_cap = p["bigtable_nodes"] * p["writes_per_node"]
+    # One reader thread per partition, so workers beyond the partitions add nothing
+    useful_workers = np.minimum(p["max_workers"], np.ceil(p["partitions"] / p["worker_vcpus"]))
+    useful_workers = np.maximum(useful_workers, p["min_workers"])
+    per_worker = p["worker_vcpus"] * p["eps_per_vcpu"]
+    lag_steps = np.maximum(np.round(p["scale_lag_s"] / dt).astype(np.int64), 0)
+
+    out = {k: np.zeros((n, steps)) for k in ("latency_ms", "batch_wait_ms", "queueing_ms", "backlog",
+                                             "workers", "cost_kafka", "cost_dataflow", "cost_bigtable")}
+    demand = np.zeros((n, steps))
+    workers = p["min_workers"].copy()
+    producer_backlog = np.zeros(n)
+    consumer_lag = np.zeros(n)
+    rows = np.arange(n)
+    for t in range(steps):
+        ingested, producer_backlog = _queue_step(producer_backlog, rates[t] * dt, ingest_cap * dt)
+        threads = np.minimum(workers * p["worker_vcpus"], p["partitions"])
+        process_cap = np.minimum(threads * p["eps_per_vcpu"], bigtable_cap)
+        processed, consumer_lag = _queue_step(consumer_lag, ingested, process_cap * dt)
+        rate = processed / dt
+
+        per_partition = ingested / dt / p["partitions"]
+        per_writer = rate / np.maximum(threads, 1)
+        read_batch = np.clip(per_partition * p["poll_timeout_s"], 1, p["max_batch_messages"])
+        reader_util = rate / np.maximum(process_cap, 1e-9)
+        queue_delay = producer_backlog / ingest_cap + consumer_lag / np.maximum(process_cap, 1e-9)
+        batch_wait = (_batch_wait(per_partition, p["max_batch_messages"], p["poll_timeout_s"])
+                      + _batch_wait(per_writer, 500, p["flush_age_s"]))
+        queueing = (_queueing_time(read_batch / p["eps_per_vcpu"], reader_util)
+                    + _queueing_time(p["bigtable_write_s"], rate / bigtable_cap))
+        out["latency_ms"][:, t] = 1000 * (p["linger_s"] + p["ack_s"] + batch_wait + queueing + queue_delay
+                                          + read_batch / p["eps_per_vcpu"] + p["bigtable_write_s"])
+        out["batch_wait_ms"][:, t] = 1000 * batch_wait
+        out["queueing_ms"][:, t] = 1000 * queueing
+        out["backlog"][:, t] = producer_backlog + consumer_lag
+        out["workers"][:, t] = workers
+
+        out["cost_kafka"][:, t] = ((p["kafka_vcpus"] * prices["kafka_vcpu_hour"]
+                                    + p["kafka_gib"] * prices["kafka_gib_hour"]) * dt / 3600)
+        out["cost_dataflow"][:, t] = (workers * (p["worker_vcpus"] * prices["dataflow_vcpu_hour"]
+                                                 + p["worker_gb"] * prices["dataflow_gb_hour"]) * dt / 3600
+                                      + processed * p["record_bytes"] / 1e9 * prices["dataflow_streaming_gb"])
+        out["cost_bigtable"][:, t] = p["bigtable_nodes"] * prices["bigtable_node_hour"] * dt / 3600
+
+        # The autoscaler sees throughput and backlog scale_lag_s late; it scales
+        # up straight to its target and down by at most one worker per step
+        demand[:, t] = (rates[t] + consumer_lag / p["drain_s"]) / (per_worker * p["target_utilization"])
+        seen = demand[rows, np.maximum(t - lag_steps, 0)]
+        target = np.clip(np.ceil(seen), p["min_workers"], useful_workers)
+        workers = np.where(target > workers, target, np.maximum(target, workers - 1))
+
+    out["bigtable_nodes"] = np.repeat(p["bigtable_nodes"][:, None], steps, axis=1)
+    out["cost_usd"] = out["cost_kafka"] + out["cost_dataflow"] + out["cost_bigtable"]
+    out["params"] = p
+    return out
+
+
+SIMULATORS = {"aws": simulate_aws, "gcp": simulate_gcp}
+DEFAULTS = {"aws": AWS_DEFAULTS, "gcp": GCP_DEFAULTS}
+
+
+# -------------------------------------------------------------- summaries ---
+
+def latency_cdf(result, events, latency_ms):
+    """
+    Fraction of the events of each configuration with a latency of at most
+    latency_ms (one value per configuration), under the within-step model of
+    the module docstring.
+    """
+    width = 2 * result["batch_wait_ms"]
+    mean_queueing = result["queueing_ms"]
+    y = np.asarray(latency_ms, dtype=np.float64)[:, None] - (result["latency_ms"] - result["batch_wait_ms"]
+                                                              - mean_queueing)
+    # P(U + E <= y) for U uniform on [0, width] and E exponential: the
+    # exponential CDF averaged over the uniform part
+    width = np.maximum(width, 1e-6)
+    mean_queueing = np.maximum(mean_queueing, 1e-6)
+    c = np.clip(y, 0, width)
+    cdf = (c - mean_queueing * np.exp(-(np.maximum(y, 0) - c) / mean_queueing)
+           * -np.expm1(-c / mean_queueing)) / width
+    cdf = np.where(y > 0, np.clip(cdf, 0, 1), 0)
+    return (cdf * events).sum(axis=1) / max(events.sum(), 1e-9)
+
+
+def latency_percentile(result, events, q, tolerance_ms=0.1):
+    """Record-level q-th percentile (0-100) of each configuration's latency, by bisection on latency_cdf."""
+    low = np.zeros(result["latency_ms"].shape[0])
+    # Past every step's uniform part and 40 mean queueing waits
+    high = (result["latency_ms"] + result["batch_wait_ms"] + 40 * result["queueing_ms"]).max(axis=1) + 1
+    while (high - low).max() > tolerance_ms:
+        middle = (low + high) / 2
+        below = latency_cdf(result, events, middle) < q / 100.0
+        low = np.where(below, middle, low)
+        high = np.where(below, high, middle)
+    return high
+
+
+def summarize(result, rates, step_seconds=60, slo_ms=None):
+    """
+    Per-configuration totals.
+
+    Returns:
+        dict of (configs,) arrays: p50/p95/p99 latency over all records and
+        the highest step mean (ms), final backlog, total cost, cost per
+        million events and, with slo_ms, the fraction of events over the
+        latency SLO.
+    """
+    rates = np.asarray(rates, dtype=np.float64)
+    events = rates * step_seconds
+    latency = result["latency_ms"]
+    summary = {f"p{q}_ms": latency_percentile(result, events, q) for q in (50, 95, 99)}
+    summary["max_ms"] = latency.max(axis=1)
+    summary["final_backlog"] = result["backlog"][:, -1]
+    summary["cost_usd"] = result["cost_usd"].sum(axis=1)
+    summary["cost_per_million"] = summary["cost_usd"] / max(events.sum(), 1.0) * 1e6
+    if slo_ms is not None:
+        summary["slo_violation"] = 1 - latency_cdf(result, events, np.full(latency.shape[0], slo_ms))
+    return summary
+
+
+def sweep(platform, rates, grid, step_seconds=60, slo_ms=None, prices=PRICES, **fixed):
+    """
+    Simulates every combination of the values in `grid` (name -> list).
+
+    Returns:
+        (params, summary): dicts of (configs,) arrays, one entry per combination.
+    """
+    names = list(grid)
+    combos = np.array(list(itertools.product(*(grid[name] for name in names))), dtype=np.float64)
+    overrides = {name: combos[:, i] for i, name in enumerate(names)}
+    result = SIMULATORS[platform](rates, step_seconds, prices, **fixed, **overrides)
+    return result["params"], summarize(result, rates, step_seconds, slo_ms)
+
+
+def load_billing(path):
+    """Cost ($) per service from a GCP billing report export, subtotal rows skipped."""
+    costs = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            service = (row.get("Service description") or "").strip()
+            if service:
+                costs[service] = costs.get(service, 0.0) + float(row["Cost ($)"] or 0)
+    return costs
+
+
+# Billing services for each simulated GCP cost component
+BILLING_SERVICES = {
+    "cost_kafka":    "Managed Service for Apache Kafka",
+    "cost_dataflow": "Dataflow",
+    "cost_bigtable": "Cloud Bigtable",
+}
+
+
+# -------------------------------------------------------------------- CLI ---
+
+def _sweep_arguments(parser, defaults):
+    for name, value in defaults.items():
+        flag = "--" + name.replace("_", "-")
+        parser.add_argument(flag, dest=name, type=float, nargs="+", default=[value],
+                            help=f"one value or several to sweep (default {value:g})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = parser.add_subparsers(dest="platform", required=True)
+    for platform in SIMULATORS:
+        p = sub.add_parser(platform)
+        p.add_argument("--trace", help="result export to take the load trace from")
+        p.add_argument("--profile", choices=PROFILES, default="constant")
+        p.add_argument("--rate", type=float, default=100.0, help="synthetic rate (events/s)")
+        p.add_argument("--peak-rate", type=float, default=None)
+        p.add_argument("--hours", type=float, default=24.0, help="simulated horizon")
+        p.add_argument("--step", type=int, default=60, help="step (seconds)")
+        p.add_argument("--scale", type=float, default=1.0, help="multiplier on the trace")
+        p.add_argument("--slo-ms", type=float, default=None, help="p95 latency objective")
+        p.add_argument("--top", type=int, default=10, help="configurations to list")
+        p.add_argument("--billing", help="GCP billing export to compare against")
+        _sweep_arguments(p, DEFAULTS[platform])
+    args = parser.parse_args(argv)
+
+    steps = max(int(args.hours * 3600 // args.step), 1)
+    if args.trace:
+        rates = trace_from_export(args.trace, args.step)
+    else:
+        rates = synthetic_trace(args.profile, args.rate, args.peak_rate, steps * args.step, args.step)
+    rates = fit_trace(rates, steps, args.scale)
+
+    grid = {name: getattr(args, name) for name in DEFAULTS[args.platform]}
+    params, summary = sweep(args.platform, rates, grid, args.step, args.slo_ms)
+    swept = [name for name, values in grid.items() if len(values) > 1]
+
+    # Feasible: the backlog is drained by the end (at most one step of arrivals left)
+    feasible = summary["final_backlog"] <= max(rates[-1], 1.0) * args.step
+    if args.slo_ms is not None:
+        feasible &= summary["p95_ms"] <= args.slo_ms
+    order = np.lexsort((summary["p95_ms"], summary["cost_per_million"], ~feasible))
+
+    print(f"{args.platform.upper()}: {len(order)} configurations, {steps} x {args.step}s steps, "
+          f"mean {rates.mean():.1f} ev/s, peak {rates.max():.1f} ev/s, {int(feasible.sum())} feasible")
+    for i in order[:args.top]:
+        config = " ".join(f"{name}={params[name][i]:g}" for name in swept) or "defaults"
+        print(f"  {'ok ' if feasible[i] else 'X  '}{config:<48} $/M={summary['cost_per_million'][i]:.3f} "
+              f"total=${summary['cost_usd'][i]:.2f} p50={summary['p50_ms'][i]:.0f}ms "
+              f"p95={summary['p95_ms'][i]:.0f}ms p99={summary['p99_ms'][i]:.0f}ms "
+              f"backlog={summary['final_backlog'][i]:.0f}")
+
+    if args.billing and args.platform == "gcp":
+        billed = load_billing(args.billing)
+        best = order[0]
+        result = simulate_gcp(rates, args.step, **{name: params[name][best] for name in grid})
+        print(f"\nBilled vs simulated over {args.hours:g}h for the first configuration:")
+        for component, service in BILLING_SERVICES.items():
+            print(f"  {service:<36} billed ${billed.get(service, 0.0):>8.2f}   "
+                  f"simulated ${result[component].sum():>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
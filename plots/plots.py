@@ -1,133 +1,333 @@
 #!/usr/bin/env python3
 """
-plots.py  Generates four comparison charts
-  1. Load vs Latency curve
-  2. Cost bar-chart (low / med / high load)
-  3. 24-hour auto-scaling horizon plot
-  4. Sustainability vs Speed scatter
-  
+plots.py  Comparison report for the AWS and GCP pipelines
+
+Figures:
+  latency    load vs p95 end-to-end latency, from the result exports
+  costs      cost per hour of every component at low / medium / high load,
+             from the capacity simulator
+  autoscale  24-hour horizon of Lambda concurrency and Dataflow workers for
+             the measured load trace, from the capacity simulator
+  eco        sustainability vs speed of candidate regions
+  billing    measured GCP cost per service, from the billing export
+
+Every export is parsed once into a cache of one `.npy` file per column,
+keyed by a hash of the file's content; later runs memory-map only the
+columns a figure reads. Figures render in a process pool with the Agg
+backend. With --incremental, a figure is only redrawn when its inputs, its
+options or the report code changed since the last run (see manifest.json in
+the output directory).
+
 Inputs:
-    AWS_result.csv
-    GCP_result.csv
-    GCP-billing-info.csv
+    AWS_result.csv         DynamoDB export
+    GCP_result.csv         Bigtable export
+    GCP-billing-info.csv   GCP billing report export
+
+Usage:
+    python plots.py [--out reports] [--incremental] [--jobs 4] [--only latency costs]
 """
 
-import pandas as pd, numpy as np, matplotlib.pyplot as plt, textwrap, pathlib, sys
+import argparse, hashlib, json, os, shutil, tempfile, time
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import analytics
+import capacity_sim
 
 AWS_CSV      = "AWS_result.csv"
 GCP_CSV      = "GCP_result.csv"
-BILLING_CSV  = "My Billing Account_Reports, 2025-04-01 — 2025-04-30.csv"
-
-# Column names inside AWS/GCP result files
-COL_LOAD     = "load"              # events/minute
-COL_LATENCY  = "p95_latency_ms"    # 95‑th percentile latency
-COL_LAMBDA   = "lambda_concurrency"
-COL_DF       = "dataflow_workers"
-COL_COST_LOW, COL_COST_MED, COL_COST_HIGH = "cost_low", "cost_med", "cost_high"
-
-# Which GCP project ID to sum cost for in billing export
-GCP_PROJECT  = "cool-continuity-457614-b2"
-
-
-plt.rcParams["figure.facecolor"] = "white"
-
-def short(path): return pathlib.Path(path).name
-
-#Loading all CSV's
-try:
-    aws = pd.read_csv(AWS_CSV)
-    gcp = pd.read_csv(GCP_CSV)
-    billing = pd.read_csv(BILLING_CSV)
-except FileNotFoundError as e:
-    sys.exit(f"✖  {e}")
-
-print("\n=== preview AWS_result.csv ===");  print(aws.head())
-print("\n=== preview GCP_result.csv ===");  print(gcp.head())
-print("\n=== preview billing export ===");  print(billing.head())
-
-'''
-plot - 1: Load vs Latency AWS vs GCP
-
-'''
-fig1 = plt.figure(figsize=(8,5))
-plt.plot(aws[COL_LOAD], aws[COL_LATENCY], "-o", c="orange",   label="AWS Kinesis → Lambda")
-plt.plot(gcp[COL_LOAD], gcp[COL_LATENCY], "-s", c="orangered",label="GCP Kafka → Dataflow")
-plt.xlabel("Load (events/minute)"); plt.ylabel("95‑th Percentile Latency (ms)")
-plt.title("Load vs Latency: AWS vs GCP Scaling"); plt.grid(True); plt.legend()
-fig1.tight_layout(); fig1.savefig("plot1_latency.png")
-
-'''
-plot -2 : Cost comparision across different components used in both the pipelines
-
-'''
-services = ["Kinesis Shards (AWS)", "Pub/Sub Throughput (GCP)",
-            "Lambda Exec (AWS)",    "Dataflow Workers (GCP)",
-            "DynamoDB Writes (AWS)","Bigtable Writes (GCP)"]
-
-low  = [aws.at[0, COL_COST_LOW],   gcp.at[0, COL_COST_LOW],
-        aws.at[0, COL_COST_LOW],   gcp.at[0, COL_COST_LOW],
-        aws.at[0, COL_COST_LOW],   gcp.at[0, COL_COST_LOW]]
-med  = [aws.at[0, COL_COST_MED],   gcp.at[0, COL_COST_MED],
-        aws.at[0, COL_COST_MED],   gcp.at[0, COL_COST_MED],
-        aws.at[0, COL_COST_MED],   gcp.at[0, COL_COST_MED]]
-high = [aws.at[0, COL_COST_HIGH],  gcp.at[0, COL_COST_HIGH],
-        aws.at[0, COL_COST_HIGH],  gcp.at[0, COL_COST_HIGH],
-        aws.at[0, COL_COST_HIGH],  gcp.at[0, COL_COST_HIGH]]
-
-y  = np.arange(len(services)); h = .25
-fig2 = plt.figure(figsize=(9,5))
-plt.barh(y-h, low,  height=h, color="lightgreen",   label="Low Load")
-plt.barh(y,    med, height=h, color="coral",        label="Medium Load")
-plt.barh(y+h,  high,height=h, color="lightskyblue", label="High Load")
-plt.yticks(y, services); plt.xlabel("Cost (USD/hour)")
-plt.title("Cost Comparison Across Load Levels (AWS vs GCP)")
-plt.grid(axis="x"); plt.legend(); fig2.tight_layout(); fig2.savefig("plot2_costs.png")
-
-'''
-plot-3 24 Hour horizon chart: Auto scaling
-
-'''
-t  = np.arange(0, 24*60, 60)          # minute marks
-aws_l = aws[COL_LAMBDA].iloc[:24]     # ensure 24 samples
-gcp_w = gcp[COL_DF].iloc[:24]
-
-fig3 = plt.figure(figsize=(9,5))
-plt.fill_between(t, aws_l, step="mid", alpha=.35, color="deepskyblue",
-                 label="AWS Lambda Concurrency")
-plt.fill_between(t, gcp_w, step="mid", alpha=.35, color="salmon",
-                 label="GCP Dataflow Workers")
-plt.xlabel("Time (minutes since midnight)");  plt.ylabel("Provisioned Resources")
-plt.title("24-Hour Horizon: Auto-Scaling Behavior (AWS vs GCP)")
-plt.legend(); plt.grid(True); fig3.tight_layout(); fig3.savefig("plot3_autoscale.png")
-
-'''
-plot-4 Sustainability vs speed, Cloud ECO
-
-'''
-eco = pd.DataFrame({
-    "Provider": ["GCP Iowa", "AWS Oregon", "AWS Virginia", "GCP Singapore"],
-    "EcoScore": [0.85, 0.70, 0.60, 0.40],
-    "Speed":    [46000, 45000, 48000, 42000],
-    "Color":    ["green", "green", "orange", "red"]
-})
-
-fig4 = plt.figure(figsize=(8,5))
-for _,r in eco.iterrows():
-    plt.scatter(r.Speed, r.EcoScore, s=220, color=r.Color)
-    plt.text(r.Speed+200, r.EcoScore, r.Provider, fontsize=8)
-plt.xlabel("Processing Speed (events/minute)"); plt.ylabel("Eco-Score (0-1)")
-plt.title("Sustainability vs Speed (Events/Minute)"); plt.grid(True)
-fig4.tight_layout(); fig4.savefig("plot4_eco_speed.png")
-
-print("\n  Plots saved: plot1_latency.png  plot2_costs.png  plot3_autoscale.png  plot4_eco_speed.png")
-
-#real April cost table
-if {"Project Id","Service Description","Cost"}.issubset(billing.columns):
-    april = (billing.query("`Project Id` == @GCP_PROJECT")
-                  .groupby("Service Description")["Cost"].sum()
-                  .sort_values(ascending=False)
-                  .head(12))
-    print("\n\nTop GCP cost drivers in April 2025 for project", GCP_PROJECT)
-    print(april.to_string())
-else:
-    print("\n\nBilling CSV column names differ; tweak script's last section.")
+BILLING_CSV  = "GCP-billing-info.csv"
+
+CACHE_DIR    = ".plot-cache"
+MANIFEST     = "manifest.json"
+# Bumped whenever the cached column layout changes
+CACHE_FORMAT = 2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# A change to any of these redraws every figure in incremental mode
+CODE_FILES = [os.path.join(HERE, name) for name in ("plots.py", "analytics.py", "capacity_sim.py")]
+
+# Sustainability vs speed of candidate regions (events/minute, eco-score 0-1)
+ECO_REGIONS = [
+    ("GCP Iowa",      46000, 0.85, "green"),
+    ("AWS Oregon",    45000, 0.70, "green"),
+    ("AWS Virginia",  48000, 0.60, "orange"),
+    ("GCP Singapore", 42000, 0.40, "red"),
+]
+
+
+# ------------------------------------------------------------------ cache ---
+
+def file_hash(path, chunk_bytes=1 << 20):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CachedExport(Mapping):
+    """
+    A parsed export in the cache, shaped like `analytics.load_export`'s
+    result; each column is memory-mapped the first time it is read.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.platform = meta["platform"]
+        self.columns = meta["columns"]
+        self._loaded = {}
+
+    def __getitem__(self, key):
+        if key == "platform":
+            return self.platform
+        if key not in self._loaded:
+            if key not in self.columns:
+                raise KeyError(key)
+            self._loaded[key] = np.load(os.path.join(self.directory, f"{key}.npy"), mmap_mode="r")
+        return self._loaded[key]
+
+    def __iter__(self):
+        return iter(["platform"] + self.columns)
+
+    def __len__(self):
+        return len(self.columns) + 1
+
+
+def cache_export(path, cache_dir=CACHE_DIR, content_hash=None):
+    """
+    Returns the cache directory of an export, parsing it only if no cache
+    exists for its content.
+    """
+    content_hash = content_hash or file_hash(path)
+    directory = os.path.join(cache_dir, f"{content_hash}-v{CACHE_FORMAT}")
+    if os.path.exists(os.path.join(directory, "meta.json")):
+        return directory
+
+    os.makedirs(cache_dir, exist_ok=True)
+    data = analytics.load_export(path)
+    staging = tempfile.mkdtemp(prefix=".staging-", dir=cache_dir)
+    columns = [c for c in data if c != "platform"]
+    for column in columns:
+        np.save(os.path.join(staging, f"{column}.npy"), data[column])
+    with open(os.path.join(staging, "meta.json"), "w") as f:
+        json.dump({"platform": data["platform"], "columns": columns, "source": os.path.basename(path),
+                   "rows": len(data["entry_id"])}, f)
+    try:
+        os.rename(staging, directory)
+    except OSError:
+        # Another run cached the same content first
+        shutil.rmtree(staging, ignore_errors=True)
+    return directory
+
+
+# ---------------------------------------------------------------- figures ---
+# Each takes its loaded inputs, the report options and the output path; they
+# run in worker processes, so pyplot is only imported there.
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    plt.rcParams["figure.facecolor"] = "white"
+    return plt
+
+
+def _measured_trace(inputs, options):
+    """The exports' load traces back to back, tiled over 24 hours."""
+    traces = [capacity_sim.trace_from_data(inputs[key], options["step"]) for key in ("aws", "gcp") if key in inputs]
+    return capacity_sim.fit_trace(np.concatenate(traces), int(24 * 3600 // options["step"]), options["scale"])
+
+
+def plot_latency(inputs, options, out_path):
+    plt = _pyplot()
+    fig = plt.figure(figsize=(8, 5))
+    for key, marker, color, label in (("aws", "-o", "orange", "AWS Kinesis → Lambda"),
+                                      ("gcp", "-s", "orangered", "GCP Kafka → Dataflow")):
+        if key in inputs:
+            load, latency = analytics.load_latency_curve(inputs[key], bucket_seconds=options["bucket"])
+            plt.plot(load, latency, marker, c=color, label=label)
+    plt.xlabel("Load (events/minute)"); plt.ylabel("95-th Percentile Latency (ms)")
+    plt.title("Load vs Latency: AWS vs GCP Scaling"); plt.grid(True); plt.legend()
+    fig.tight_layout(); fig.savefig(out_path); plt.close(fig)
+
+
+def plot_costs(inputs, options, out_path):
+    plt = _pyplot()
+    rates = options["loads"]
+    components = [("aws", "cost_kinesis", "Kinesis Shards (AWS)"), ("gcp", "cost_kafka", "Kafka Cluster (GCP)"),
+                  ("aws", "cost_lambda", "Lambda Exec (AWS)"), ("gcp", "cost_dataflow", "Dataflow Workers (GCP)"),
+                  ("aws", "cost_dynamodb", "DynamoDB Writes (AWS)"), ("gcp", "cost_bigtable", "Bigtable Nodes (GCP)")]
+
+    # One simulated hour at each constant load, default configuration
+    per_hour = {component: [] for _p, component, _l in components}
+    for rate in rates:
+        results = {platform: simulate(np.full(60, rate), 60) for platform, simulate in capacity_sim.SIMULATORS.items()}
+        for platform, component, _label in components:
+            per_hour[component].append(results[platform][component].sum())
+
+    y = np.arange(len(components)); h = 0.8 / len(rates)
+    colors = ["lightgreen", "coral", "lightskyblue", "khaki", "plum"]
+    fig = plt.figure(figsize=(9, 5))
+    for i, rate in enumerate(rates):
+        plt.barh(y + (i - (len(rates) - 1) / 2) * h, [per_hour[c][i] for _p, c, _l in components],
+                 height=h, color=colors[i % len(colors)], label=f"{rate:g} ev/s")
+    plt.yticks(y, [label for _p, _c, label in components]); plt.xlabel("Cost (USD/hour)")
+    plt.title("Cost Comparison Across Load Levels (AWS vs GCP)")
+    plt.grid(axis="x"); plt.legend(); fig.tight_layout(); fig.savefig(out_path); plt.close(fig)
+
+
+def plot_autoscale(inputs, options, out_path):
+    plt = _pyplot()
+    rates = _measured_trace(inputs, options)
+    aws = capacity_sim.simulate_aws(rates, options["step"])
+    gcp = capacity_sim.simulate_gcp(rates, options["step"])
+    minutes = np.arange(rates.size) * options["step"] / 60.0
+
+    fig = plt.figure(figsize=(9, 5))
+    plt.fill_between(minutes, aws["concurrency"][0], step="mid", alpha=.35, color="deepskyblue",
+                     label="AWS Lambda Concurrency")
+    plt.fill_between(minutes, gcp["workers"][0], step="mid", alpha=.35, color="salmon",
+                     label="GCP Dataflow Workers")
+    plt.xlabel("Time (minutes)"); plt.ylabel("Provisioned Resources")
+    plt.title(f"24-Hour Horizon: Auto-Scaling Behavior (measured load x{options['scale']:g})")
+    plt.legend(); plt.grid(True); fig.tight_layout(); fig.savefig(out_path); plt.close(fig)
+
+
+def plot_eco(inputs, options, out_path):
+    plt = _pyplot()
+    fig = plt.figure(figsize=(8, 5))
+    for provider, speed, score, color in ECO_REGIONS:
+        plt.scatter(speed, score, s=220, color=color)
+        plt.text(speed + 200, score, provider, fontsize=8)
+    plt.xlabel("Processing Speed (events/minute)"); plt.ylabel("Eco-Score (0-1)")
+    plt.title("Sustainability vs Speed (Events/Minute)"); plt.grid(True)
+    fig.tight_layout(); fig.savefig(out_path); plt.close(fig)
+
+
+def plot_billing(inputs, options, out_path):
+    plt = _pyplot()
+    costs = sorted(inputs["billing"].items(), key=lambda item: item[1])
+    fig = plt.figure(figsize=(9, 5))
+    plt.barh([service for service, _cost in costs], [cost for _service, cost in costs], color="salmon")
+    plt.xlabel("Cost (USD)"); plt.title("Measured GCP Cost per Service")
+    plt.grid(axis="x"); fig.tight_layout(); fig.savefig(out_path); plt.close(fig)
+
+
+# name -> (function, inputs, option keys, output file)
+FIGURES = {
+    "latency":   (plot_latency,   ("aws", "gcp"), ("bucket",),        "plot1_latency.png"),
+    "costs":     (plot_costs,     (),             ("loads",),         "plot2_costs.png"),
+    "autoscale": (plot_autoscale, ("aws", "gcp"), ("step", "scale"),  "plot3_autoscale.png"),
+    "eco":       (plot_eco,       (),             (),                 "plot4_eco_speed.png"),
+    "billing":   (plot_billing,   ("billing",),   (),                 "plot5_billing.png"),
+}
+
+
+def _render(name, sources, options, out_path):
+    """Worker entry point: loads the inputs a figure needs and draws it."""
+    start = time.perf_counter()
+    function, keys, _option_keys, _file = FIGURES[name]
+    inputs = {}
+    for key in keys:
+        if key == "billing":
+            inputs[key] = capacity_sim.load_billing(sources[key])
+        elif key in sources:
+            inputs[key] = CachedExport(sources[key])
+    function(inputs, options, out_path)
+    return name, time.perf_counter() - start
+
+
+# ---------------------------------------------------------------- report ---
+
+def _fingerprint(name, hashes, options, code_hash):
+    _function, keys, option_keys, _file = FIGURES[name]
+    return hashlib.blake2b(json.dumps({
+        "inputs": {key: hashes.get(key) for key in keys},
+        "options": {key: options[key] for key in option_keys},
+        "code": code_hash,
+    }, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--aws", default=AWS_CSV, help="AWS result export")
+    parser.add_argument("--gcp", default=GCP_CSV, help="GCP result export")
+    parser.add_argument("--billing", default=BILLING_CSV, help="GCP billing export")
+    parser.add_argument("--out", default=".", help="output directory")
+    parser.add_argument("--cache", default=CACHE_DIR, help="parsed export cache")
+    parser.add_argument("--only", nargs="+", choices=list(FIGURES), default=list(FIGURES))
+    parser.add_argument("--incremental", action="store_true",
+                        help="only redraw figures whose inputs, options or code changed")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="rendering processes")
+    parser.add_argument("--bucket", type=int, default=60, help="latency curve bucket (seconds)")
+    parser.add_argument("--step", type=int, default=60, help="simulator step (seconds)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier on the measured load")
+    parser.add_argument("--loads", type=float, nargs="+", default=[10.0, 100.0, 1000.0],
+                        help="loads (events/s) of the cost chart")
+    args = parser.parse_args(argv)
+
+    options = {"bucket": args.bucket, "step": args.step, "scale": args.scale, "loads": args.loads}
+    paths = {"aws": args.aws, "gcp": args.gcp, "billing": args.billing}
+    missing = [key for key, path in paths.items() if not os.path.exists(path)]
+    for key in missing:
+        print(f"✖  {paths.pop(key)} not found; figures needing it are skipped")
+
+    start = time.perf_counter()
+    hashes = {key: file_hash(path) for key, path in paths.items()}
+    code_hash = hashlib.blake2b("".join(file_hash(p) for p in CODE_FILES).encode(), digest_size=16).hexdigest()
+
+    os.makedirs(args.out, exist_ok=True)
+    manifest_path = os.path.join(args.out, MANIFEST)
+    manifest = {}
+    if args.incremental and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    todo = {}
+    for name in args.only:
+        _function, keys, _option_keys, filename = FIGURES[name]
+        if keys and not any(key in paths for key in keys):
+            continue
+        fingerprint = _fingerprint(name, hashes, options, code_hash)
+        if manifest.get(name) == fingerprint and os.path.exists(os.path.join(args.out, filename)):
+            print(f"  {name:<10} unchanged")
+            continue
+        todo[name] = fingerprint
+    if not todo:
+        print("Nothing to redraw.")
+        return
+
+    with ProcessPoolExecutor(max_workers=max(min(args.jobs, len(todo)), 1)) as pool:
+        # Parse each needed export once (in parallel); figures then share the cache
+        needed = {key for name in todo for key in FIGURES[name][1] if key in ("aws", "gcp") and key in paths}
+        parsing = {key: pool.submit(cache_export, paths[key], args.cache, hashes[key]) for key in needed}
+        sources = {key: future.result() for key, future in parsing.items()}
+        if "billing" in paths:
+            sources["billing"] = paths["billing"]
+        print(f"  inputs ready in {time.perf_counter() - start:.2f}s")
+
+        rendering = [pool.submit(_render, name, sources, options, os.path.join(args.out, FIGURES[name][3]))
+                     for name in todo]
+        for future in rendering:
+            name, seconds = future.result()
+            manifest[name] = todo[name]
+            print(f"  {name:<10} {FIGURES[name][3]} ({seconds:.2f}s)")
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    if "billing" in paths:
+        costs = capacity_sim.load_billing(paths["billing"])
+        print("\nTop GCP cost drivers (billing export):")
+        for service, cost in sorted(costs.items(), key=lambda item: -item[1]):
+            print(f"  {service:<36} ${cost:>8.2f}")
+    print(f"\nReport written to {args.out} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
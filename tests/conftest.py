@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The pipelines and the plot scripts are run from their own directories, not installed
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "aws-data-pipeline"), os.path.join(ROOT, "gcp-data-pipeline"),
+             os.path.join(ROOT, "plots")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,141 @@
+import pytest
+
+from pipeline_common.adaptive import Knob, LatencySLOController
+from pipeline_common.metrics import REGISTRY
+
+TARGET = 0.5
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def controller(knobs, name, **kwargs):
+    clock = FakeClock()
+    changes = []
+    slo = LatencySLOController(knobs, target_seconds=TARGET, interval_seconds=1.0, min_samples=10,
+                               on_change=changes.append, name=name, clock=clock, **kwargs)
+    return slo, clock, changes
+
+
+def window(slo, clock, p95_seconds, count=100, seconds=1.0):
+    """One full window in which every record took `p95_seconds`; judged by its last observation."""
+    slo.observe(p95_seconds, count - 1)
+    clock.now += seconds
+    slo.observe(p95_seconds)
+
+
+def test_knob_clamps_and_rounds():
+    knob = Knob(50, 10, 100, integer=True)
+    assert knob.step == 4.5
+    knob.set(7.6)
+    assert knob.value == 10
+    knob.set(120)
+    assert knob.value == 100
+    knob.set(33.4)
+    assert knob.value == 33
+    with pytest.raises(ValueError):
+        Knob(5, 10, 100)
+
+
+def test_additive_increase_below_the_headroom():
+    slo, clock, changes = controller({"records": Knob(20, 10, 100, step=5, integer=True),
+                                      "age_ms": Knob(10.0, 1.0, 50.0, step=2.5)}, "increase")
+    window(slo, clock, 0.1)
+    window(slo, clock, 0.1)
+    assert changes == [{"records": 25, "age_ms": 12.5}, {"records": 30, "age_ms": 15.0}]
+    assert slo.increases == 2
+    assert slo.last_latency == 0.1
+    assert REGISTRY.gauge("adaptive_setting", controller="increase", knob="records").value == 30
+
+    # Under the target but above target * headroom: hold
+    window(slo, clock, 0.45)
+    assert slo.settings == {"records": 30, "age_ms": 15.0}
+    assert len(changes) == 2
+
+
+def test_multiplicative_decrease_above_the_target():
+    slo, clock, changes = controller({"records": Knob(100, 10, 100, step=5, integer=True),
+                                      "age_ms": Knob(40.0, 1.0, 50.0)}, "decrease")
+    window(slo, clock, 1.0)
+    window(slo, clock, 1.0)
+    assert changes == [{"records": 50, "age_ms": 20.0}, {"records": 25, "age_ms": 10.0}]
+    assert slo.decreases == 2
+    assert not slo.saturated
+    assert REGISTRY.gauge("adaptive_latency_seconds", controller="decrease").value == 1.0
+
+
+def test_knobs_stay_within_bounds():
+    slo, clock, changes = controller({"records": Knob(40, 10, 100, step=50, integer=True),
+                                      "age_ms": Knob(4.0, 1.0, 50.0, step=30.0)}, "bounds")
+    for _ in range(5):
+        window(slo, clock, 1.0)
+    assert slo.settings == {"records": 10, "age_ms": 1.0}
+    # At the floor a decrease changes nothing and is not counted
+    assert slo.decreases == 2
+    assert len(changes) == 2
+
+    window(slo, clock, 0.1)
+    window(slo, clock, 0.1)
+    assert slo.settings == {"records": 100, "age_ms": 50.0}
+    assert slo.increases == 2
+    # At the ceiling an increase is not counted either
+    window(slo, clock, 0.1)
+    assert slo.settings == {"records": 100, "age_ms": 50.0}
+    assert slo.increases == 2
+    assert len(changes) == 4
+
+
+def test_window_needs_min_samples_and_the_interval():
+    slo, clock, changes = controller({"records": Knob(100, 10, 100, integer=True)}, "window")
+    # Enough samples, too short: the window stays open
+    clock.now += 0.5
+    slo.observe(1.0, 20)
+    assert slo.update() is None
+    clock.now += 0.5
+    slo.observe(1.0)
+    assert changes == [{"records": 50}]
+
+    # Long enough, too few samples: judged once the tenth arrives
+    clock.now += 5.0
+    slo.observe(0.6, 9)
+    assert changes == [{"records": 50}]
+    slo.observe(0.6)
+    assert changes == [{"records": 50}, {"records": 25}]
+
+
+def test_saturation_restores_the_settings_and_holds_them():
+    slo, clock, changes = controller({"records": Knob(100, 10, 100, step=5, integer=True)}, "saturation")
+    window(slo, clock, 1.0, count=100)
+    assert slo.settings == {"records": 50}
+
+    # Halving the batches barely helped and throughput dropped: overloaded, not batching-bound
+    window(slo, clock, 0.9, count=80)
+    assert slo.saturated
+    assert slo.settings == {"records": 100}
+    assert REGISTRY.gauge("adaptive_saturated", controller="saturation").value == 1
+
+    # Held while the target is still missed
+    window(slo, clock, 1.5, count=50)
+    assert slo.settings == {"records": 100}
+    assert changes == [{"records": 50}, {"records": 100}]
+
+    # Back under the target: released
+    window(slo, clock, 0.45)
+    assert not slo.saturated
+    assert REGISTRY.gauge("adaptive_saturated", controller="saturation").value == 0
+    window(slo, clock, 1.0)
+    assert slo.settings == {"records": 50}
+
+
+def test_decrease_that_helps_is_not_saturation():
+    slo, clock, _changes = controller({"records": Knob(100, 10, 100, integer=True)}, "not-saturated")
+    window(slo, clock, 1.0, count=100)
+    # Still over the target, but the latency fell by more than half the cut
+    window(slo, clock, 0.7, count=80)
+    assert not slo.saturated
+    assert slo.settings == {"records": 25}
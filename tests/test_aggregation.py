@@ -0,0 +1,128 @@
+import base64
+import hashlib
+
+import pytest
+
+from pipeline_common.aggregation import (MAGIC, RecordAggregator, _read_varint, _varint, _varint_size,
+                                         aggregate, deaggregate, is_aggregated)
+
+# Made by aws-kinesis-agg 1.2.3 (aws_kinesis_agg.aggregator.RecordAggregator) from KPL_RECORDS;
+# the last record has an explicit hash key, so the message also has an explicit_hash_key_table
+KPL_RECORDS = [
+    ("101", b'{"entry_id": 101}'),
+    ("102", b"\x01binary\x00payload"),
+    ("101", b"x" * 200),
+    ("103", b""),
+    ("104", b"explicit"),
+]
+KPL_AGGREGATE = base64.b64decode(
+    "84mawgoDMTAxCgMxMDIKAzEwMwoDMTA0EicxNzAxNDExODM0NjA0NjkyMzE3MzE2ODczMDM3MTU4ODQxMDU3MjgaFQgAGhF7Im"
+    "VudHJ5X2lkIjogMTAxfRoTCAEaDwFiaW5hcnkAcGF5bG9hZBrNAQgAGsgBeHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4"
+    "eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eH"
+    "h4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHh4"
+    "eHh4eHh4eHh4eHh4eHh4eHh4eHh4eHgaBAgCGgAaDggDEAAaCGV4cGxpY2l0Unph8wlEU0el5kUiDQVLiw==")
+
+
+def single_size(partition_key, data):
+    """Actual size of an aggregate holding just this record."""
+    (_key, payload, _count), = aggregate([(partition_key, data)], max_bytes=1 << 30)
+    return len(payload)
+
+
+@pytest.mark.parametrize("value, encoded", [
+    (0, b"\x00"),
+    (1, b"\x01"),
+    (127, b"\x7f"),
+    (128, b"\x80\x01"),
+    (300, b"\xac\x02"),
+    (16383, b"\xff\x7f"),
+    (16384, b"\x80\x80\x01"),
+    (2 ** 63 - 1, b"\xff" * 8 + b"\x7f"),
+])
+def test_varint(value, encoded):
+    assert _varint(value) == encoded
+    assert _varint_size(value) == len(encoded)
+    assert _read_varint(b"\x00" + encoded, 1) == (value, 1 + len(encoded))
+
+
+def test_reads_kpl_aggregate():
+    assert is_aggregated(KPL_AGGREGATE)
+    assert deaggregate(KPL_AGGREGATE) == KPL_RECORDS
+
+
+def test_round_trip():
+    records = [(str(i % 7), bytes([i % 256]) * i) for i in range(300)]
+    out = aggregate(records, max_bytes=25 * 1024)
+    assert len(out) > 1
+    assert sum(count for _key, _payload, count in out) == len(records)
+    assert [record for _key, payload, _count in out for record in deaggregate(payload)] == records
+    # Each aggregate is routed by its first record's key
+    assert [key for key, _payload, _count in out] == [deaggregate(payload)[0][0] for _key, payload, _count in out]
+
+
+def test_round_trip_across_the_one_byte_key_index():
+    # Key indexes 127 and 128 take one and two varint bytes
+    records = [(f"key-{i}", f"record-{i}".encode()) for i in range(130)]
+    (_key, payload, count), = aggregate(records, max_bytes=1 << 20)
+    assert count == 130
+    assert deaggregate(payload) == records
+
+
+def test_readable_by_aws_kinesis_agg():
+    deaggregator = pytest.importorskip("aws_kinesis_agg.deaggregator")
+    (_key, payload, _count), = aggregate(KPL_RECORDS[:4])
+    event = {"kinesis": {"partitionKey": "101", "data": base64.b64encode(payload).decode("ascii"),
+                         "sequenceNumber": "1", "approximateArrivalTimestamp": 0.0,
+                         "kinesisSchemaVersion": "1.0"}}
+    inner = deaggregator.deaggregate_records([event])
+    assert [(r["kinesis"]["partitionKey"], base64.b64decode(r["kinesis"]["data"])) for r in inner] == KPL_RECORDS[:4]
+
+
+# Data lengths that take the record's data length, and the record's own length, across 127/128
+@pytest.mark.parametrize("length", [120, 121, 122, 123, 124, 125, 126, 127, 128, 129, 16370, 16384])
+def test_too_large_is_exact(length):
+    data = b"d" * length
+    size = single_size("12345", data)
+    assert not RecordAggregator(max_bytes=size).too_large("12345", data)
+    assert RecordAggregator(max_bytes=size - 1).too_large("12345", data)
+
+
+@pytest.mark.parametrize("length", [120, 122, 123, 124, 125, 126, 127, 128, 129])
+@pytest.mark.parametrize("same_key", [True, False])
+def test_fits_is_exact(length, same_key):
+    first, second = ("1", b"a" * 10), ("1" if same_key else "2", b"d" * length)
+    (_key, payload, _count), = aggregate([first, second], max_bytes=1 << 30)
+
+    fits = RecordAggregator(max_bytes=len(payload))
+    fits.add(*first)
+    assert fits.fits(*second)
+    fits.add(*second)
+    assert fits.drain()[1] == payload
+
+    full = RecordAggregator(max_bytes=len(payload) - 1)
+    full.add(*first)
+    assert not full.fits(*second)
+    with pytest.raises(ValueError):
+        full.add(*second)
+
+
+def test_too_large_record_is_passed_through():
+    big = b"b" * 100
+    out = aggregate([("1", b"a"), ("2", big), ("3", b"c")], max_bytes=single_size("2", big) - 1)
+    assert [(key, count) for key, _payload, count in out] == [("1", 1), ("2", 1), ("3", 1)]
+    assert out[1][1] == big
+    assert deaggregate(big) == [(None, big)]
+
+
+def test_checksum_mismatch_is_a_plain_record():
+    (_key, payload, _count), = aggregate(KPL_RECORDS[:2])
+    corrupt = payload[:-1] + bytes([payload[-1] ^ 1])
+    assert not is_aggregated(corrupt)
+    assert deaggregate(corrupt) == [(None, corrupt)]
+
+
+def test_malformed_message_with_valid_checksum_raises():
+    # A records field whose length runs past the message
+    message = b"\x0a\x01k\x1a\x05\x08\x00"
+    with pytest.raises(ValueError):
+        deaggregate(MAGIC + message + hashlib.md5(message).digest())
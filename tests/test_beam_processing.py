@@ -0,0 +1,305 @@
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import confluent_kafka
+import pytest
+from apache_beam.io.restriction_trackers import OffsetRange, OffsetRestrictionTracker
+from apache_beam.io.watermark_estimators import ManualWatermarkEstimator
+from apache_beam.runners.sdf_utils import ThreadsafeRestrictionTracker
+from apache_beam.transforms.window import GlobalWindow
+from apache_beam.utils.timestamp import Duration, Timestamp
+
+import beam_processing
+
+TOPIC = "iot-data"
+IDLE_SECONDS = 60
+
+
+class FakeMessage:
+    def __init__(self, partition, offset, value, timestamp_ms):
+        self._partition = partition
+        self._offset = offset
+        self._value = value
+        self._timestamp_ms = timestamp_ms
+
+    def error(self):
+        return None
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def value(self):
+        return self._value
+
+    def timestamp(self):
+        return confluent_kafka.TIMESTAMP_CREATE_TIME, self._timestamp_ms
+
+
+class FakeConsumer:
+    """One partition's log per partition number, shared by every consumer."""
+    logs = {}
+
+    def __init__(self, conf):
+        self.conf = conf
+        self.position = {}
+        self.commits = []
+        self.closed = False
+
+    def assign(self, partitions):
+        for tp in partitions:
+            self.position[tp.partition] = tp.offset
+
+    def consume(self, num_messages, timeout):
+        (partition, offset), = self.position.items()
+        batch = self.logs[partition][offset:offset + num_messages]
+        self.position[partition] = offset + len(batch)
+        return batch
+
+    def get_watermark_offsets(self, tp, timeout=None, cached=False):
+        return 0, len(self.logs[tp.partition])
+
+    def poll(self, timeout):
+        return None
+
+    def commit(self, offsets, asynchronous=True):
+        assert asynchronous
+        self.commits.append(sorted((tp.topic, tp.partition, tp.offset) for tp in offsets))
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTokenProvider:
+    def get_token(self, config):
+        return "token", time.time() + 3600
+
+
+def entry(entry_id, created_at):
+    return json.dumps({"entry_id": entry_id, "field1": "21.5",
+                       "created_at": created_at.strftime("%Y-%m-%dT%H:%M:%SZ")}).encode()
+
+
+@pytest.fixture
+def reader(monkeypatch):
+    monkeypatch.setattr(confluent_kafka, "Consumer", FakeConsumer)
+    monkeypatch.setattr(FakeConsumer, "logs", {})
+    fn = beam_processing.ReadKafkaMessages("localhost:9092", TOPIC, "test-group", FakeTokenProvider,
+                                           poll_timeout_seconds=0.01, idle_watermark_seconds=IDLE_SECONDS,
+                                           allowed_lateness_seconds=3600)
+    fn.setup()
+    yield fn
+    fn.teardown()
+
+
+def run_partition(fn, partition, watermark_estimator):
+    """Runs the SDF on one partition until it checkpoints; returns the records and the deferred restriction."""
+    tracker = ThreadsafeRestrictionTracker(OffsetRestrictionTracker(OffsetRange(0, sys.maxsize)))
+    records = list(fn.process((TOPIC, partition), tracker=tracker, watermark_estimator=watermark_estimator))
+    residual, _delay = tracker.deferred_status()
+    return records, residual
+
+
+def test_empty_partition_does_not_hold_back_a_busy_one(reader):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    busy_times = [now - timedelta(seconds=s) for s in (30, 20, 10)]
+    FakeConsumer.logs = {
+        0: [FakeMessage(0, i, entry(i + 1, t), int(t.timestamp() * 1000)) for i, t in enumerate(busy_times)],
+        1: [],
+    }
+    busy, empty = ManualWatermarkEstimator(None), ManualWatermarkEstimator(None)
+
+    records, residual = run_partition(reader, 0, busy)
+    assert [record.value[1]["entry_id"] for record in records] == [1, 2, 3]
+    # Offsets travel next to the record, not inside it
+    assert [record.value[0] for record in records] == [(0, 0), (0, 1), (0, 2)]
+    assert not any(key.startswith("kafka_") and key != "kafka_timestamp" for key in records[0].value[1])
+    assert residual.start == 3
+    started = time.time()
+    _, residual = run_partition(reader, 1, empty)
+    assert residual.start == 0
+
+    # The busy partition follows its event times
+    assert busy.current_watermark() == Timestamp.of(busy_times[-1].timestamp())
+    # The empty one trails wall time by the bound instead of staying at its minimum,
+    # so the pipeline watermark (the lower of the two) keeps firing windows
+    watermark = min(busy.current_watermark(), empty.current_watermark())
+    assert Timestamp.of(started) - Duration(seconds=IDLE_SECONDS + 1) <= watermark
+    assert watermark <= Timestamp.now() - Duration(seconds=IDLE_SECONDS)
+
+
+def test_partition_with_backlog_runs_only_past_its_newest_event_time(reader):
+    long_ago = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(hours=3)
+    FakeConsumer.logs = {0: [FakeMessage(0, 0, entry(1, long_ago), int(long_ago.timestamp() * 1000)),
+                             FakeMessage(0, 1, entry(2, long_ago), int(long_ago.timestamp() * 1000))]}
+    estimator = ManualWatermarkEstimator(None)
+
+    # The first record is read, then a poll comes back empty with the second one still unread
+    consumer = reader._consumer_for(TOPIC, 0, 0)
+    list(reader.process_helper(consumer.consume(1, 0), 0, estimator))
+    reader._idle_watermark(consumer, TOPIC, 0, 1, estimator)
+    assert estimator.current_watermark() == Timestamp.of(long_ago.timestamp()) + Duration(seconds=IDLE_SECONDS)
+
+
+def test_partition_with_backlog_and_no_event_time_keeps_its_watermark(reader):
+    FakeConsumer.logs = {0: [FakeMessage(0, 0, entry(1, datetime.now(timezone.utc)), 0)]}
+    estimator = ManualWatermarkEstimator(None)
+    consumer = reader._consumer_for(TOPIC, 0, 0)
+    reader._idle_watermark(consumer, TOPIC, 0, 0, estimator)
+    assert estimator.current_watermark() is None
+
+
+class FakeRow:
+    def __init__(self, row_key):
+        self.row_key = row_key
+        self.cells = []
+
+    def set_cell(self, column_family_id, column, value, timestamp=None):
+        self.cells.append((column_family_id, column, value, timestamp))
+
+    @property
+    def entry_id(self):
+        return json.loads(self.cells[0][2])["entry_id"]
+
+
+class FakeStatus:
+    def __init__(self, code):
+        self.code = code
+
+
+class FakeTable:
+    """Fails the row of each entry ID in `fail_times` that many times (code 14, UNAVAILABLE)."""
+
+    def __init__(self, fail_times=None):
+        self.fail_times = dict(fail_times or {})
+        self.calls = []
+        self.written = []
+
+    def direct_row(self, row_key):
+        return FakeRow(row_key)
+
+    def mutate_rows(self, rows):
+        self.calls.append([row.entry_id for row in rows])
+        statuses = []
+        for row in rows:
+            if self.fail_times.get(row.entry_id, 0) > 0:
+                self.fail_times[row.entry_id] -= 1
+                statuses.append(FakeStatus(14))
+            else:
+                self.written.append(row.entry_id)
+                statuses.append(FakeStatus(0))
+        return statuses
+
+
+def bigtable_writer(monkeypatch, table, **kwargs):
+    monkeypatch.setattr(beam_processing.time, "sleep", lambda seconds: None)
+    fn = beam_processing.WriteToBigtable("project", "instance", "table", max_batch_age_seconds=3600, **kwargs)
+    fn.open_table = lambda: table
+    fn.setup()
+    fn.start_bundle()
+    return fn
+
+
+def write(fn, elements):
+    """Processes ((partition, offset), entry_id) elements; returns what process emitted."""
+    out = []
+    for (partition, offset), entry_id in elements:
+        out.extend(fn.process(((partition, offset), {"entry_id": entry_id, "wind_direction": 21.5}),
+                              timestamp=Timestamp.of(1745000000), window=GlobalWindow()))
+    return out
+
+
+def test_flush_retries_only_the_failed_rows(monkeypatch):
+    table = FakeTable(fail_times={2: 1, 4: 2})
+    fn = bigtable_writer(monkeypatch, table)
+    assert write(fn, [((0, offset), offset + 1) for offset in range(5)]) == []
+
+    committable = [value.value for value in fn.finish_bundle()]
+    assert table.calls == [[1, 2, 3, 4, 5], [2, 4], [4]]
+    assert sorted(table.written) == [1, 2, 3, 4, 5]
+    assert committable == [(0, 5)]
+
+
+def test_flush_raises_after_max_attempts_and_commits_nothing(monkeypatch):
+    table = FakeTable(fail_times={2: 10})
+    fn = bigtable_writer(monkeypatch, table, max_attempts=3)
+    write(fn, [((0, 10), 1), ((0, 11), 2)])
+
+    with pytest.raises(RuntimeError):
+        list(fn.finish_bundle())
+    assert table.calls == [[1, 2], [2], [2]]
+    # Not remembered as written, so the retried bundle writes both again
+    assert 1 not in fn.written and 2 not in fn.written
+
+
+def test_offsets_are_emitted_only_for_written_rows(monkeypatch):
+    table = FakeTable()
+    fn = bigtable_writer(monkeypatch, table, max_batch_rows=3)
+
+    # The third row fills the batch: its flush covers offsets up to 7 on partition 0 and 3 on partition 1
+    assert write(fn, [((0, 6), 1), ((1, 3), 2)]) == []
+    assert write(fn, [((0, 7), 3)]) == [(0, 8), (1, 4)]
+    assert table.written == [1, 2, 3]
+
+    # A duplicate is not written again, but its offset is done once the batch after it is stored
+    assert write(fn, [((1, 4), 2), ((0, 8), 4)]) == []
+    assert [value.value for value in fn.finish_bundle()] == [(1, 5), (0, 9)]
+    assert table.written == [1, 2, 3, 4]
+
+
+@pytest.fixture
+def committer(monkeypatch):
+    monkeypatch.setattr(confluent_kafka, "Consumer", FakeConsumer)
+    fn = beam_processing.CommitKafkaOffsets("localhost:9092", TOPIC, "test-group", FakeTokenProvider,
+                                            commit_interval_seconds=3600)
+    fn.setup()
+    return fn
+
+
+def test_offsets_are_committed_at_the_end_of_the_bundle(committer):
+    assert committer.consumer.conf["enable.auto.commit"] is False
+    for element in [(0, 5), (1, 7), (0, 3)]:
+        committer.process(element)
+    # Only the highest per partition is kept, and nothing is sent before the interval
+    assert committer.pending == {0: 5, 1: 7}
+    assert committer.consumer.commits == []
+
+    committer.finish_bundle()
+    assert committer.consumer.commits == [[(TOPIC, 0, 5), (TOPIC, 1, 7)]]
+    assert committer.committed == {0: 5, 1: 7}
+    assert committer.pending == {}
+
+
+def test_offsets_at_or_below_the_committed_one_are_ignored(committer):
+    committer.process((0, 5))
+    committer.finish_bundle()
+
+    # A retried bundle re-emits offsets that are already committed
+    committer.process((0, 5))
+    committer.process((0, 4))
+    assert committer.pending == {}
+    committer.finish_bundle()
+    assert len(committer.consumer.commits) == 1
+
+    committer.process((0, 6))
+    committer.finish_bundle()
+    assert committer.consumer.commits[-1] == [(TOPIC, 0, 6)]
+    assert committer.committed == {0: 6}
+
+
+def test_offsets_are_committed_within_the_bundle_once_the_interval_passes(committer):
+    committer.commit_interval_seconds = 0
+    committer.process((2, 10))
+    assert committer.consumer.commits == [[(TOPIC, 2, 10)]]
+
+
+def test_teardown_commits_what_is_pending(committer):
+    committer.process((0, 5))
+    consumer = committer.consumer
+    committer.teardown()
+    assert consumer.commits == [[(TOPIC, 0, 5)]]
+    assert consumer.closed
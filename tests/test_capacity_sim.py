@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+import capacity_sim
+
+
+@pytest.mark.parametrize("profile, expected", [
+    ("constant", 2000.0),
+    ("ramp", 11000.0),
+    # 5 s at the peak rate in every 60 s
+    ("burst", 2000.0 + 18000.0 * 5 / 60),
+])
+def test_synthetic_trace_mean_is_the_profile_mean(profile, expected):
+    rates = capacity_sim.synthetic_trace(profile, 2000, 20000, duration_s=6 * 3600, step_seconds=60)
+    assert rates.mean() == pytest.approx(expected)
+
+
+def test_synthetic_trace_keeps_bursts_that_straddle_steps():
+    rates = capacity_sim.synthetic_trace("burst", 2000, 20000, duration_s=180, step_seconds=45,
+                                         burst_seconds=5, burst_period=60)
+    np.testing.assert_allclose(rates, [4000.0, 4000.0, 4000.0, 2000.0])
+
+
+def test_percentiles_are_over_records_not_step_means():
+    # Step 1: 50 ms + uniform batch wait up to 80 ms; step 2: fixed 300 ms, a quarter of the events
+    result = {"latency_ms": np.array([[90.0, 300.0]]),
+              "batch_wait_ms": np.array([[40.0, 0.0]]),
+              "queueing_ms": np.array([[0.0, 0.0]])}
+    events = np.array([3.0, 1.0])
+    # Half the records: two thirds of step 1, whose waits are spread evenly
+    assert capacity_sim.latency_percentile(result, events, 50)[0] == pytest.approx(50 + 80 * 2 / 3, abs=0.1)
+    assert capacity_sim.latency_percentile(result, events, 95)[0] == pytest.approx(300.0, abs=0.1)
+    assert 1 - capacity_sim.latency_cdf(result, events, np.array([100.0]))[0] == pytest.approx(
+        0.75 * 30 / 80 + 0.25)
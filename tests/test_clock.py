@@ -0,0 +1,160 @@
+import socket
+import time
+
+import pytest
+
+from pipeline_common import clock as clock_module
+from pipeline_common.clock import _MAGIC, _REQUEST, _RESPONSE, ClockSync, ReferenceServer, clock_fields
+
+MS = 1_000_000
+# Reference clock minus this host's monotonic clock, in the fake exchanges
+OFFSET_NS = 1_700_000_000_000 * MS
+
+
+class FakeTime:
+    def __init__(self):
+        self.mono = 5_000 * MS
+
+    def monotonic_ns(self):
+        return self.mono
+
+
+class FakeReferenceSocket:
+    """
+    Answers each ping after the given one-way delays (ns), moving the fake
+    monotonic clock on by the round trip.
+    """
+
+    def __init__(self, fake_time, legs, stale_first=False):
+        self.time = fake_time
+        self.legs = list(legs)
+        self.stale_first = stale_first
+        self.request = None
+
+    def send(self, data):
+        self.request = _REQUEST.unpack(data)
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self, size):
+        magic, sequence, t1 = self.request
+        if self.stale_first:
+            # A late answer to an earlier ping
+            self.stale_first = False
+            return _RESPONSE.pack(_MAGIC, sequence - 1, t1 - MS, 0, 0)
+        if not self.legs:
+            raise socket.timeout()
+        out, back = self.legs.pop(0)
+        t2 = t1 + OFFSET_NS + out
+        t3 = t2 + 100_000
+        self.time.mono = t1 + out + 100_000 + back
+        return _RESPONSE.pack(_MAGIC, sequence, t1, t2, t3)
+
+
+@pytest.fixture
+def fake_time(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(clock_module, "time", fake)
+    return fake
+
+
+def fake_sync(fake_time, legs, **kwargs):
+    sync = ClockSync("reference:1", pings=len(legs), **kwargs)
+    sync._sock = FakeReferenceSocket(fake_time, legs)
+    return sync
+
+
+def test_symmetric_exchange_gives_the_exact_offset(fake_time):
+    sync = fake_sync(fake_time, [(3 * MS, 3 * MS)])
+    assert sync.sync()
+    assert sync.offset_ns == OFFSET_NS
+    assert sync.delay_ns == 6 * MS
+
+
+def test_asymmetric_exchange_is_off_by_half_the_difference(fake_time):
+    sync = fake_sync(fake_time, [(1 * MS, 9 * MS)])
+    assert sync.sync()
+    # The estimate is within delay / 2 of the truth
+    assert sync.offset_ns == OFFSET_NS - 4 * MS
+    assert sync.delay_ns == 10 * MS
+
+
+def test_ping_with_the_smallest_delay_wins(fake_time):
+    sync = fake_sync(fake_time, [(5 * MS, 9 * MS), (1 * MS, 2 * MS), (2 * MS, 8 * MS)])
+    assert sync.sync()
+    assert sync.delay_ns == 3 * MS
+    assert sync.offset_ns == OFFSET_NS - MS // 2
+
+
+def test_late_reply_to_an_earlier_ping_is_skipped(fake_time):
+    sync = fake_sync(fake_time, [(2 * MS, 2 * MS)])
+    sync._sock.stale_first = True
+    assert sync.sync()
+    assert (sync.offset_ns, sync.delay_ns) == (OFFSET_NS, 4 * MS)
+
+
+def test_error_bound_grows_with_drift(fake_time):
+    sync = fake_sync(fake_time, [(1 * MS, 1 * MS)], max_drift_ppm=20.0)
+    assert sync.now() is None
+    assert sync.sync()
+
+    ref_us, error_us = sync.now()
+    assert ref_us == (fake_time.mono + OFFSET_NS) // 1000
+    assert error_us == 1000 + 1
+
+    # 100 s later: 20 ppm adds 2 ms
+    fake_time.mono += 100_000 * MS
+    ref_us, error_us = sync.now()
+    assert ref_us == (fake_time.mono + OFFSET_NS) // 1000
+    assert error_us == 3000 + 1
+
+
+def test_failed_resync_keeps_the_estimate(fake_time):
+    sync = fake_sync(fake_time, [(1 * MS, 1 * MS)], resync_seconds=60)
+    assert sync.maybe_sync()
+    fake_time.mono += 30_000 * MS
+    # Too soon: no ping is sent
+    assert sync.maybe_sync()
+    assert sync.syncs == 1
+
+    fake_time.mono += 30_000 * MS
+    assert not sync.sync()
+    assert sync.failures == 1
+    assert sync.synced and sync.offset_ns == OFFSET_NS
+
+
+def test_loopback_reference():
+    server = ReferenceServer("127.0.0.1", port=0).start()
+    try:
+        host, port = server.address
+        sync = ClockSync(f"{host}:{port}", pings=4, timeout_seconds=1.0)
+        assert sync.sync()
+        assert server.answered == 4
+
+        before_us = time.time_ns() // 1000
+        ref_us, error_us = sync.now()
+        after_us = time.time_ns() // 1000
+        # The reference is this host's own wall clock
+        assert before_us - error_us <= ref_us <= after_us + error_us
+        assert 0 < error_us < 1_000_000
+
+        record = sync.stamp({"entry_id": 1}, "vm_timestamp")
+        assert set(record) == {"entry_id", "vm_ref_us", "vm_error_us"}
+        assert clock_fields("vm_timestamp") == ("vm_ref_us", "vm_error_us")
+    finally:
+        server.close()
+
+
+def test_unreachable_reference_leaves_the_host_unsynced():
+    # A port nothing listens on any more
+    server = ReferenceServer("127.0.0.1", port=0)
+    host, port = server.address
+    server.close()
+
+    sync = ClockSync(f"{host}:{port}", pings=2, timeout_seconds=0.05)
+    assert not sync.sync()
+    assert not sync.synced
+    assert sync.failures == 1
+    assert sync.now() is None
+    assert sync.stamp({"entry_id": 1}, "vm_timestamp") == {"entry_id": 1}
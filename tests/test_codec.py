@@ -0,0 +1,113 @@
+import json
+import math
+from decimal import Decimal
+
+import pytest
+
+from pipeline_common import codec
+from pipeline_common.codec import HEADER_JSON, VERSION_1, decode, encode, encode_binary
+
+ENTRY = {
+    "entry_id": 5440826,
+    "created_at": "2025-05-06T19:26:47Z",
+    "field1": "37", "field2": "1", "field3": "95", "field4": "59.5",
+    "field5": "0", "field6": "29.88", "field7": "4.13", "field8": "",
+    "scheduled_timestamp": 1746559607000,
+    "ec2_timestamp": "2025-05-06T20:44:38.512000Z",
+    "ec2_ref_us": 1746564278512345,
+    "ec2_error_us": 850,
+}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def parser(request, monkeypatch):
+    """Runs a test with orjson (when installed) and with the standard library parser."""
+    if request.param == "json":
+        monkeypatch.setattr(codec, "orjson", None)
+    elif codec.orjson is None:
+        pytest.skip("orjson is not installed")
+    return request.param
+
+
+def test_binary_round_trip():
+    payload = encode(ENTRY)
+    assert payload[0] == VERSION_1
+    assert len(payload) < len(json.dumps(ENTRY))
+
+    decoded = decode(payload)
+    assert decoded == {
+        "entry_id": 5440826,
+        "created_at": "2025-05-06T19:26:47Z",
+        "field1": 37.0, "field2": 1.0, "field3": 95.0, "field4": 59.5,
+        "field5": 0.0, "field6": 29.88, "field7": 4.13,
+        "scheduled_timestamp": 1746559607000,
+        "ec2_timestamp": 1746564278512,
+        "ec2_ref_us": 1746564278512345,
+        "ec2_error_us": 850,
+    }
+    # Decoded again, it encodes to the same bytes
+    assert encode(decoded) == payload
+
+
+def test_binary_without_created_at_or_stamps():
+    decoded = decode(encode({"entry_id": 1, "field1": 2.5}))
+    assert decoded == {"entry_id": 1, "field1": 2.5}
+
+
+def test_binary_sensor_values_through_parse_float():
+    decoded = decode(encode(ENTRY), parse_float=Decimal)
+    assert decoded["field4"] == Decimal("59.5")
+    assert decoded["field6"] == Decimal("29.88")
+
+
+def test_binary_keeps_infinity_and_drops_nan():
+    decoded = decode(encode({"entry_id": 1, "field1": "inf", "field2": "nan"}))
+    assert decoded == {"entry_id": 1, "field1": math.inf}
+
+
+@pytest.mark.parametrize("record", [
+    {"entry_id": 1, "field1": "n/a"},          # non-numeric reading
+    {"entry_id": 1, "note": "hello"},          # key outside the schema
+    {"field1": "1"},                           # no entry_id
+    {"entry_id": 2 ** 64},                     # does not fit an int64
+    {"entry_id": 1, "created_at": "yesterday"},
+])
+def test_records_outside_the_schema_fall_back_to_json(record, parser):
+    assert encode_binary(record) is None
+    payload = encode(record)
+    assert payload[0] == HEADER_JSON
+    assert decode(payload) == record
+
+
+def test_json_encoding(parser):
+    payload = encode(ENTRY, "json")
+    assert payload == json.dumps(ENTRY).encode()
+    assert decode(payload) == ENTRY
+
+
+def test_json_floats_through_parse_float(parser):
+    assert decode(b'{"entry_id": 1, "field4": 59.5}', parse_float=Decimal) == {
+        "entry_id": 1, "field4": Decimal("59.5")}
+
+
+@pytest.mark.parametrize("payload", [b' {"entry_id": 1}', b'\n\t{"entry_id": 1}', b'\r\n{"entry_id": 1}'])
+def test_json_led_by_whitespace(payload, parser):
+    assert decode(payload) == {"entry_id": 1}
+    assert decode(memoryview(payload)) == {"entry_id": 1}
+
+
+def test_unknown_encoding_name():
+    with pytest.raises(ValueError):
+        encode(ENTRY, "avro")
+
+
+@pytest.mark.parametrize("payload", [
+    b"",                                     # empty
+    b"\x02" + bytes(40),                     # unknown version
+    b"\x01\x00\x01",                         # truncated header
+    encode(ENTRY)[:-3],                      # truncated stamp
+    b"{not json",
+])
+def test_malformed_payloads_raise_value_error(payload, parser):
+    with pytest.raises(ValueError):
+        decode(payload)
@@ -0,0 +1,106 @@
+import pytest
+
+from pipeline_common import dedupe
+from pipeline_common.dedupe import EntryIdFilter, TTLSeenSet
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(dedupe, "time", fake)
+    return fake
+
+
+def test_filter_drops_repeats_within_the_window():
+    ids = EntryIdFilter(window=5)
+    assert [ids.accept(i) for i in (10, 11, 10, 12, 11)] == [True, True, False, True, False]
+    assert ids.high_water == 12
+    # Below the mark but inside the window, and never seen: a late arrival, still sent
+    assert ids.accept(9) is True
+    assert (ids.stats.passed, ids.stats.dropped) == (4, 2)
+
+
+def test_filter_drops_everything_a_window_below_the_high_water_mark():
+    ids = EntryIdFilter(window=3)
+    assert ids.accept(100)
+    # 97 is the window's size below the mark, so it is assumed sent already
+    assert not ids.accept(97)
+    assert ids.accept(98)
+
+
+def test_filter_forgets_the_oldest_ids_beyond_the_window():
+    ids = EntryIdFilter(window=3)
+    for i in (1, 2, 3, 4):
+        assert ids.accept(i)
+    assert list(ids.recent) == [2, 3, 4]
+    # 1 fell out of the LRU but is a window below the mark
+    assert not ids.accept(1)
+    assert not ids.accept(2)
+
+
+def test_filter_accepts_entries_without_an_id():
+    ids = EntryIdFilter(window=3)
+    assert ids.accept(None)
+    assert ids.accept(None)
+    assert ids.high_water is None and not ids.recent
+    assert ids.accept(5) and not ids.accept(5)
+
+
+def test_sizes_are_measured_only_for_dropped_entries():
+    measured = []
+
+    def size(entry_id):
+        return lambda: measured.append(entry_id) or 100
+
+    ids = EntryIdFilter()
+    for entry_id in (1, 2, 1, 3, 2):
+        ids.accept(entry_id, size(entry_id))
+    assert measured == [1, 2]
+    assert ids.stats.as_dict() == {"passed": 3, "dropped": 2, "bytes_saved": 200}
+    ids.accept(1, 50)
+    assert ids.stats.bytes_saved == 250
+
+
+def test_seen_set_expires_keys_after_the_ttl(clock):
+    seen = TTLSeenSet(capacity=10, ttl_seconds=60)
+    seen.add("a")
+    clock.now += 30
+    seen.add("b")
+    assert seen.check("a", 10) and seen.check("b")
+
+    clock.now += 31
+    assert "a" not in seen
+    assert "b" in seen
+    assert not seen.check("a")
+    assert seen.stats.as_dict() == {"passed": 1, "dropped": 2, "bytes_saved": 10}
+
+    # Expired keys at the front are evicted by the next add
+    clock.now += 60
+    seen.add("c")
+    assert list(seen.entries) == ["c"]
+
+
+def test_seen_set_evicts_the_least_recently_added_beyond_capacity(clock):
+    seen = TTLSeenSet(capacity=3, ttl_seconds=60)
+    for key in "abc":
+        seen.add(key)
+    # Adding "a" again refreshes it, so "b" is now the oldest
+    seen.add("a")
+    seen.add("d")
+    assert list(seen.entries) == ["c", "a", "d"]
+    assert "b" not in seen
+
+    # A refreshed key lives a full TTL from its last add
+    clock.now += 59
+    seen.add("c")
+    clock.now += 2
+    assert "a" not in seen and "d" not in seen
+    assert "c" in seen
@@ -0,0 +1,251 @@
+import os
+import threading
+import time
+
+import pytest
+
+from kafka_producer import _FRAME, SegmentLog, SpillingProducer
+
+
+class FakeMessage:
+    def __init__(self, key, value):
+        self._key = key
+        self._value = value
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+
+class FakeProducer:
+    """
+    Accepts messages until `full`; delivery callbacks run only when the
+    test calls `deliver`, from `poll` on the producer's delivery thread.
+    """
+
+    def __init__(self):
+        self.full = False
+        self.sent = []
+        self._callbacks = []
+        self._results = []
+        self._lock = threading.Lock()
+
+    def produce(self, topic, key=None, value=None, on_delivery=None):
+        if self.full:
+            raise BufferError("Local: Queue full")
+        with self._lock:
+            self.sent.append(value)
+            self._callbacks.append((FakeMessage(key, value), on_delivery))
+
+    def deliver(self, count=None, err=None):
+        """Acknowledges the oldest `count` messages sent (all by default)."""
+        with self._lock:
+            count = len(self._callbacks) if count is None else count
+            delivered, self._callbacks = self._callbacks[:count], self._callbacks[count:]
+            self._results.extend((err, msg, callback) for msg, callback in delivered)
+
+    def poll(self, timeout):
+        with self._lock:
+            results, self._results = self._results, []
+        for err, msg, callback in results:
+            callback(err, msg)
+        if not results:
+            time.sleep(min(timeout, 0.001))
+        return len(results)
+
+    def flush(self, timeout=None):
+        return 0
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def read_all(log):
+    """Reads every record, returning (position, value) pairs."""
+    records = []
+    while True:
+        record = log.peek()
+        if record is None:
+            return records
+        records.append((log.position, record[1]))
+        log.advance()
+
+
+def cursor(directory):
+    with open(os.path.join(directory, "cursor")) as f:
+        return [tuple(int(part) for part in line.split()) for line in f if line.strip()]
+
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("segment-"))
+
+
+def test_buffer_error_spills_and_replays_in_order(tmp_path):
+    fake = FakeProducer()
+    producer = SpillingProducer(fake, "iot-data", str(tmp_path), max_in_flight=100, poll_interval_seconds=0.001)
+    try:
+        producer.produce(b"k", b"0")
+        fake.full = True
+        for i in range(1, 5):
+            producer.produce(b"k", str(i).encode())
+        assert producer.spilled == 4
+        fake.full = False
+        # Queued behind the spilled ones, although librdkafka has room again
+        producer.produce(b"k", b"5")
+        assert producer.spilled == 5
+
+        wait_for(lambda: len(fake.sent) == 6)
+        assert fake.sent == [str(i).encode() for i in range(6)]
+        assert producer.replayed == 5
+        fake.deliver()
+        assert producer.flush(timeout=5)
+    finally:
+        producer.close(timeout=5)
+    assert segment_files(tmp_path) == []
+
+
+def test_failed_delivery_is_spilled_and_sent_again(tmp_path):
+    fake = FakeProducer()
+    delivered = []
+    producer = SpillingProducer(fake, "iot-data", str(tmp_path), poll_interval_seconds=0.001,
+                                on_delivery=lambda err, msg: delivered.append((err, msg.value())))
+    try:
+        producer.produce(b"k", b"a")
+        fake.deliver(err="broker down")
+        wait_for(lambda: len(fake.sent) == 2)
+        assert fake.sent == [b"a", b"a"]
+        fake.deliver()
+        assert producer.flush(timeout=5)
+        assert delivered == [("broker down", b"a"), (None, b"a")]
+    finally:
+        producer.close(timeout=5)
+
+
+def test_out_of_order_acks_move_the_cursor_to_the_oldest_unacked(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=4096)
+    for i in range(4):
+        log.append(b"k", str(i).encode())
+    (p0, _), (p1, _), (p2, _), (p3, _) = read_all(log)
+
+    log.ack(p1)
+    log.ack(p3)
+    log.commit()
+    assert cursor(tmp_path) == [p0, p1, p3]
+    assert log.unacked() == 4
+
+    log.ack(p0)
+    log.commit()
+    assert cursor(tmp_path) == [p2, p3]
+    assert log.unacked() == 2
+
+    log.ack(p2)
+    log.commit()
+    assert cursor(tmp_path) == [log.position]
+    assert log.unacked() == 0
+
+
+def test_restart_replays_exactly_the_unacked_records(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=64)
+    for i in range(6):
+        log.append(b"k", str(i).encode())
+    positions = [position for position, _value in read_all(log)]
+    for i in (0, 2, 3):
+        log.ack(positions[i])
+    log.commit()
+    # A crash: the log is never closed
+    log.writer.flush()
+    del log
+
+    restarted = SegmentLog(str(tmp_path), segment_bytes=64)
+    assert [value for _position, value in read_all(restarted)] == [b"1", b"4", b"5"]
+    for position, _value in read_all(restarted):
+        restarted.ack(position)
+
+    # Records appended after the restart come after the replayed ones
+    restarted.append(b"k", b"6")
+    assert [value for _position, value in read_all(restarted)] == [b"6"]
+
+
+def test_restart_after_a_second_crash_still_skips_acked_records(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=64)
+    for i in range(3):
+        log.append(b"k", str(i).encode())
+    positions = [position for position, _value in read_all(log)]
+    log.ack(positions[2])
+    log.commit()
+    del log
+
+    # Crashes again before it reads anything
+    restarted = SegmentLog(str(tmp_path), segment_bytes=64)
+    restarted.commit()
+    del restarted
+
+    again = SegmentLog(str(tmp_path), segment_bytes=64)
+    assert [value for _position, value in read_all(again)] == [b"0", b"1"]
+
+
+def test_corrupt_frame_is_skipped(tmp_path, caplog):
+    log = SegmentLog(str(tmp_path), segment_bytes=4096)
+    for value in (b"first", b"second", b"third"):
+        log.append(b"k", value)
+    second = _FRAME.size + 1 + len(b"first")
+    # Flip a byte of the second record's value
+    log.writer[second + _FRAME.size + 2] ^= 0xFF
+
+    assert [value for _position, value in read_all(log)] == [b"first", b"third"]
+    assert "Corrupt record" in caplog.text
+    assert log.empty()
+
+
+def test_torn_tail_is_dropped_on_restart(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=4096)
+    log.append(b"k", b"whole")
+    torn = log.write_offset
+    log.append(b"k", b"torn")
+    # The crash hit after the header, before the payload
+    log.writer[torn + _FRAME.size:log.write_offset] = bytes(log.write_offset - torn - _FRAME.size)
+    log.writer.flush()
+    del log
+
+    restarted = SegmentLog(str(tmp_path), segment_bytes=4096)
+    assert [value for _position, value in read_all(restarted)] == [b"whole"]
+    restarted.append(b"k", b"after")
+    assert [value for _position, value in read_all(restarted)] == [b"after"]
+
+
+def test_segments_are_deleted_only_after_the_cursor_passes_them(tmp_path):
+    # One record per segment
+    log = SegmentLog(str(tmp_path), segment_bytes=_FRAME.size + 12)
+    for i in range(3):
+        log.append(b"k", b"record-%d" % i)
+    assert len(segment_files(tmp_path)) == 3
+    (p0, _), (p1, _), (p2, _) = read_all(log)
+
+    # Read past, but not acknowledged: the files stay
+    log.commit()
+    assert len(segment_files(tmp_path)) == 3
+
+    log.ack(p1)
+    log.commit()
+    assert len(segment_files(tmp_path)) == 3
+
+    log.ack(p0)
+    log.commit()
+    # The cursor is in the third segment now
+    assert segment_files(tmp_path) == [f"segment-{p2[0]:012d}.log"]
+
+    log.ack(p2)
+    log.close()
+    assert segment_files(tmp_path) == []
+
+
+def test_record_larger_than_a_segment_is_rejected(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=64)
+    with pytest.raises(ValueError):
+        log.append(b"k", b"x" * 64)
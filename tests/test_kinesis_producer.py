@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import Counter
+
+from kinesis_producer import KinesisBatchProducer
+from pipeline_common.aggregation import deaggregate
+
+
+class FakeKinesis:
+    """
+    Accepts PutRecords entries, rejecting each record the first
+    `fail_times(data)` times it is sent, and tracks concurrent calls.
+    """
+
+    def __init__(self, fail_times=lambda data: 0, call_errors=0, call_seconds=0.0):
+        self.fail_times = fail_times
+        self.call_errors = call_errors
+        self.call_seconds = call_seconds
+        self.accepted = []
+        self.calls = []
+        self.concurrent = 0
+        self.max_concurrent = 0
+        self._rejected = Counter()
+        self._lock = threading.Lock()
+
+    def put_records(self, StreamName, Records):
+        with self._lock:
+            self.concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self.concurrent)
+            self.calls.append([record["Data"] for record in Records])
+            error = self.call_errors > 0
+            self.call_errors -= error
+        try:
+            time.sleep(self.call_seconds)
+            if error:
+                raise ConnectionError("connection reset")
+            results = []
+            with self._lock:
+                for record in Records:
+                    data = record["Data"]
+                    if self._rejected[data] < self.fail_times(data):
+                        self._rejected[data] += 1
+                        results.append({"ErrorCode": "ProvisionedThroughputExceededException",
+                                        "ErrorMessage": "Rate exceeded"})
+                    else:
+                        self.accepted.append(data)
+                        results.append({"SequenceNumber": str(len(self.accepted)), "ShardId": "shardId-0"})
+            return {"FailedRecordCount": sum("ErrorCode" in r for r in results), "Records": results}
+        finally:
+            with self._lock:
+                self.concurrent -= 1
+
+
+def records(n):
+    return [b"record-%d" % i for i in range(n)]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_partially_failed_calls_send_every_record_exactly_once():
+    # Every third record is rejected once, every seventh twice
+    fake = FakeKinesis(fail_times=lambda data: (int(data[7:]) % 3 == 0) + (int(data[7:]) % 7 == 0),
+                       call_seconds=0.002)
+    producer = KinesisBatchProducer(fake, "stream", max_batch_records=50, max_in_flight=3,
+                                    base_backoff_seconds=0)
+    data = records(1000)
+    for i, payload in enumerate(data):
+        producer.put(payload, str(i))
+    producer.close()
+
+    assert Counter(fake.accepted) == Counter(data)
+    assert (producer.records_sent, producer.records_failed) == (1000, 0)
+    # Retries carry only the rejected entries
+    rejections = sum((i % 3 == 0) + (i % 7 == 0) for i in range(1000))
+    assert sum(len(call) for call in fake.calls) == 1000 + rejections
+    assert all(len(call) <= 50 for call in fake.calls)
+    assert fake.max_concurrent <= 3
+
+
+def test_records_rejected_on_every_attempt_are_counted_as_failed():
+    always = {b"record-3", b"record-8"}
+    fake = FakeKinesis(fail_times=lambda data: 10 if data in always else 0)
+    producer = KinesisBatchProducer(fake, "stream", max_attempts=3, base_backoff_seconds=0)
+    for i, payload in enumerate(records(10)):
+        producer.put(payload, str(i))
+    producer.close()
+
+    assert Counter(fake.accepted) == Counter(set(records(10)) - always)
+    assert (producer.records_sent, producer.records_failed) == (8, 2)
+    assert [len(call) for call in fake.calls] == [10, 2, 2]
+
+
+def test_failed_call_is_retried_whole():
+    fake = FakeKinesis(call_errors=2)
+    producer = KinesisBatchProducer(fake, "stream", base_backoff_seconds=0)
+    for i, payload in enumerate(records(5)):
+        producer.put(payload, str(i))
+    producer.close()
+
+    assert fake.accepted == records(5)
+    assert len(fake.calls) == 3
+    assert producer.records_sent == 5
+
+
+def test_partial_batch_is_sent_once_it_is_old_enough():
+    fake = FakeKinesis()
+    producer = KinesisBatchProducer(fake, "stream", max_batch_age_ms=20)
+    try:
+        started = time.monotonic()
+        for i, payload in enumerate(records(3)):
+            producer.put(payload, str(i))
+        # No flush: the linger thread dispatches it
+        wait_for(lambda: len(fake.accepted) == 3)
+        assert time.monotonic() - started >= 0.02
+        assert fake.calls == [records(3)]
+    finally:
+        producer.close()
+    assert len(fake.calls) == 1
+
+
+def test_in_flight_calls_are_bounded():
+    fake = FakeKinesis(call_seconds=0.01)
+    producer = KinesisBatchProducer(fake, "stream", max_batch_records=10, max_in_flight=2)
+    for i, payload in enumerate(records(200)):
+        producer.put(payload, str(i))
+    producer.close()
+
+    assert fake.max_concurrent == 2
+    assert Counter(fake.accepted) == Counter(records(200))
+
+
+def test_rejected_aggregates_are_resent_once():
+    # Aggregates of odd length are rejected on their first attempt
+    fake = FakeKinesis(fail_times=lambda data: len(data) % 2)
+    producer = KinesisBatchProducer(fake, "stream", max_batch_records=5, aggregate_bytes=1024,
+                                    base_backoff_seconds=0)
+    data = records(500)
+    for i, payload in enumerate(data):
+        producer.put(payload, str(i % 10))
+    producer.close()
+
+    assert len(fake.accepted) < len(data)
+    assert sum(len(call) for call in fake.calls) > len(fake.accepted)
+    assert Counter(record for payload in fake.accepted for _key, record in deaggregate(payload)) == Counter(data)
+    # Counts are in user records
+    assert (producer.records_sent, producer.records_failed) == (500, 0)
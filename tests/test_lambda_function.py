@@ -0,0 +1,109 @@
+import base64
+import hashlib
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+import lambda_function
+from pipeline_common.aggregation import MAGIC, aggregate
+
+# Entries DynamoDB rejects, as it would an item over 400 KB
+INVALID_ENTRY = "13"
+
+
+class FakeDynamoDB:
+    def __init__(self, throttled=()):
+        self.items = {}
+        self.throttled = set(throttled)
+
+    @staticmethod
+    def _check(item, operation):
+        if item["entry_id"]["N"] == INVALID_ENTRY:
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": "Item too large"}}, operation)
+
+    def batch_write_item(self, RequestItems):
+        (table, requests), = RequestItems.items()
+        for request in requests:
+            self._check(request["PutRequest"]["Item"], "BatchWriteItem")
+        unprocessed = []
+        for request in requests:
+            item = request["PutRequest"]["Item"]
+            if item["entry_id"]["N"] in self.throttled:
+                unprocessed.append(request)
+            else:
+                self.items[item["entry_id"]["N"]] = item
+        return {"UnprocessedItems": {table: unprocessed} if unprocessed else {}}
+
+    def put_item(self, TableName, Item):
+        self._check(Item, "PutItem")
+        self.items[Item["entry_id"]["N"]] = Item
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    monkeypatch.setattr(lambda_function, "BASE_BACKOFF_SECONDS", 0)
+    monkeypatch.setattr(lambda_function, "written_entries", lambda_function.TTLSeenSet())
+    # Sampling starts over, so each test sees the first record-level error logged
+    monkeypatch.setattr(lambda_function, "error_log", lambda_function.SampledLog(print, every=100))
+    fake = FakeDynamoDB()
+    monkeypatch.setattr(lambda_function, "dynamodb", fake)
+    return fake
+
+
+def kinesis_event(payloads):
+    return {"Records": [{
+        "kinesis": {
+            "data": base64.b64encode(payload).decode("ascii"),
+            "sequenceNumber": str(i),
+            "approximateArrivalTimestamp": 1745000000.0,
+        },
+    } for i, payload in enumerate(payloads)]}
+
+
+def entry(entry_id):
+    return json.dumps({"entry_id": entry_id, "field1": "21.5", "created_at": "2025-04-18T12:00:00Z"}).encode()
+
+
+def test_permanent_errors_are_skipped_not_retried(dynamodb, capsys):
+    event = kinesis_event([entry(1), b"{not json", json.dumps({"field1": "1"}).encode(),
+                           entry(int(INVALID_ENTRY)), entry(5)])
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response == {"batchItemFailures": []}
+    assert sorted(dynamodb.items) == ["1", "5"]
+    output = capsys.readouterr().out.strip().splitlines()
+    # Three record-level errors, but one log line: the rest are counted, not logged
+    logged = [line for line in output if line.startswith("Skipping")]
+    assert len(logged) == 1 and logged[0].startswith("Skipping undecodable record 1:")
+    metrics = json.loads(output[-1])
+    assert metrics["Skipped"] == 3
+    assert metrics["Failed"] == 0
+    assert metrics["Inserted"] == 2
+
+
+def test_transient_failures_are_reported(dynamodb):
+    dynamodb.throttled = {"2"}
+    response = lambda_function.lambda_handler(kinesis_event([entry(1), entry(2)]), None)
+    assert response == {"batchItemFailures": [{"itemIdentifier": "1"}]}
+    assert sorted(dynamodb.items) == ["1"]
+
+
+def test_malformed_aggregate_is_skipped(dynamodb, capsys):
+    # Valid checksum, but the records field runs past the message
+    message = b"\x0a\x01k\x1a\x05\x08\x00"
+    (_key, good, _count), = aggregate([("1", entry(1)), ("2", entry(2))])
+    malformed = MAGIC + message + hashlib.md5(message).digest()
+    event = kinesis_event([malformed, good, malformed])
+    response = lambda_function.lambda_handler(event, None)
+
+    assert response == {"batchItemFailures": []}
+    assert sorted(dynamodb.items) == ["1", "2"]
+    output = capsys.readouterr().out.strip().splitlines()
+    # Logged for the first one only; both are counted
+    assert [line.split(":")[0] for line in output if line.startswith("Skipping")] == [
+        "Skipping malformed aggregated record 0"]
+    metrics = json.loads(output[-1])
+    assert metrics["Skipped"] == 2
+    assert metrics["KinesisRecords"] == 3
+    assert metrics["Records"] == 2
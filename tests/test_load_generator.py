@@ -0,0 +1,24 @@
+import csv
+from datetime import datetime, timezone
+
+from pipeline_common.load_generator import replay_source
+from pipeline_common.thingspeak import parse_created_at
+
+
+def test_replay_offers_records_as_new_events(tmp_path):
+    path = tmp_path / "AWS_result.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["entry_id", "created_at", "temperature_fahrenheit"])
+        writer.writerow(["100", "2025-05-06T19:26:47Z", "59.5"])
+        writer.writerow(["101", "2025-05-06T19:56:47Z", "60.0"])
+    make = replay_source([str(path)])
+
+    start = datetime(2026, 10, 18, 12, 0, 0, tzinfo=timezone.utc).timestamp()
+    records = [make(start + i * 0.5) for i in range(5)]
+
+    assert [record["entry_id"] for record in records] == [100, 101, 102, 103, 104]
+    assert [record["field4"] for record in records] == ["59.5", "60.0", "59.5", "60.0", "59.5"]
+    # Event time is when the record is offered, not when it was first recorded
+    assert [parse_created_at(record["created_at"]).timestamp() - start for record in records] == [
+        0.0, 0.0, 1.0, 1.0, 2.0]
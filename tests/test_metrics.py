@@ -0,0 +1,146 @@
+import json
+import pickle
+import random
+import threading
+
+import pytest
+
+from pipeline_common.metrics import (EXPORT_BOUNDS, Histogram, Registry, SampledLog, _bucket_bounds,
+                                     _bucket_index, emf_line)
+
+
+@pytest.mark.parametrize("value, bounds", [
+    (0, (0, 0)),
+    (127, (127, 127)),
+    (128, (128, 129)),
+    (255, (254, 255)),
+    (256, (256, 259)),
+    (1000, (1000, 1007)),
+    (1_000_000, (999_424, 1_007_615)),
+])
+def test_bucket_bounds(value, bounds):
+    assert _bucket_bounds(_bucket_index(value)) == bounds
+
+
+def test_buckets_tile_the_values_within_1_in_64():
+    previous_high = -1
+    for index in range(_bucket_index(1 << 24) + 1):
+        low, high = _bucket_bounds(index)
+        # Contiguous: no gaps, no overlaps
+        assert low == previous_high + 1
+        assert _bucket_index(low) == _bucket_index(high) == index
+        assert high - low + 1 <= max(low / 64, 1)
+        previous_high = high
+
+
+def test_quantiles_are_within_the_bucket_error():
+    rng = random.Random(7)
+    values = [int(rng.lognormvariate(9, 1.5)) + 100 for _ in range(20000)]
+    histogram = Histogram()
+    for value in values:
+        histogram.record_us(value)
+    ordered = sorted(values)
+    for q in (0.5, 0.9, 0.95, 0.99, 0.999):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert abs(histogram.quantile(q) * 1_000_000 - exact) <= exact / 64
+    assert histogram.quantile(0.0) * 1_000_000 == pytest.approx(ordered[0], rel=1 / 64)
+    assert histogram.quantile(1.0) * 1_000_000 == pytest.approx(ordered[-1], rel=1 / 64)
+
+
+def test_histogram_counts_and_merge():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) != histogram.quantile(0.5)  # NaN while empty
+    histogram.record_us(2000, count=3)
+    histogram.observe(0.3)
+    assert (histogram.count, histogram.total_us, histogram.min_us, histogram.max_us) == (4, 306000, 2000, 300000)
+
+    merged = Histogram()
+    merged.merge(histogram)
+    assert merged.count == 4
+    assert merged.quantile(0.5) == pytest.approx(0.002, rel=1 / 64)
+    assert merged.cumulative(EXPORT_BOUNDS) == histogram.cumulative(EXPORT_BOUNDS)
+
+
+def test_openmetrics_text():
+    registry = Registry()
+    registry.counter("records", stage="produce").inc(3)
+    registry.counter("records", stage="send").inc()
+    registry.gauge("lag", partition=0).set(1.5)
+    histogram = registry.histogram("stage_seconds", stage="encode")
+    histogram.observe(0.002)
+    histogram.observe(0.002)
+    histogram.observe(0.3)
+
+    lines = registry.openmetrics().splitlines()
+    assert lines[:6] == [
+        "# TYPE lag gauge",
+        'lag{partition="0"} 1.5',
+        "# TYPE records counter",
+        'records_total{stage="produce"} 3',
+        'records_total{stage="send"} 1',
+        "# TYPE stage_seconds histogram",
+    ]
+    buckets = lines[6:6 + len(EXPORT_BOUNDS) + 1]
+    assert buckets[3] == 'stage_seconds_bucket{stage="encode",le="0.001"} 0'
+    assert buckets[4] == 'stage_seconds_bucket{stage="encode",le="0.0025"} 2'
+    assert buckets[11] == 'stage_seconds_bucket{stage="encode",le="0.5"} 3'
+    assert buckets[-1] == 'stage_seconds_bucket{stage="encode",le="+Inf"} 3'
+    assert lines[-3:] == [
+        'stage_seconds_sum{stage="encode"} 0.304',
+        'stage_seconds_count{stage="encode"} 3',
+        "# EOF",
+    ]
+    # Every bucket line is cumulative
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts)
+
+
+def test_emf_line_shape():
+    document = json.loads(emf_line("DataPipeline", {"Stage": "lambda"}, {"Records": 10, "WriteMs": 1.5},
+                                   units={"WriteMs": "Milliseconds"}))
+    assert document["Stage"] == "lambda"
+    assert (document["Records"], document["WriteMs"]) == (10, 1.5)
+    aws = document["_aws"]
+    assert isinstance(aws["Timestamp"], int)
+    assert aws["CloudWatchMetrics"] == [{
+        "Namespace": "DataPipeline",
+        "Dimensions": [["Stage"]],
+        "Metrics": [{"Name": "Records", "Unit": "None"}, {"Name": "WriteMs", "Unit": "Milliseconds"}],
+    }]
+
+
+def test_sampled_log_emits_one_in_every():
+    logged = []
+    formatted = []
+    log = SampledLog(logged.append, every=3)
+    for i in range(7):
+        log(lambda i=i: formatted.append(i) or f"message {i}")
+    assert logged == ["message 0", "message 3", "message 6"]
+    # Skipped calls never format their message
+    assert formatted == [0, 3, 6]
+
+
+def test_sampled_log_counts_every_call_across_threads():
+    logged = []
+    log = SampledLog(logged.append, every=100)
+
+    def worker():
+        for _ in range(10000):
+            log(lambda: "message")
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert log.calls == 80000
+    assert len(logged) == 800
+
+
+def test_sampled_log_pickles():
+    log = SampledLog(print, every=5)
+    log(lambda: "first")
+    copy = pickle.loads(pickle.dumps(log))
+    assert (copy.calls, copy.every) == (1, 5)
+    copy(lambda: "second")
+    assert copy.calls == 2
@@ -0,0 +1,97 @@
+import json
+import math
+import time
+from decimal import Decimal
+
+import pytest
+
+from pipeline_common.codec import encode
+from pipeline_common.normalize import normalize_batch, normalize_record
+
+RAW = {
+    "entry_id": "5440826",
+    "created_at": "2025-05-06T19:26:47Z",
+    "field1": "37", "field4": "59.5", "field8": "",
+    "ec2_timestamp": "2025-05-06T20:44:38.512000Z",
+    "scheduled_timestamp": 1746559607000,
+    "kafka_offset": 12,
+}
+
+
+class FakeClock:
+    def __init__(self, stamp):
+        self.stamp = stamp
+
+    def now(self):
+        return self.stamp
+
+
+def test_record():
+    assert normalize_record(RAW) == {
+        "entry_id": 5440826,
+        "created_at": "2025-05-06T19:26:47Z",
+        "wind_direction": 37.0,
+        "temperature_fahrenheit": 59.5,
+        "ec2_timestamp": 1746564278512,
+        "scheduled_timestamp": 1746559607000,
+    }
+
+
+def test_decimal_keeps_the_text_of_the_reading():
+    record = normalize_record({"entry_id": 1, "field6": "29.88", "field7": 4.13}, number=Decimal)
+    assert record["pressure_inhg"] == Decimal("29.88")
+    # A float is converted through its repr, not its binary value
+    assert record["power_level_volts"] == Decimal("4.13")
+
+    floats = normalize_record({"entry_id": 1, "field6": "29.88"})
+    assert floats["pressure_inhg"] == 29.88
+    assert type(floats["pressure_inhg"]) is float
+
+
+@pytest.mark.parametrize("number", [float, Decimal])
+def test_nan_is_dropped_and_infinity_kept(number):
+    record = normalize_record({"entry_id": 1, "field1": "NaN", "field2": math.nan, "field3": "inf",
+                               "field5": "n/a"}, number=number)
+    assert record == {"entry_id": 1, "humidity_percent": number("inf")}
+
+
+def test_missing_entry_id_is_rejected():
+    with pytest.raises(KeyError):
+        normalize_record({"field1": "1"})
+    with pytest.raises(KeyError):
+        normalize_record({"entry_id": None, "field1": "1"})
+
+
+def test_batch_maps_errors_to_their_index():
+    payloads = [
+        encode({"entry_id": 1, "field1": "1"}),
+        b"\x02not a record",
+        json.dumps({"field1": "2"}).encode(),
+        json.dumps({"entry_id": 4, "ec2_timestamp": "yesterday"}).encode(),
+        encode({"entry_id": 5, "field2": "3.5"}, "json"),
+    ]
+    before = time.time_ns() // 1_000_000
+    records, errors = normalize_batch(payloads, [100, 200, 300, 400, 500], "kinesis_timestamp", "lambda_timestamp")
+    after = time.time_ns() // 1_000_000
+
+    assert [record is None for record in records] == [False, True, True, True, False]
+    assert sorted(errors) == [1, 2, 3]
+    assert isinstance(errors[1], ValueError)
+    assert isinstance(errors[2], KeyError)
+    assert isinstance(errors[3], ValueError)
+
+    first, last = records[0], records[4]
+    assert first["wind_direction"] == 1.0 and last["wind_speed"] == 3.5
+    assert (first["kinesis_timestamp"], last["kinesis_timestamp"]) == (100, 500)
+    # One processing time for the whole batch
+    assert before <= first["lambda_timestamp"] == last["lambda_timestamp"] <= after
+
+
+def test_batch_adds_the_clock_stamp_once_synced():
+    payloads = [encode({"entry_id": 1})]
+    records, _ = normalize_batch(payloads, [0], "kafka_timestamp", "beam_timestamp", clock=FakeClock((123, 4)))
+    assert records[0]["beam_ref_us"] == 123
+    assert records[0]["beam_error_us"] == 4
+
+    records, _ = normalize_batch(payloads, [0], "kafka_timestamp", "beam_timestamp", clock=FakeClock(None))
+    assert "beam_ref_us" not in records[0]
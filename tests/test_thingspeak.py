@@ -0,0 +1,123 @@
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pipeline_common import thingspeak
+from pipeline_common.thingspeak import CREATED_AT_FORMAT, QUERY_TIME_FORMAT, ThingSpeakFetcher
+
+T0 = datetime(2025, 5, 6, 12, 0, 0, tzinfo=timezone.utc)
+# Entries per response, in place of ThingSpeak's 8000
+CAP = 10
+
+
+class FakeResponse:
+    def __init__(self, feeds):
+        self.feeds = feeds
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"channel": {"id": 12397}, "feeds": self.feeds}
+
+
+class FakeSession:
+    """Serves the first `results` entries created in [start, end], like the feeds endpoint."""
+
+    def __init__(self, entries, jitter_seconds=0.0):
+        self.entries = entries
+        self.jitter_seconds = jitter_seconds
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        start = datetime.strptime(params["start"], QUERY_TIME_FORMAT).replace(tzinfo=timezone.utc)
+        end = datetime.strptime(params["end"], QUERY_TIME_FORMAT).replace(tzinfo=timezone.utc)
+        with self._lock:
+            self.requests.append((start, end))
+        if self.jitter_seconds:
+            time.sleep(random.uniform(0, self.jitter_seconds))
+        feeds = [entry for entry in self.entries
+                 if start <= datetime.strptime(entry["created_at"], CREATED_AT_FORMAT).replace(tzinfo=timezone.utc) <= end]
+        return FakeResponse(feeds[:params["results"]])
+
+    def close(self):
+        pass
+
+
+def entries(seconds, per_second=1):
+    out = []
+    for s in range(seconds):
+        for _ in range(per_second):
+            out.append({"entry_id": len(out) + 1, "created_at": (T0 + timedelta(seconds=s)).strftime(CREATED_AT_FORMAT),
+                        "field1": "21.5"})
+    return out
+
+
+@pytest.fixture
+def fetcher(monkeypatch):
+    monkeypatch.setattr(thingspeak, "MAX_RESULTS", CAP)
+    fetcher = ThingSpeakFetcher(requests_per_second=0)
+    yield fetcher
+    fetcher.close()
+
+
+def test_range_under_a_full_page_is_one_request(fetcher):
+    fetcher.session = FakeSession(entries(CAP - 1))
+    assert len(fetcher.fetch_range(T0, T0 + timedelta(hours=1))) == CAP - 1
+    assert len(fetcher.session.requests) == 1
+
+
+def test_full_page_is_split_until_every_entry_is_read(fetcher):
+    all_entries = entries(25)
+    fetcher.session = FakeSession(all_entries)
+    feeds = fetcher.fetch_range(T0, T0 + timedelta(seconds=24))
+
+    assert feeds == all_entries
+    requests = fetcher.session.requests
+    assert requests[0] == (T0, T0 + timedelta(seconds=24))
+    # Halves are whole seconds and neither overlap nor leave a gap
+    assert requests[1] == (T0, T0 + timedelta(seconds=12))
+    assert (T0 + timedelta(seconds=13), T0 + timedelta(seconds=24)) in requests
+
+
+def test_full_page_within_two_seconds_is_not_split(fetcher):
+    # More entries in one second than a page holds: the API cannot page them
+    fetcher.session = FakeSession(entries(1, per_second=CAP + 5))
+    feeds = fetcher.fetch_range(T0, T0 + timedelta(seconds=1))
+    assert len(feeds) == CAP
+    assert len(fetcher.session.requests) == 1
+
+
+def test_backfill_yields_pages_in_order_without_repeats(fetcher):
+    all_entries = entries(160)
+    # Requests finish out of order
+    fetcher.session = FakeSession(all_entries, jitter_seconds=0.005)
+    pages = list(fetcher.backfill(T0, T0 + timedelta(seconds=159), page=timedelta(seconds=8), concurrency=4))
+
+    assert len(pages) == 20
+    assert [entry for page in pages for entry in page] == all_entries
+
+
+def test_backfill_reads_ahead_at_most_twice_the_concurrency(fetcher):
+    fetcher.session = FakeSession(entries(100))
+    pages = fetcher.backfill(T0, T0 + timedelta(seconds=99), page=timedelta(seconds=5), concurrency=2)
+
+    def settled(count):
+        deadline = time.monotonic() + 5
+        while len(fetcher.session.requests) < count:
+            assert time.monotonic() < deadline, "timed out"
+            time.sleep(0.001)
+        # Give any request beyond the limit the chance to show up
+        time.sleep(0.05)
+        return len(fetcher.session.requests)
+
+    assert next(pages) == entries(5)
+    assert settled(4) == 4
+    next(pages)
+    assert settled(5) == 5
+    assert sum(1 for _ in pages) == 18
+    assert settled(20) == 20